@@ -0,0 +1,46 @@
+# Copyright (c) 2017 The Regents of the University of Michigan
+# All rights reserved.
+# This software is licensed under the BSD 3-Clause License.
+"""
+Compares parsing qsub arguments with argparse, as PBSConfig.parse_args used to,
+with the single-pass parser parse_qsub_args, uncached and memoized.
+
+    python benchmarks/pbs_parse.py -n 10000
+"""
+from __future__ import print_function
+import os
+import sys
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fluid.config.pbs import PBSConfig, parse_qsub_args, parse_resource_list  # noqa: E402
+
+ARGS = "-A sglotzer_fluxoe -l nodes=2:ppn=16:gpus=2,walltime=24:00:00 -l pmem=2gb -q fluxg -V -M user@umich.edu"
+
+
+def parse_argparse(args):
+    parser = argparse.ArgumentParser()
+    PBSConfig.add_args_to_parser(parser)
+    submit_args = vars(parser.parse_args(args.split()))
+    submit_args['l'] = parse_resource_list(submit_args['l'])
+    return submit_args
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the qsub argument parsers.")
+    parser.add_argument('-n', type=int, default=10000, help="The number of calls.")
+    args = parser.parse_args()
+    candidates = [
+        ('argparse', lambda: parse_argparse(ARGS)),
+        ('parse_qsub_args', lambda: parse_qsub_args.__wrapped__(ARGS)),
+        ('parse_qsub_args (memoized)', lambda: parse_qsub_args(ARGS)),
+    ]
+    print("{:<30}{:>14}".format('parser', 'us per call'))
+    for name, func in candidates:
+        t = min(timeit.repeat(func, number=args.n, repeat=3))
+        print("{:<30}{:>14.2f}".format(name, 1e6 * t / args.n))
+
+
+if __name__ == '__main__':
+    main()
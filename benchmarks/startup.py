@@ -0,0 +1,57 @@
+# Copyright (c) 2017 The Regents of the University of Michigan
+# All rights reserved.
+# This software is licensed under the BSD 3-Clause License.
+"""
+Measures the startup latency of fluid, which is paid by every command and job
+script: the time of `python -c "import fluid"` and of resolving the project
+with get_project() and FluidProject.get_project(). Each measurement runs in a fresh interpreter.
+
+    python benchmarks/startup.py -n 20 --root path/to/signac/project
+
+Use `python -X importtime -c "import fluid"` to see where the time goes.
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+STATEMENTS = [
+    ('python', 'pass'),
+    ('import fluid', 'import fluid'),
+    ('import fluid.project', 'import fluid.project'),
+    ('get_project()', 'import fluid; fluid.get_project(root={root!r})'),
+    ('FluidProject.get_project()', 'import fluid; fluid.FluidProject.get_project(root={root!r})'),
+]
+
+
+def measure(statement, n, cwd=None):
+    times = []
+    for _ in range(n):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', statement], cwd=cwd)
+        times.append(time.time() - start)
+    times.sort()
+    return times[len(times) // 2], times[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup latency of fluid.")
+    parser.add_argument('-n', type=int, default=10, help="The number of repetitions.")
+    parser.add_argument('--root', default=os.getcwd(), help="The root directory of a signac project.")
+    args = parser.parse_args()
+    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    print("{:<28}{:>12}{:>12}".format('statement', 'median [ms]', 'min [ms]'))
+    for name, statement in STATEMENTS:
+        statement = "import sys; sys.path.insert(0, {!r}); {}".format(package, statement.format(root=args.root))
+        try:
+            median, best = measure(statement, args.n, cwd=args.root)
+        except subprocess.CalledProcessError:
+            print("{:<28}{:>12}".format(name, 'failed'))
+            continue
+        print("{:<28}{:>12.1f}{:>12.1f}".format(name, 1e3 * median, 1e3 * best))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,36 @@
+import importlib
 
-from .bundler import Bundler
-from .formatter import ScriptFormatter
-from .parameter import FluidParams
-from .project import FluidProject, FluidOperation
-from .scheduler import Scheduler
-from . import config
-from . import ipython
-import argparse
+# The submodules are imported on first access, so that a script which only needs
+# part of the package does not pay for importing signac, flow or ipywidgets.
+_submodules = (
+    'bundler', 'condition', 'config', 'formatter', 'index', 'ipython',
+    'job_filter', 'parameter', 'project', 'scheduler', 'status')
 
+_attributes = dict(
+    Bundler='bundler',
+    ScriptFormatter='formatter',
+    FluidParams='parameter',
+    FluidProject='project',
+    FluidOperation='project',
+    get_project='project',
+    Scheduler='scheduler')
 
-__all__ = ['Bundler', 'ScriptFormatter', 'FlowParams', 'FlowProject', 'FlowOperation', 'Scheduler', 'run', 'ipython']
+__all__ = ['Bundler', 'ScriptFormatter', 'FluidParams', 'FluidProject', 'FluidOperation', 'Scheduler', 'get_project', 'config', 'ipython']
+
+
+def __getattr__(name):
+    if name in _attributes:
+        value = getattr(importlib.import_module('.' + _attributes[name], __name__), name)
+    elif name in _submodules:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()).union(_attributes, _submodules))
 
 
 # class operation(object):
@@ -1,7 +1,13 @@
 # Copyright (c) 2017 The Regents of the University of Michigan
 # All rights reserved.
 # This software is licensed under the BSD 3-Clause License.
-import itertools
+import os
+import io
+import re
+import json
+import time
+import sqlite3
+from hashlib import sha1
 from . import scheduler
 from signac.common.six import with_metaclass
 import uuid
@@ -38,41 +44,56 @@ import uuid
 #             yield job
 
 class JobBundle(object):
+    """
+    A set of job-operations submitted as one scheduler job. The job-operations
+    run concurrently in lanes, a lane is a list of job-operations executed one
+    after another on nprocs processes and ngpus gpus. By default each
+    job-operation is a lane of its own with procs_per_job processes.
+    """
 
-    def __init__(self, jobops, procs_per_job=None):
+    def __init__(self, jobops, procs_per_job=None, lanes=None):
         self._job_ops = list(jobops)
         self._name = None;
         self._job_names = [];
         self._ppj = procs_per_job;
+        self._lanes = lanes
+        self._resources = None
 
     def _submit_name(self, project):
         if len(self._job_ops) == 1:
-            op, job = self._job_ops[0]
-            return "{}-{}-{}".format(job, op, project);
+            job, op = self._job_ops[0]
+            return scheduler.make_submit_name(op, job, project);
         else:
             uid = uuid.uuid4();
             return "{}-bundle-{}".format(uid, project);
 
     def dump(self, stream, hostconf, submitconf, project, **kwargs):
         assert len(self._job_ops) > 0
-        if len(self._job_ops) == 1: # just one job so we just write the operation script.
+        self._name = self._submit_name(project)
+        self._job_names = [scheduler.make_submit_name(op, job, project) for job, op in self._job_ops]
+        submitconf.write_preamble(stream, self._name)
+        stream.write('\n')
+        if self._lanes is None and len(self._job_ops) == 1: # just one job so we just write the operation script.
             job, op = self._job_ops[0]
-            self._name = self._make_submit_name(op, job, project)
-            submitconf.write_preamble(stream, self._name)
-            stream.write(op.format_header(hostconf, submitconf, project, **kwargs))
-            stream.write('\n')
-            stream.write(op.format_script(host, submission, project, job, **kwargs))
+            stream.write(op.format_script(
+                project, job, nprocs=submitconf.nprocs, ngpus=submitconf.ngpus,
+                walltime=submitconf.walltime, mpicmd=hostconf.mpi_cmd, **kwargs))
             stream.write('\n')
-        else:
-            self._name = "{project}-bundle-{hex}".format(project, hex)
-            submitconf.write_preamble(stream, self._name)
-            _, op = self._job_ops[0];
-            stream.write(op.format_header(hostconf, submitconf, project, nprocs=self._ppj, **kwargs)) #TODO: fix this.
-            stream.write('\n')
-            for job, operation in self._job_ops:
-                self._job_names(scheduler.make_submit_name(operation, job, project))
-                stream.write(op.format_script(host, submission, project, job, nprocs=self.procs_per_job, **kwargs).strip())
-                stream.write(' &\n');
+            return
+        lanes = self._lanes
+        if lanes is None:
+            lanes = [(self._ppj, None, [jobop]) for jobop in self._job_ops]
+        # each lane runs in a subshell with one command per line, so a command
+        # may end in a comment or span several lines.
+        for nprocs, ngpus, jobops in lanes:
+            stream.write('(\n')
+            for job, op in jobops:
+                stream.write(op.format_script(
+                    project, job, nprocs=nprocs, ngpus=ngpus,
+                    walltime=submitconf.walltime, mpicmd=hostconf.mpi_cmd, **kwargs).strip())
+                stream.write('\n')
+            stream.write(') &\n')
+        stream.write('wait\n')
 
     def dumps(self, hostconf, submitconf, project, **kwargs):
         stream = io.StringIO()
@@ -89,11 +110,31 @@ class JobBundle(object):
     def name(self):
         return self._name
 
-    def save(self):
-        pass
+    def save(self, registry, submitconf=None):
+        "Record the members of this bundle in registry, call after dump()."
+        self._resources = _resources(submitconf)
+        registry.register(self._name, _members(self._job_ops, self._job_names), self._resources)
+
+    def resources(self):
+        "The resources requested by the submission, known after :meth:`save` or :meth:`load`."
+        return self._resources
 
-    def load(self):
-        pass
+    def load(self, registry, name, project=None, operations=None):
+        """
+        Restore the bundle name recorded with :meth:`save`: the submit names of
+        its members and the requested resources. The job-operations are restored
+        as well if the project and the operations, a mapping of operation name
+        to operation, are given. The lanes are not recorded, so a loaded bundle
+        is not dumped with the layout it was submitted with.
+        """
+        entries = registry.entries(name)
+        self._name = name
+        self._job_names = [submit_name for submit_name, job_id, operation in entries]
+        self._resources = registry.resources(name)
+        if project is not None and operations is not None:
+            self._job_ops = [(project.open_job(id=job_id), operations[operation])
+                             for submit_name, job_id, operation in entries]
+            self._lanes = None
 
 
 class BundlerType(type):
@@ -112,7 +153,399 @@ class Bundler(with_metaclass(BundlerType)):
 
     def bundle(self, hostconf, submitconf, jobops, **kwargs):
         jobops = list(jobops);
-        total_size = len(jobops);
-        assert total_size % self._size == 0
-        for i in range(total_size/self._size):
-            yield JobBundle(itertools.islice(jobops, start=i*self._size, stop=(i+1)*self._size), procs_per_job=(submitconf.nprocs/self._size))
+        for i in range(0, len(jobops), self._size):
+            chunk = jobops[i:i+self._size]
+            ppj = submitconf.nprocs // len(chunk) if submitconf.nprocs else None
+            yield JobBundle(chunk, procs_per_job=ppj)
+
+
+class _Node(object):
+
+    def __init__(self, procs, gpus):
+        self.procs = procs
+        self.gpus = gpus
+        self.free_procs = procs
+        self.free_gpus = gpus
+
+class _Lane(object):
+
+    def __init__(self, nodes, procs, gpus):
+        self.nodes = nodes
+        self.procs = procs
+        self.gpus = gpus
+        self.time = 0
+        self.jobops = []
+
+class _Bin(object):
+    "The resources of one submission, filled with lanes of job-operations."
+
+    def __init__(self, layout, walltime):
+        self.nodes = [_Node(p, g) for p, g in layout]
+        self.walltime = walltime
+        self.lanes = []
+
+    def _new_lane(self, procs, gpus):
+        # a job-operation that fits on one node gets a slice of a node,
+        # a larger one the smallest set of free nodes that fits it.
+        for node in self.nodes:
+            if node.free_procs >= procs and node.free_gpus >= gpus:
+                node.free_procs -= procs
+                node.free_gpus -= gpus
+                return _Lane([node], procs, gpus)
+        nodes = []
+        for node in self.nodes:
+            if node.free_procs == node.procs and node.free_gpus == node.gpus:
+                nodes.append(node)
+                if sum(n.procs for n in nodes) >= procs and sum(n.gpus for n in nodes) >= gpus:
+                    for n in nodes:
+                        n.free_procs = n.free_gpus = 0
+                    return _Lane(nodes, procs, gpus)
+        return None
+
+    def place(self, jobop, procs, gpus, time):
+        """
+        Places jobop in a new lane while the nodes have free processes and gpus
+        for it, otherwise after the jobs of the least loaded lane that has the
+        resources and the walltime left. The procs and gpus of a lane are those
+        of its first job-operation, which are the most of all of its jobs.
+        """
+        if self.walltime and time > self.walltime:
+            return False
+        lane = self._new_lane(procs, gpus)
+        if lane is not None:
+            self.lanes.append(lane)
+        else:
+            lanes = [l for l in self.lanes if l.procs >= procs and l.gpus >= gpus and
+                     (not self.walltime or l.time + time <= self.walltime)]
+            if not lanes:
+                return False
+            lane = min(lanes, key=lambda l: l.time)
+        lane.jobops.append(jobop)
+        lane.time += time
+        return True
+
+
+class PackingBundler(Bundler):
+    """
+    Packs the job-operations into as few submissions as possible, using the
+    node layout (nodes, ppn, gpn) and the walltime of the submission
+    configuration. Job-operations run concurrently on the free processes and
+    gpus of the nodes, and once these are taken one after another as long as the
+    walltime allows it. The bins are filled first-fit with the job-operations
+    ordered by decreasing size (processes times runtime). Job-operations only
+    run after a job-operation that requests at least as many processes and gpus.
+
+    :param estimate: The resources of a job-operation, either a function of
+        (job, operation) or a mapping of operation name, returning a dictionary
+        with the keys 'nprocs', 'ngpus' and 'walltime' (in seconds). The defaults
+        are one process, no gpus and the walltime of the submission.
+    """
+
+    def __init__(self, estimate=None):
+        self._estimate = estimate
+
+    def _resources(self, job, op, walltime):
+        estimate = self._estimate
+        if callable(estimate):
+            estimate = estimate(job, op)
+        elif estimate is not None:
+            estimate = estimate.get(str(op))
+        estimate = estimate or dict()
+        return (estimate.get('nprocs') or 1, estimate.get('ngpus') or 0, estimate.get('walltime') or walltime)
+
+    @staticmethod
+    def _layout(submitconf):
+        "A (procs, gpus) tuple for each node requested by submitconf."
+        if submitconf.nodes is None:
+            return [(submitconf.nprocs or 1, submitconf.ngpus or 0)]
+        counts = [n if n is not None else 1 for n in submitconf.nodes]
+        ppn = [p if p is not None else 1 for p in submitconf.ppn]
+        gpn = submitconf.gpn
+        if all(g is None for g in gpn): # gpus requested as a resource, distribute them evenly.
+            gpn = [(submitconf.ngpus or 0) // sum(counts)] * len(counts)
+        gpn = [g if g is not None else 0 for g in gpn]
+        layout = []
+        for n, p, g in zip(counts, ppn, gpn):
+            layout += [(p, g)] * n
+        return layout
+
+    def bundle(self, hostconf, submitconf, jobops, **kwargs):
+        layout = self._layout(submitconf)
+        walltime = submitconf.walltime
+        items = [(jobop, self._resources(jobop[0], jobop[1], walltime)) for jobop in jobops]
+        items.sort(key=lambda item: (item[1][0] * item[1][2], item[1][1] * item[1][2]), reverse=True)
+        bins = []
+        for jobop, (procs, gpus, time) in items:
+            for b in bins:
+                if b.place(jobop, procs, gpus, time):
+                    break
+            else:
+                b = _Bin(layout, walltime)
+                if not b.place(jobop, procs, gpus, time):
+                    raise ValueError(
+                        "Operation {} of job {} requires {} procs, {} gpus and {} seconds, which exceeds "
+                        "the submission.".format(jobop[1], jobop[0], procs, gpus, time))
+                bins.append(b)
+        for b in bins:
+            yield JobBundle(
+                [jobop for lane in b.lanes for jobop in lane.jobops],
+                lanes=[(lane.procs, lane.gpus, lane.jobops) for lane in b.lanes])
+
+
+def _fn_bundle(project, name):
+    return os.path.join(project.root_directory(), '.bundles', name)
+
+
+class JobArrayBundle(object):
+    """
+    Runs one operation for many jobs as a single job array submission. The array
+    index of each task selects a line of the map file, which holds the job id,
+    the submit name and the operation script of that task.
+    """
+
+    def __init__(self, operation, jobs):
+        self._operation = operation
+        self._jobs = list(jobs)
+        self._name = None
+        self._job_names = []
+
+    def _submit_name(self, project):
+        h = '.'.join(job.get_id() for job in self._jobs)
+        return '{}-{}-array-{}'.format(project, self._operation, sha1(h.encode('utf-8')).hexdigest())
+
+    def dump(self, stream, hostconf, submitconf, project, **kwargs):
+        assert len(self._jobs) > 0
+        self._name = self._submit_name(project)
+        self._job_names = [scheduler.make_submit_name(self._operation, job, project) for job in self._jobs]
+        fn_map = _fn_bundle(project, self._name + '.map')
+        if not os.path.isdir(os.path.dirname(fn_map)):
+            os.makedirs(os.path.dirname(fn_map))
+        # the script index skips formatting the scripts whose inputs did not change.
+        index = project.script_index() if hasattr(project, 'script_index') else None
+        with open(fn_map, 'w') as file:
+            for job, name in zip(self._jobs, self._job_names):
+                fn_script = self._operation.write_script(
+                    project, job, nprocs=submitconf.nprocs, ngpus=submitconf.ngpus,
+                    walltime=submitconf.walltime, mpicmd=hostconf.mpi_cmd, index=index, **kwargs)
+                file.write('{}\t{}\t{}\n'.format(job.get_id(), name, fn_script))
+        if index is not None:
+            index.save()
+        # PBS runs the script with the login shell of the user unless it starts
+        # with a shebang, the script only uses POSIX sh syntax.
+        stream.write('#!/bin/sh\n')
+        submitconf.write_preamble(stream, self._name)
+        submitconf.write_array_range(stream, 0, len(self._jobs) - 1)
+        stream.write('\n')
+        stream.write("IFS='\t' read -r JOB_ID SUBMIT_NAME SCRIPT <<EOF\n")
+        stream.write('$(sed -n "$((${} + 1))p" "{}")\n'.format(submitconf.array_index_var, fn_map))
+        stream.write('EOF\n')
+        stream.write('/bin/bash "$SCRIPT"\n')
+
+    def dumps(self, hostconf, submitconf, project, **kwargs):
+        stream = io.StringIO()
+        self.dump(stream, hostconf, submitconf, project, **kwargs)
+        return stream.getvalue()
+
+    def jobops(self):
+        return [(job, self._operation) for job in self._jobs]
+
+    def save(self, registry, submitconf=None):
+        "Record the members of this bundle in registry, call after dump()."
+        registry.register(self._name, _members(self.jobops(), self._job_names), _resources(submitconf))
+
+    def job_names(self):
+        return self._job_names
+
+    def name(self):
+        return self._name
+
+
+class JobArrayBundler(Bundler):
+    """
+    Bundles the job-operations into one job array per operation, so each
+    operation is a single scheduler submission no matter how many jobs are
+    eligible for it. Arrays larger than max_size are split.
+    """
+
+    def __init__(self, max_size=None):
+        self._max_size = max_size
+
+    def bundle(self, hostconf, submitconf, jobops, **kwargs):
+        operations = []
+        jobs = dict()
+        for job, op in jobops:
+            if op not in jobs:
+                operations.append(op)
+                jobs[op] = []
+            jobs[op].append(job)
+        for op in operations:
+            size = self._max_size or len(jobs[op])
+            for i in range(0, len(jobs[op]), size):
+                yield JobArrayBundle(op, jobs[op][i:i+size])
+
+
+_array_id = re.compile(r'^(\d+)(?:\[(\d+)\]|_(\d+)$)') # torque 123[4], slurm 123_4
+
+def expand_array_jobs(scheduler_jobs, bundle_dir):
+    """
+    Expand the sub-jobs of job arrays submitted with :class:`JobArrayBundler` into
+    a :class:`~.scheduler.ClusterJob` named after the job-operation they execute.
+    Other jobs are yielded unchanged.
+    """
+    maps = dict()
+    for job in scheduler_jobs:
+        match = _array_id.match(job.id())
+        if match is None:
+            yield job
+            continue
+        index = int(match.group(2) or match.group(3))
+        name = job.name()
+        suffix = '-{}'.format(index)
+        if name.endswith(suffix) and '-array-' in name[:-len(suffix)]:
+            name = name[:-len(suffix)] # torque appends the index to the name of sub-jobs.
+        if name not in maps:
+            fn_map = os.path.join(bundle_dir, name + '.map')
+            if os.path.isfile(fn_map):
+                with open(fn_map) as file:
+                    maps[name] = [line.split('\t')[1] for line in file]
+            else:
+                maps[name] = None
+        if maps[name] is None or index >= len(maps[name]):
+            yield job
+        else:
+            yield scheduler.ClusterJob(job.id(), maps[name][index], job.status())
+
+
+def _members(jobops, names):
+    return [(name, job.get_id(), str(op)) for (job, op), name in zip(jobops, names)]
+
+def _resources(submitconf):
+    if submitconf is None:
+        return None
+    return dict(nprocs=submitconf.nprocs, ngpus=submitconf.ngpus, walltime=submitconf.walltime)
+
+
+class BundleRegistry(object):
+    """
+    Records the members of each submitted bundle in a sqlite database, by default
+    .bundles/registry.sqlite in the project root. The scheduler jobs of bundles
+    and job arrays are expanded into the job-operations they execute with one
+    indexed lookup per bundle. Finished bundles are removed with :meth:`compact`.
+
+    .. code-block:: python
+
+        registry = BundleRegistry.for_project(project)
+        for bundle in bundler.bundle(hostconf, submitconf, jobops):
+            script = bundle.dumps(hostconf, submitconf, project)
+            scheduler.submit(io.StringIO(script))
+            bundle.save(registry, submitconf)
+        stati = list(registry.expand(scheduler.jobs()))
+    """
+
+    def __init__(self, filename, timeout=30):
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._conn = sqlite3.connect(filename, timeout=timeout)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS bundles ("
+                "name TEXT PRIMARY KEY, submitted REAL, resources TEXT, finished INTEGER DEFAULT 0)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS members ("
+                "bundle TEXT, idx INTEGER, submit_name TEXT, job_id TEXT, operation TEXT, "
+                "PRIMARY KEY (bundle, idx)) WITHOUT ROWID")
+
+    @classmethod
+    def for_project(cls, project):
+        return cls(_fn_bundle(project, 'registry.sqlite'))
+
+    def close(self):
+        self._conn.close()
+
+    def register(self, name, members, resources=None):
+        """
+        Record a bundle.
+
+        :param name: The submit name of the bundle.
+        :param members: A list of (submit name, job id, operation) tuples, for a
+            job array in the order of the array index.
+        :param resources: A json encodable description of the requested resources.
+        """
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO bundles (name, submitted, resources, finished) VALUES (?, ?, ?, 0)",
+                (name, time.time(), json.dumps(resources)))
+            self._conn.execute("DELETE FROM members WHERE bundle = ?", (name,))
+            self._conn.executemany(
+                "INSERT INTO members (bundle, idx, submit_name, job_id, operation) VALUES (?, ?, ?, ?, ?)",
+                ((name, i, n, j, o) for i, (n, j, o) in enumerate(members)))
+
+    def __contains__(self, name):
+        return self._conn.execute("SELECT 1 FROM bundles WHERE name = ?", (name,)).fetchone() is not None
+
+    def members(self, name):
+        "The submit names of the members of bundle name, empty if it is not registered."
+        rows = self._conn.execute(
+            "SELECT submit_name FROM members WHERE bundle = ? ORDER BY idx", (name,))
+        return [row[0] for row in rows]
+
+    def entries(self, name):
+        "The (submit name, job id, operation) of each member of bundle name, empty if it is not registered."
+        rows = self._conn.execute(
+            "SELECT submit_name, job_id, operation FROM members WHERE bundle = ? ORDER BY idx", (name,))
+        return [tuple(row) for row in rows]
+
+    def resources(self, name):
+        "The resources recorded for bundle name, None if there are none."
+        row = self._conn.execute("SELECT resources FROM bundles WHERE name = ?", (name,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def expand(self, scheduler_jobs):
+        """
+        Yield a :class:`~.scheduler.ClusterJob` for each member of the registered
+        bundles in scheduler_jobs, job arrays are expanded by their array index.
+        Other scheduler jobs are yielded unchanged.
+        """
+        members = dict()
+        for job in scheduler_jobs:
+            name = job.name()
+            match = _array_id.match(job.id())
+            if match is not None:
+                suffix = '-{}'.format(match.group(2) or match.group(3))
+                if name.endswith(suffix) and name not in members and name[:-len(suffix)] in self:
+                    name = name[:-len(suffix)] # torque appends the index to the name of sub-jobs.
+            if name not in members:
+                members[name] = self.members(name)
+            if not members[name]:
+                yield job
+            elif match is not None:
+                index = int(match.group(2) or match.group(3))
+                if index < len(members[name]):
+                    yield scheduler.ClusterJob(job.id(), members[name][index], job.status())
+                else:
+                    yield job
+            else:
+                for submit_name in members[name]:
+                    yield scheduler.ClusterJob(job.id(), submit_name, job.status())
+
+    def finish(self, names):
+        "Mark the bundles names as finished."
+        with self._conn:
+            self._conn.executemany("UPDATE bundles SET finished = 1 WHERE name = ?", ((n,) for n in names))
+
+    def compact(self, active=None):
+        """
+        Remove the finished bundles. If active, the names of the bundles still
+        known to the scheduler, is given all other bundles are removed as well.
+        """
+        with self._conn:
+            if active is not None:
+                self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS active (name TEXT PRIMARY KEY)")
+                self._conn.execute("DELETE FROM active")
+                self._conn.executemany("INSERT OR IGNORE INTO active VALUES (?)", ((n,) for n in active))
+                self._conn.execute("UPDATE bundles SET finished = 1 WHERE name NOT IN (SELECT name FROM active)")
+            self._conn.execute(
+                "DELETE FROM members WHERE bundle IN (SELECT name FROM bundles WHERE finished = 1)")
+            self._conn.execute("DELETE FROM bundles WHERE finished = 1")
+        self._conn.execute("VACUUM")
@@ -0,0 +1,186 @@
+# Copyright (c) 2017 The Regents of the University of Michigan
+# All rights reserved.
+# This software is licensed under the BSD 3-Clause License.
+import os
+import json
+import errno
+import logging
+from hashlib import sha1
+
+logger = logging.getLogger("flow.{}".format(__name__))
+
+
+def _condition_key(callback):
+    """
+    A name for callback that is stable between python sessions, or None if the
+    value of callback may depend on state that is not part of the name. The line
+    number separates lambdas defined in the same module, and the values captured
+    by a closure or bound as default arguments are part of the key, so closures
+    made by the same factory get different keys. Callbacks that capture values
+    which can not be serialized to json are not persisted.
+    """
+    if callback is None:
+        return 'None'
+    func = getattr(callback, '__func__', callback) # bound methods
+    code = getattr(func, '__code__', None)
+    name = getattr(func, '__qualname__', None) or getattr(func, '__name__', None)
+    if code is None or name is None: # e.g. functools.partial or a callable object.
+        return None
+    key = "{}:{}:{}".format(getattr(func, '__module__', ''), name, code.co_firstlineno)
+    owner = getattr(callback, '__self__', None)
+    if owner is not None:
+        key = "{}@{}".format(key, type(owner).__qualname__)
+    try:
+        captured = [cell.cell_contents for cell in func.__closure__ or ()]
+        captured += [func.__defaults__, func.__kwdefaults__]
+        state = json.dumps(captured, sort_keys=True)
+    except (TypeError, ValueError): # not serializable, or an empty cell.
+        return None
+    if captured != [None, None]:
+        key = "{}:{}".format(key, sha1(state.encode()).hexdigest())
+    return key
+
+
+class FluidCondition(object):
+    """
+    A condition as a function of a job handle. Conditions compare equal when they
+    wrap the same callback, so a condition shared by several operations is only
+    evaluated once per job when a :class:`ConditionCache` is used.
+    """
+
+    def __init__(self, callback):
+        self._callback = callback
+        self._key = _condition_key(callback)
+
+    def __call__(self, job, cache=None):
+        if self._callback is None:
+            return True
+        if cache is None:
+            return bool(self._callback(job))
+        return cache.evaluate(self, job)
+
+    def evaluate(self, job):
+        return self._callback is None or bool(self._callback(job))
+
+    def key(self):
+        return self._key
+
+    def __hash__(self):
+        return hash(self._callback)
+
+    def __eq__(self, other):
+        return isinstance(other, FluidCondition) and self._callback == other._callback
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+        return 0.0
+
+
+class PersistentConditionCache(object):
+    """
+    Stores condition values in a json file between sessions. The values of a job
+    are dropped when the job document or the workspace directory is modified.
+    Conditions without a stable key (see :func:`_condition_key`) are not stored.
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._data = dict()
+        self._stamps = dict()
+        self._modified = False
+        if os.path.isfile(filename):
+            try:
+                with open(filename) as f:
+                    self._data = json.load(f)
+            except ValueError:
+                logger.warning("Ignoring corrupted condition cache {!r}.".format(filename))
+
+    def _stamp(self, job):
+        jid = job.get_id()
+        if jid not in self._stamps:
+            ws = job.workspace()
+            self._stamps[jid] = max(_mtime(ws), _mtime(os.path.join(ws, job.FN_DOCUMENT)))
+        return self._stamps[jid]
+
+    def get(self, job, condition):
+        if condition.key() is None:
+            return None
+        entry = self._data.get(job.get_id())
+        if entry is None or entry['stamp'] != self._stamp(job):
+            return None
+        return entry['values'].get(condition.key())
+
+    def set(self, job, condition, value):
+        if condition.key() is None: # not persistent, see _condition_key.
+            return
+        jid = job.get_id()
+        stamp = self._stamp(job)
+        entry = self._data.get(jid)
+        if entry is None or entry['stamp'] != stamp:
+            entry = self._data[jid] = dict(stamp=stamp, values=dict())
+        entry['values'][condition.key()] = value
+        self._modified = True
+
+    def save(self):
+        if not self._modified:
+            return
+        dirname = os.path.dirname(self._filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = self._filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._data, f)
+        os.rename(tmp, self._filename)
+        self._modified = False
+
+
+class ConditionCache(object):
+    """
+    Memoizes condition values for one pass over the project, keyed by the job id
+    and the condition. An optional :class:`PersistentConditionCache` is consulted
+    before a condition is evaluated.
+
+    .. code-block:: python
+
+        cache = ConditionCache()
+        eligible = [op for op in operations if op.eligible(job, cache)]
+    """
+
+    def __init__(self, persistent=None):
+        self._values = dict()
+        self._persistent = persistent
+
+    def evaluate(self, condition, job):
+        key = (job.get_id(), condition)
+        value = self._values.get(key)
+        if value is None:
+            if self._persistent is not None:
+                value = self._persistent.get(job, condition)
+            if value is None:
+                value = condition.evaluate(job)
+                if self._persistent is not None:
+                    self._persistent.set(job, condition, value)
+            self._values[key] = value
+        return value
+
+    def clear(self):
+        self._values.clear()
+
+    def save(self):
+        if self._persistent is not None:
+            self._persistent.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.save()
+        self.clear()
@@ -1,12 +1,17 @@
 # Copyright (c) 2017 The Regents of the University of Michigan
 # All rights reserved.
 # This software is licensed under the BSD 3-Clause License.
+import os
+import copy
+import atexit
+import json
 import platform
 import logging
 import re
 import argparse
 import datetime
 import socket
+from hashlib import sha1
 import signac
 from signac.common.six import with_metaclass
 import signac.common.config
@@ -14,9 +19,9 @@ from signac.common.config import Config
 
 logger = logging.getLogger("flow.{}".format(__name__));
 
-def load_config(root=None, local=False):
+def load_config(root=None, local=False, cache_file=None):
     logger.debug("loading flow config")
-    return FlowConfig(config=signac.common.config.load_config(root, local))
+    return FlowConfig(config=signac.common.config.load_config(root, local), cache_file=cache_file)
 
 def read_config_file(filename):
     logger.debug("reading flow config file")
@@ -29,6 +34,76 @@ def get_config(infile=None, configspec=None, * args, **kwargs):
 
 # TODO: Error Handling. There are many asserts in the code, we need to handle the errors.
 
+_hostname = None
+def get_hostname():
+    "The hostname, resolved once per process."
+    global _hostname
+    if _hostname is None:
+        _hostname = socket.gethostname()
+    return _hostname
+
+def _hash(obj):
+    return sha1(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class SubmitConfigCache(object):
+    """
+    Caches the parsed state of submission configurations, keyed by a hash of the
+    scheduler type, the configuration and the arguments, so that the arguments
+    of a submission are only parsed once. If filename is given the cache is
+    stored in that json file and shared between processes, call :meth:`save`
+    after a batch of submissions. At most max_size states are kept, the least
+    recently used are dropped first.
+    """
+
+    def __init__(self, filename=None, max_size=256):
+        self._filename = filename
+        self._max_size = max_size
+        self._data = None
+        self._modified = False
+
+    def _load(self):
+        if self._data is None:
+            self._data = dict()
+            if self._filename is not None and os.path.isfile(self._filename):
+                try:
+                    with open(self._filename) as f:
+                        self._data = json.load(f)
+                except (IOError, OSError, ValueError):
+                    logger.warning("Ignoring corrupted config cache {!r}.".format(self._filename))
+        return self._data
+
+    def get(self, key):
+        "Returns a copy of the state stored for key or None."
+        data = self._load()
+        state = data.pop(key, None)
+        if state is None:
+            return None
+        data[key] = state # the most recently used last.
+        return copy.deepcopy(state)
+
+    def set(self, key, state):
+        data = self._load()
+        if data.get(key) == state:
+            return
+        data.pop(key, None)
+        data[key] = copy.deepcopy(state)
+        while len(data) > self._max_size:
+            del data[next(iter(data))]
+        self._modified = True
+
+    def save(self):
+        if self._filename is None or not self._modified:
+            return
+        dirname = os.path.dirname(self._filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = "{}.{}.tmp".format(self._filename, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self._data, f)
+        os.rename(tmp, self._filename)
+        self._modified = False
+
 class SubmitConfigType(type):
 
     def __init__(cls, name, bases, dct):
@@ -89,7 +164,7 @@ class SubmitConfig(with_metaclass(SubmitConfigType)):
 
     def _get_ngpus(self):
         if self._gpus is not None and self._nodes is not None:
-            return sum(self._get_nodes())*self._gpus # assumption!
+            return sum(n if n is not None else 1 for n in self._get_nodes())*self._gpus # assumption!
         elif self._nodes is not None:
             nl = self._get_nodes();
             nl = [n if n is not None else 1 for n in nl]; # assumption!
@@ -130,6 +205,21 @@ class SubmitConfig(with_metaclass(SubmitConfigType)):
     def parse_args(self, args):
         return;
 
+    def _update_properties(self):
+        return;
+
+    def get_state(self):
+        "The parsed configuration in a json serializable form."
+        return dict(config=self._config, remainder=self._remainder)
+
+    def set_state(self, state):
+        self._config = state['config']
+        self._remainder = state['remainder']
+        self._update_properties()
+
+    def write_array_range(self, stream, first, last):
+        raise NotImplementedError("{} does not support job arrays".format(type(self).__name__))
+
     def forward_args(self):
         return self._remainder.split();
 
@@ -169,6 +259,7 @@ class ComputeEnvironment(with_metaclass(ComputeEnvironmentType)):
     def __init__(self, alias, conf):
         # alias, pattern, mpicmd, scheduler_type, submit_schemes
         self.hostname_pattern = conf["pattern"]
+        self._pattern = re.compile(conf["pattern"]) if conf["pattern"] is not None else None
         self.alias = alias
         self.mpi_cmd = conf["mpicmd"]
         self.scheduler_type = conf["type"]
@@ -179,52 +270,105 @@ class ComputeEnvironment(with_metaclass(ComputeEnvironmentType)):
             self.submit_config = conf["submitconf"]
 
     def is_present(self):
-        if self.hostname_pattern is None:
+        if self._pattern is None:
             return False
         else:
-            return re.match(
-                self.hostname_pattern, socket.gethostname()) is not None
+            return self._pattern.match(get_hostname()) is not None
 
-    def get_submission_config(self, name):
+    def get_submission_config(self, name, args=None, cache=None):
+        """
+        Returns the submission configuration name, updated with args if given.
+        If a :class:`SubmitConfigCache` is given, the parsed configuration is
+        taken from the cache when the configuration and args are unchanged.
+        """
         if self.scheduler_type is None or self.submit_config is None: # TODO: should this be an error?
             logger.debug("scheduler type and/or submitconf is None")
             return None;
         conf_cls = SubmitConfig.registry[self.scheduler_type];
-        if name in self.submit_config:
-            return conf_cls(host=self._alias, name=name, default=self.submit_config[name])
-        else:
+        if name not in self.submit_config:
             raise KeyError("submission configuration named {} is not found".format(name))
+        # a deep copy, parsing args must not modify the configuration.
+        default = copy.deepcopy(dict(self.submit_config[name]))
+        submitconf = conf_cls(host=self.alias, name=name, default=default)
+        if args is None:
+            return submitconf
+        key = _hash([self.scheduler_type, name, default, args])
+        state = cache.get(key) if cache is not None else None
+        if state is not None:
+            submitconf.set_state(state)
+        else:
+            submitconf.parse_args(args)
+            if cache is not None:
+                cache.set(key, submitconf.get_state())
+        return submitconf
 
     def get_mpi_cmd(self, nprocs): # I think we may want to move this to the handler.
         return self.mpi_cmd.format(nprocs=nprocs);
 
 # FlowConfig in flow is meant to match the signac config as much as posible.
 class FlowConfig(Config):
+    _environments = dict() # the environments of each configuration, keyed by its hash.
+    _submit_caches = dict() # the submit config caches, keyed by the absolute path of their file.
 
-    def __init__(self, config=None, *args, **kwargs):
+    def __init__(self, config=None, *args, cache_file=None, **kwargs):
         if config is not None:
             Config.__init__(self, config);
         else:
             Config.__init__(self, *args, **kwargs);
         self._envs = list()
+        self._present = None
+        self._submit_cache = self._get_submit_cache(cache_file)
         self._valid = 'flow' in self;
         if self._valid:
             if 'environment' in self['flow']:
-                for alias in self['flow']['environment'].keys():
-                    name = self['flow']['environment'][alias]['class']
-                    ComputeEnvironmentClass = ComputeEnvironment.registry[name]
-                    self._envs.append(ComputeEnvironmentClass(alias, self['flow']['environment'][alias]))
+                conf = self['flow']['environment'].dict()
+                key = _hash(conf)
+                if key not in self._environments:
+                    envs = []
+                    for alias in conf.keys():
+                        name = conf[alias]['class']
+                        ComputeEnvironmentClass = ComputeEnvironment.registry[name]
+                        envs.append(ComputeEnvironmentClass(alias, conf[alias]))
+                    self._environments[key] = envs
+                self._envs = list(self._environments[key])
         else:
             logger.debug("signac-flow has not been configured, using default definitions")
 
+    @classmethod
+    def _get_submit_cache(cls, cache_file):
+        """
+        Returns the cache stored in cache_file. The configurations of a file share
+        one cache, which is saved by a single handler at exit, so an older copy of
+        the cache can not overwrite the entries of a newer one.
+        """
+        if cache_file is None:
+            return SubmitConfigCache()
+        fn = os.path.abspath(cache_file)
+        if fn not in cls._submit_caches:
+            cls._submit_caches[fn] = SubmitConfigCache(fn)
+            atexit.register(cls._submit_caches[fn].save)
+        return cls._submit_caches[fn]
+
     def get_environment(self, alias=None):
-        for env in self._envs:
-            if alias is not None:
+        if alias is not None:
+            for env in self._envs:
                 if env.alias == alias:
                     return env;
-            elif env.is_present():
-                return env
-        return None
+            return None
+        if self._present is None: # the hostname does not change, detect it once.
+            self._present = next((env for env in self._envs if env.is_present()), False)
+        return self._present or None
+
+    def get_submission_config(self, name, args=None, alias=None):
+        "Returns the submission configuration name of the environment alias or the present environment."
+        env = self.get_environment(alias)
+        if env is None:
+            return None
+        return env.get_submission_config(name, args, cache=self._submit_cache)
+
+    def save(self):
+        "Stores the parsed submission configurations in the cache file, if any of them changed."
+        self._submit_cache.save()
 
     def get_modules(self):
         if self._valid:
@@ -7,6 +7,9 @@ import logging
 import re
 import argparse
 import datetime
+import functools
+import xml.etree.ElementTree as ET
+from collections import namedtuple
 
 from .config import SubmitConfig
 
@@ -40,45 +43,22 @@ def parse_node_item(node):
         }
     ]
     """
-    assert 'nodes=' == node[:6];
-    node_specs = node.lstrip('nodes=').split('+');
-    specs = [];
-    for spec in node_specs:
-        data = dict(count=None, name=None, ppn=None, gpus=None, features=None);
-        sp = spec.split(':');
-        assert len(sp) > 0
-        if sp[0].isnumeric():
-            data['count'] = int(sp[0]);
-        else:
-            data['name'] = sp[0];
-        if len(sp) > 1:
-            for s in sp[1:]:
-                if 'ppn=' == s[:4] or 'gpus=' == s[:5]:
-                    n = s.split('=')
-                    assert len(n) == 2
-                    assert n[0] in data.keys()
-                    data[n[0]] = int(n[1]);
-                else:
-                    if data['features'] is None:
-                        data['features'] = [];
-                    data['features'].append(s);
-        specs.append(data);
-    return specs;
+    if not node.startswith('nodes='):
+        raise ValueError("Invalid node resource {!r}.".format(node))
+    return _node_dicts(dict(_parse_resources([node]))['nodes']);
 
 
 def parse_resource_list(resources):
     """
     Assumes that resources is a list of the form ["nodes=1:ppn=2,walltime=05:00:00", "qos=fluxoe", ...]
     """
-    resource_map = dict() if len(resources) !=0 else None;
-    for options in resources:
-        for ops in options.split(','):
-            if 'nodes=' == ops[:6]:
-                resource_map['nodes'] = parse_node_item(ops);
-            else:
-                namevalue = ops.split('=');
-                assert len(namevalue) == 2;
-                resource_map[namevalue[0]] = namevalue[1];
+    if len(resources) == 0:
+        return None
+    resource_map = dict();
+    for name, value in _parse_resources(resources):
+        if name == 'nodes':
+            value = _node_dicts(value);
+        resource_map[name] = value;
     return resource_map
 
 def dump_node_spec(nodelist):
@@ -103,11 +83,144 @@ def dump_node_spec(nodelist):
     return '+'.join(specstr)
 
 
+# The qsub options that are parsed, all others are forwarded in the remainder.
+_STRING, _APPEND, _FLAG = range(3)
+_qsub_options = dict(A=_STRING, N=_STRING, q=_STRING, l=_APPEND, M=_APPEND, m=_STRING, j=_STRING, V=_FLAG, t=_STRING)
+
+_memory_units = dict(b=1, kb=1024, mb=1024**2, gb=1024**3, tb=1024**4)
+_word_size = 8
+_memory_pattern = re.compile(r'^(\d+)([kmgt]?[bw])?$', re.IGNORECASE)
+
+NodeSpec = namedtuple('NodeSpec', ['count', 'name', 'ppn', 'gpus', 'features'])
+PBSSpec = namedtuple('PBSSpec', ['options', 'resources', 'remainder'])
+PBSSpec.__doc__ = """
+The parsed qsub arguments. options is a tuple of (option, value) pairs, the
+value of the options that can be given more than once is a tuple. resources is
+a tuple of (name, value) pairs of the -l resource lists, the value of nodes is a
+tuple of :class:`NodeSpec`. remainder is the tuple of the arguments following
+the first argument that is not a known option.
+"""
+
+def parse_walltime(walltime):
+    """
+    Parses a walltime of the form [[[DD:]HH:]MM:]SS[.ms] into a datetime.timedelta.
+    """
+    fields = walltime.strip().split(':')
+    if not 1 <= len(fields) <= 4:
+        raise ValueError("Invalid walltime {!r}.".format(walltime))
+    try:
+        seconds = float(fields[-1])
+        units = [int(f) for f in fields[:-1]]
+    except ValueError:
+        raise ValueError("Invalid walltime {!r}.".format(walltime))
+    for factor, value in zip((60, 3600, 86400), reversed(units)):
+        seconds += factor * value
+    return datetime.timedelta(seconds=seconds)
+
+def parse_memory(memory):
+    """
+    Parses a PBS memory size e.g. 2gb or 512mw into bytes, a word is 8 bytes.
+
+    units   multipliers
+    b	w	1
+    kb	kw	1024
+    mb	mw	1,048,576
+    gb	gw	1,073,741,824
+    tb	tw	1,099,511,627,776
+    """
+    match = _memory_pattern.match(memory.strip())
+    if match is None:
+        raise ValueError("Invalid memory size {!r}.".format(memory))
+    unit = (match.group(2) or 'b').lower()
+    size = int(match.group(1)) * _memory_units[unit[:-1] + 'b']
+    return size * _word_size if unit.endswith('w') else size
+
+def _parse_node_spec(spec):
+    "Parses one {<node_count> | <hostname>} [:ppn=<ppn>][:gpus=<gpu>][:<property>...] item."
+    fields = spec.split(':')
+    count = name = ppn = gpus = None
+    features = []
+    if fields[0].isdigit():
+        count = int(fields[0])
+    elif fields[0]:
+        name = fields[0]
+    else:
+        raise ValueError("Invalid node specification {!r}.".format(spec))
+    for field in fields[1:]:
+        key, sep, value = field.partition('=')
+        if sep and key in ('ppn', 'gpus'):
+            if not value.isdigit():
+                raise ValueError("Invalid {} in node specification {!r}.".format(key, spec))
+            if key == 'ppn':
+                ppn = int(value)
+            else:
+                gpus = int(value)
+        else:
+            features.append(field)
+    return NodeSpec(count, name, ppn, gpus, tuple(features) if features else None)
+
+def _parse_resources(resources):
+    "Parses the values of -l options into a tuple of (name, value) pairs."
+    parsed = []
+    for resource_list in resources:
+        for item in resource_list.split(','):
+            name, sep, value = item.partition('=')
+            if not sep or not name:
+                raise ValueError("Invalid resource {!r}, expected name=value.".format(item))
+            if name == 'nodes':
+                value = tuple(_parse_node_spec(spec) for spec in value.split('+'))
+            parsed.append((name, value))
+    return tuple(parsed)
+
+def _node_dicts(specs):
+    "The mutable form of the node specifications stored in the configuration."
+    return [dict(spec._asdict(), features=list(spec.features) if spec.features else None) for spec in specs]
+
+@functools.lru_cache(maxsize=1024)
+def parse_qsub_args(args):
+    """
+    Parses qsub arguments in a single pass, args is a string or a tuple of
+    arguments. Returns an immutable :class:`PBSSpec`, the result is memoized
+    on args.
+    """
+    tokens = args.split() if isinstance(args, str) else list(args)
+    options = dict()
+    resources = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if len(token) < 2 or token[0] != '-' or token[1] not in _qsub_options:
+            break
+        option = token[1]
+        kind = _qsub_options[option]
+        if kind == _FLAG:
+            if len(token) > 2:
+                break
+            options[option] = True
+            i += 1
+            continue
+        if len(token) > 2: # the value is attached, e.g. -lnodes=1
+            value = token[2:]
+            i += 1
+        elif i + 1 < len(tokens):
+            value = tokens[i+1]
+            i += 2
+        else:
+            raise ValueError("qsub option -{} requires a value.".format(option))
+        if option == 'l':
+            resources.append(value)
+        elif kind == _APPEND:
+            options[option] = options.get(option, ()) + (value,)
+        else:
+            options[option] = value
+    return PBSSpec(tuple(sorted(options.items())), _parse_resources(resources), tuple(tokens[i:]))
+
 class PBSConfig(SubmitConfig):
     alias='pbs';
     submit_cmd = 'qsub';
-    status_cmd = 'qstat -fx -u {user}';
+    status_cmd = 'qstat -fx -t -u {user}';
     preable_prefix="#PBS";
+    array_index_var = 'PBS_ARRAYID';
 
     def is_valid(self):
         """
@@ -116,23 +229,20 @@ class PBSConfig(SubmitConfig):
         return True;
 
     def parse_args(self, args):
-        if isinstance(args, str):
-            args = args.split();
-        parser = argparse.ArgumentParser();
-        self.add_args_to_parser(parser);
-        submit_args = dict(**vars(parser.parse_args(args)));
-        resources = parse_resource_list(submit_args['l']);
-        submit_args['l'] = resources
+        if not isinstance(args, str):
+            args = tuple(args);
+        spec = parse_qsub_args(args);
         update = dict();
-        for key in submit_args:
-            if key == 'remainder':
-                continue;
-            if isinstance(submit_args[key], list):
-                if len(submit_args[key]) != 0:
-                    update[key] = submit_args[key];
-            elif submit_args[key] is not None:
-                update[key] = submit_args[key];
-        self._remainder = submit_args['remainder'];
+        for key, value in spec.options:
+            update[key] = list(value) if isinstance(value, tuple) else value;
+        if spec.resources:
+            resources = dict();
+            for name, value in spec.resources:
+                if name == 'nodes':
+                    value = _node_dicts(value);
+                resources[name] = value;
+            update['l'] = resources;
+        self._remainder = ' '.join(spec.remainder);
         SubmitConfig._rupdate(self._config, update);
         self._update_properties();
 
@@ -145,17 +255,15 @@ class PBSConfig(SubmitConfig):
         gb	gw	1,073,741,824
         tb	tw	1,099,511,627,776
         """
-        if 'nodes' in self._config['l'].keys():
-            self._nodes = self._config['l']['nodes'];
-        if 'gpus' in self._config['l'].keys():
-            self._gpus = int(self._config['l']['gpus']); # the gpus can be specified as a resource.
-        if 'pmem' in self._config['l'].keys():
-            self._memory_per_proc = self._config['l']['pmem']; #TODO: parse the memory
-        if 'walltime' in self._config['l'].keys():
-            wt = self._config['l']['walltime'].split(':');
-            # seconds, or [[HH:]MM:]SS
-            assert len(wt) == 3 # TODO: parse time and or give a parse string i.e. HH:MM:SS
-            self._walltime = datetime.timedelta(hours=int(wt[0]),minutes=int(wt[1]),seconds=int(wt[2])); #TODO: parse the memory
+        resources = self._config.get('l') or dict();
+        if 'nodes' in resources.keys():
+            self._nodes = resources['nodes'];
+        if 'gpus' in resources.keys():
+            self._gpus = int(resources['gpus']); # the gpus can be specified as a resource.
+        if 'pmem' in resources.keys():
+            self._memory_per_proc = parse_memory(resources['pmem']); # in bytes
+        if 'walltime' in resources.keys():
+            self._walltime = parse_walltime(resources['walltime']);
 
 
     @classmethod
@@ -252,6 +360,9 @@ class PBSConfig(SubmitConfig):
     def _write_preamble_name(self, stream, name):
         self._write_preamble_line(stream, '-N', name);
 
+    def write_array_range(self, stream, first, last):
+        self._write_preamble_line(stream, '-t', '{}-{}'.format(first, last));
+
     def write_preamble(self, stream, name=None):
         """
         writes the preamble to stream. stream object must have a write method.
@@ -280,17 +391,39 @@ class PBSConfig(SubmitConfig):
             self._write_preamble_line(stream, option, value)
 
     def job_status(self, result): # TODO: pull this into its own class? more flexible but then we need to store more info in the config
-        tree = ET.parse(source=result)
-        root = tree.getroot()
-        for node in root.findall('Job'):
-            job_state = self.node.find('job_state').text
-            state = JobStatus.registered
-            if job_state == 'R':
-                state = JobStatus.active
-            if job_state == 'Q':
-                state = JobStatus.queued
-            if job_state == 'C':
-                state = JobStatus.inactive
-            if job_state == 'H':
-                state = JobStatus.held
-            yield self.node.find('Job_Id').text, self.node.find('Job_Name').text, state
+        """
+        Parses the xml output of qstat -fx incrementally and yields a tuple of
+        (job id, job name, status) for each job as soon as its element is
+        complete. The element is discarded right after, so the memory does not
+        grow with the number of jobs. result is a binary file object, which can
+        be the stdout pipe of the qstat process.
+        """
+        from ..scheduler import JobStatus
+        states = dict(
+            R=JobStatus.active,
+            E=JobStatus.active,
+            B=JobStatus.active, # a job array with running subjobs (PBS Pro)
+            Q=JobStatus.queued,
+            W=JobStatus.queued,
+            T=JobStatus.queued,
+            C=JobStatus.inactive,
+            F=JobStatus.inactive, # finished (PBS Pro)
+            X=JobStatus.inactive, # a finished subjob (PBS Pro)
+            H=JobStatus.held,
+            S=JobStatus.held,
+            U=JobStatus.held)
+        root = None
+        try:
+            for event, elem in ET.iterparse(result, events=('start', 'end')):
+                if root is None:
+                    root = elem
+                if event != 'end' or elem.tag != 'Job':
+                    continue
+                state = states.get(elem.findtext('job_state'), JobStatus.registered)
+                yield elem.findtext('Job_Id'), elem.findtext('Job_Name'), state
+                elem.clear()
+                root.clear() # drop the references to the finished jobs.
+        except ET.ParseError:
+            if root is not None:
+                raise
+            # qstat does not write anything if there are no jobs.
@@ -7,15 +7,248 @@ import logging
 import re
 import argparse
 import datetime
+import functools
+from collections import namedtuple
 
 from .config import SubmitConfig
 
 logger = logging.getLogger("flow.{}".format(__name__));
 
+# The sbatch options that are parsed, mapped to the name of their long form.
+# All other arguments are forwarded in the remainder.
+_sbatch_options = {
+    '-A': 'account', '--account': 'account',
+    '-J': 'job-name', '--job-name': 'job-name',
+    '-p': 'partition', '--partition': 'partition',
+    '-q': 'qos', '--qos': 'qos',
+    '-N': 'nodes', '--nodes': 'nodes',
+    '-n': 'ntasks', '--ntasks': 'ntasks',
+    '--ntasks-per-node': 'ntasks-per-node',
+    '-c': 'cpus-per-task', '--cpus-per-task': 'cpus-per-task',
+    '-t': 'time', '--time': 'time',
+    '--mem': 'mem',
+    '--mem-per-cpu': 'mem-per-cpu',
+    '--gres': 'gres',
+    '-G': 'gpus', '--gpus': 'gpus',
+    '--gpus-per-node': 'gpus-per-node',
+    '-a': 'array', '--array': 'array',
+    '-C': 'constraint', '--constraint': 'constraint',
+    '-o': 'output', '--output': 'output',
+    '-e': 'error', '--error': 'error',
+    '--mail-user': 'mail-user',
+    '--mail-type': 'mail-type',
+    '--export': 'export',
+}
+_sbatch_flags = {'--exclusive': 'exclusive', '--requeue': 'requeue', '--no-requeue': 'no-requeue'}
+
+_memory_units = dict(k=1024, m=1024**2, g=1024**3, t=1024**4)
+_memory_pattern = re.compile(r'^(\d+)([kmgt])?b?$', re.IGNORECASE)
+_gres_gpu = re.compile(r'(?:^|,)gpu(?::[^:,]+)?:(\d+)')
+
+SBatchSpec = namedtuple('SBatchSpec', ['options', 'remainder'])
+SBatchSpec.__doc__ = """
+The parsed sbatch arguments. options is a tuple of (name, value) pairs with the
+long option name without the leading dashes, flags have the value True.
+remainder is the tuple of the arguments following the first argument that is
+not a known option.
+"""
+
+def parse_time(time):
+    """
+    Parses a SLURM time limit into a datetime.timedelta, the accepted forms are
+    minutes, minutes:seconds, hours:minutes:seconds, days-hours,
+    days-hours:minutes and days-hours:minutes:seconds. Returns None for
+    an unlimited time.
+    """
+    time = time.strip()
+    if time.lower() in ('unlimited', 'infinite', '-1'):
+        return None
+    days, sep, rest = time.partition('-')
+    try:
+        if sep:
+            fields = [int(f) for f in rest.split(':')]
+            if not 1 <= len(fields) <= 3:
+                raise ValueError()
+            hours, minutes, seconds = (fields + [0, 0])[:3]
+            return datetime.timedelta(days=int(days), hours=hours, minutes=minutes, seconds=seconds)
+        fields = [int(f) for f in time.split(':')]
+    except ValueError:
+        raise ValueError("Invalid time limit {!r}.".format(time))
+    if len(fields) == 1:
+        return datetime.timedelta(minutes=fields[0])
+    if len(fields) == 2:
+        return datetime.timedelta(minutes=fields[0], seconds=fields[1])
+    if len(fields) == 3:
+        return datetime.timedelta(hours=fields[0], minutes=fields[1], seconds=fields[2])
+    raise ValueError("Invalid time limit {!r}.".format(time))
+
+def parse_memory(memory):
+    "Parses a SLURM memory size e.g. 4G into bytes, the default unit is megabytes."
+    match = _memory_pattern.match(memory.strip())
+    if match is None:
+        raise ValueError("Invalid memory size {!r}.".format(memory))
+    return int(match.group(1)) * _memory_units[(match.group(2) or 'm').lower()]
+
+@functools.lru_cache(maxsize=1024)
+def parse_sbatch_args(args):
+    """
+    Parses sbatch arguments in a single pass, args is a string or a tuple of
+    arguments. Returns an immutable :class:`SBatchSpec`, the result is memoized
+    on args.
+    """
+    tokens = args.split() if isinstance(args, str) else list(args)
+    options = dict()
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in _sbatch_flags:
+            options[_sbatch_flags[token]] = True
+            i += 1
+            continue
+        if token.startswith('--'):
+            option, sep, value = token.partition('=')
+        elif token.startswith('-') and len(token) > 2: # the value is attached, e.g. -N2
+            option, sep, value = token[:2], True, token[2:]
+        else:
+            option, sep, value = token, False, None
+        if option not in _sbatch_options:
+            break
+        if sep:
+            i += 1
+        elif i + 1 < len(tokens):
+            value = tokens[i+1]
+            i += 2
+        else:
+            raise ValueError("sbatch option {} requires a value.".format(option))
+        options[_sbatch_options[option]] = value
+    return SBatchSpec(tuple(sorted(options.items())), tuple(tokens[i:]))
+
+
 class SLURMConfig(SubmitConfig):
     alias='slurm';
-    def __init__(self):
-        pass
+    submit_cmd = 'sbatch --parsable';
+    status_cmd = 'squeue --noheader --array --user {user} --format %i|%j|%t';
+    history_cmd = 'sacct --noheader --parsable2 --user {user} --format JobID,JobName,State --starttime {since}';
+    preable_prefix="#SBATCH";
+    array_index_var = 'SLURM_ARRAY_TASK_ID';
+
+    def is_valid(self):
+        """
+        opportunity to do a sanity check if needed.
+        """
+        return True;
+
+    def parse_args(self, args):
+        if not isinstance(args, str):
+            args = tuple(args);
+        spec = parse_sbatch_args(args);
+        SubmitConfig._rupdate(self._config, dict(spec.options));
+        self._remainder = ' '.join(spec.remainder);
+        self._update_properties();
+
+    def _update_properties(self):
+        conf = self._config;
+        cpus_per_task = int(conf.get('cpus-per-task', 1));
+        nodes = int(conf['nodes'].split('-')[0]) if 'nodes' in conf else None; # the minimum of a range
+        if 'ntasks-per-node' in conf:
+            ppn = int(conf['ntasks-per-node']) * cpus_per_task;
+        elif 'ntasks' in conf:
+            ppn = -(-int(conf['ntasks']) // (nodes or 1)) * cpus_per_task;
+        else:
+            ppn = cpus_per_task if 'cpus-per-task' in conf else None;
+        gpn = None;
+        if 'gpus-per-node' in conf:
+            gpn = int(conf['gpus-per-node'].split(':')[-1]);
+        elif 'gres' in conf:
+            match = _gres_gpu.search(conf['gres']);
+            if match is not None:
+                gpn = int(match.group(1));
+        elif 'gpus' in conf:
+            gpn = -(-int(conf['gpus'].split(':')[-1]) // (nodes or 1));
+        if nodes is not None or ppn is not None or gpn is not None:
+            self._nodes = [dict(count=nodes or 1, name=None, ppn=ppn, gpus=gpn, features=None)]; # a single node without -N
+        if 'mem-per-cpu' in conf:
+            self._memory_per_proc = parse_memory(conf['mem-per-cpu']); # in bytes
+        if 'time' in conf:
+            self._walltime = parse_time(conf['time']);
+
+    @classmethod
+    def add_args_to_parser(cls, parser):
+        """
+        Adds the sbatch arguments to parser.
+        The arguments defined here are available to be overloaded. All other sbatch
+        commands are stored in remainder and forwarded to sbatch.
+        """
+        names = dict();
+        for option, name in _sbatch_options.items():
+            names.setdefault(name, []).append(option);
+        for name, options in sorted(names.items()):
+            parser.add_argument(*sorted(options, key=len), dest=name, default=None, type=str);
+        for option, name in sorted(_sbatch_flags.items()):
+            parser.add_argument(option, dest=name, default=None, action='store_true');
+        parser.add_argument(
+            'remainder',
+            nargs=argparse.REMAINDER
+        )
+
+    def _write_preamble_line(self, stream, option, value=None):
+        if value is None:
+            stream.write("{prefix} --{option}\n".format(prefix=self.preable_prefix, option=option));
+        else:
+            stream.write("{prefix} --{option}={value}\n".format(prefix=self.preable_prefix, option=option, value=value));
+
+    def write_array_range(self, stream, first, last):
+        self._write_preamble_line(stream, 'array', '{}-{}'.format(first, last));
+
+    def write_preamble(self, stream, name=None):
+        """
+        writes the preamble to stream. stream object must have a write method.
+        """
+        if name is not None: # name could be specified on command line
+            self._write_preamble_line(stream, 'job-name', name);
+        for key, value in self._config.items():
+            if key == 'job-name' and name is not None:
+                continue;
+            if isinstance(value, bool):
+                if value:
+                    self._write_preamble_line(stream, key);
+            else:
+                self._write_preamble_line(stream, key, value);
+
+    # The states of squeue --format %t and of sacct.
+    _states = {
+        'PD': 'queued', 'PENDING': 'queued', 'CF': 'queued', 'CONFIGURING': 'queued',
+        'RQ': 'queued', 'REQUEUED': 'queued', 'RF': 'queued', 'REQUEUE_FED': 'queued',
+        'R': 'active', 'RUNNING': 'active', 'CG': 'active', 'COMPLETING': 'active',
+        'SO': 'active', 'STAGE_OUT': 'active', 'SI': 'active', 'SIGNALING': 'active',
+        'RS': 'active', 'RESIZING': 'active',
+        'S': 'held', 'SUSPENDED': 'held', 'ST': 'held', 'STOPPED': 'held',
+        'RH': 'held', 'REQUEUE_HOLD': 'held', 'RD': 'held', 'RESV_DEL_HOLD': 'held',
+        'CD': 'inactive', 'COMPLETED': 'inactive', 'CA': 'inactive', 'CANCELLED': 'inactive',
+        'PR': 'inactive', 'PREEMPTED': 'inactive', 'RV': 'inactive', 'REVOKED': 'inactive',
+        'F': 'error', 'FAILED': 'error', 'TO': 'error', 'TIMEOUT': 'error',
+        'NF': 'error', 'NODE_FAIL': 'error', 'OOM': 'error', 'OUT_OF_MEMORY': 'error',
+        'BF': 'error', 'BOOT_FAIL': 'error', 'DL': 'error', 'DEADLINE': 'error',
+        'SE': 'error', 'SPECIAL_EXIT': 'error',
+    }
 
-    def _parse_args(self, args):
-        raise NotImplementedError("SLURMConfig._parse_args is not implemented yet!");
+    def job_status(self, result):
+        """
+        Parses the '|' delimited output of squeue --format %i|%j|%t or
+        sacct --parsable2 --format JobID,JobName,State line by line and yields a
+        tuple of (job id, job name, status) for each job. result is a binary
+        file object, which can be the stdout pipe of the command, so the memory
+        does not grow with the number of jobs. Job steps reported by sacct are
+        skipped.
+        """
+        from ..scheduler import JobStatus
+        for line in result:
+            line = line.decode('utf-8', 'replace').rstrip('\n')
+            fields = line.split('|')
+            if len(fields) < 3:
+                continue
+            jobid = fields[0].strip()
+            if '.' in jobid: # a job step
+                continue
+            state = fields[-1].split()[0] if fields[-1].strip() else ''
+            yield jobid, '|'.join(fields[1:-1]), JobStatus[self._states.get(state, 'registered')]
@@ -1,8 +1,56 @@
 # Copyright (c) 2017 The Regents of the University of Michigan
 # All rights reserved.
 # This software is licensed under the BSD 3-Clause License.
+import re
+import string
+
+_field_root = re.compile(r'[^.\[]*')
+
+class ScriptTemplate(object):
+    """
+    An operation script that has been parsed once. fields is the set of names
+    used by the script. A template is rendered with a mapping that only has
+    to provide the fields that are used, see :class:`LazyFields`.
+    """
+    _parser = string.Formatter()
+
+    def __init__(self, script):
+        self.script = script
+        self.fields = set()
+        self._parse(script)
+
+    def _parse(self, script):
+        for literal, field, spec, conversion in self._parser.parse(script):
+            if field is None:
+                continue
+            root = _field_root.match(field).group(0)
+            if root == '' or root.isdigit():
+                raise ValueError("Positional field {{{}}} in script template {!r}.".format(field, self.script))
+            self.fields.add(root)
+            if spec:
+                self._parse(spec)
+
+    def render(self, fields):
+        return self.script.format_map(fields)
+
+class LazyFields(dict):
+    """
+    A mapping of template fields. The values of getters (a mapping of name to a
+    function without arguments) are only evaluated when the template accesses them.
+    """
+
+    def __init__(self, getters, **values):
+        dict.__init__(self, **values)
+        self._getters = getters
+
+    def __missing__(self, key):
+        if key not in self._getters:
+            raise KeyError(key)
+        value = self[key] = self._getters[key]()
+        return value
 
 class ScriptFormatter(object):
+    _templates = dict() # the compiled scripts, shared by all formatters
     #TODO: think if we can remove the header + script and just have a single entry.
     # def format_header(self, header, host, submitconf, project, operation, nprocs=None, **kwargs):
     #     """
@@ -69,7 +117,35 @@ class ScriptFormatter(object):
             * memory: the amount memory in MB requested
             * walltime: the amount of time in seconds requested
         """
+        return next(self.format_many(
+            script, project, operation, [job], nprocs=nprocs, ngpus=ngpus,
+            walltime=walltime, memory=memory, mpicmd=mpicmd, **kwargs))
+
+    def compile(self, script):
+        "Returns the :class:`ScriptTemplate` of script, each script is parsed only once."
+        template = self._templates.get(script)
+        if template is None:
+            template = self._templates[script] = ScriptTemplate(script)
+        return template
+
+    def format_many(self,
+                    script,
+                    project,
+                    operation,
+                    jobs,
+                    nprocs=None,
+                    ngpus=None,
+                    walltime=None,
+                    memory=None,
+                    mpicmd=None,
+                    **kwargs):
+        """
+        Yields the formatted script for each job in jobs, see :meth:`format`.
+        The script is parsed once and the workspace and statepoint of a job are
+        only fetched if the script uses them.
+        """
         #* parameters: the parameters defined by the project. you can access specific parameters
+        template = self.compile(script)
         np = 0 if nprocs is None else nprocs
         ng = 0 if ngpus is None else ngpus
         mem = 0 if memory is None else memory
@@ -77,18 +153,19 @@ class ScriptFormatter(object):
         mpi = "" if mpicmd is None else mpicmd.format(nprocs=np);
 
         fparams = dict(
-            project_root=project.root_directory(),
             operation=operation.name,
-            job=job,
-            workspace=job.workspace(),
-            statepoint=job.statepoint(),
             mpicmd=mpi,
             nprocs=np,
             ngpus=ng,
             memory=mem,
             walltime=walltime
         );
-        return script.format(**fparams, **kwargs)
+        fparams.update(kwargs)
+        if 'project_root' in template.fields:
+            fparams['project_root'] = project.root_directory()
+        for job in jobs:
+            getters = dict(workspace=job.workspace, statepoint=job.statepoint)
+            yield template.render(LazyFields(getters, job=job, **fparams))
 
 # TODO: move this into the project template as an example of how to add
 class HoomdScriptFormatter(ScriptFormatter):
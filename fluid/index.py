@@ -0,0 +1,337 @@
+# Copyright (c) 2017 The Regents of the University of Michigan
+# All rights reserved.
+# This software is licensed under the BSD 3-Clause License.
+import os
+import json
+import errno
+import base64
+import logging
+from array import array
+
+# numpy is imported on first use by _numpy(), importing it takes longer than
+# importing the rest of the package.
+np = False
+
+def _numpy():
+    "Returns numpy, or None if it is not installed."
+    global np
+    if np is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        np = numpy
+    return np
+
+logger = logging.getLogger("flow.{}".format(__name__))
+
+FN_STATEPOINT = 'signac_statepoint.json'
+FN_DOCUMENT = 'signac_job_document.json'
+
+
+def _flatten(d, prefix=''):
+    "Flatten a nested state point into a dictionary with dotted keys."
+    flat = dict()
+    for k, v in d.items():
+        if isinstance(v, dict):
+            flat.update(_flatten(v, prefix + k + '.'))
+        else:
+            flat[prefix + k] = v
+    return flat
+
+def _normalize(value):
+    "Integral floats as int, so that numbers that compare equal have the same key, bools are kept."
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return dict((k, _normalize(v)) for k, v in value.items())
+    return value
+
+def _canonical(value):
+    return json.dumps(_normalize(value), sort_keys=True)
+
+def _encode(a):
+    return base64.b64encode(a.tobytes()).decode('ascii')
+
+def _decode(typecode, s):
+    a = array(typecode)
+    a.frombytes(base64.b64decode(s.encode('ascii')))
+    return a
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+        return 0.0
+
+def _read_json(path, default=None):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+class _Column(object):
+    """
+    A dictionary encoded column. Each distinct value is stored once and the rows
+    hold the code of their value, -1 marks rows without the key. Numbers that
+    compare equal (1 and 1.0) share a code.
+    """
+
+    def __init__(self, values=None, codes=None):
+        self.values = list(values) if values is not None else []
+        self.codes = codes if codes is not None else array('i')
+        self._lookup = dict((_canonical(v), i) for i, v in enumerate(self.values))
+        self._postings = None
+
+    def code(self, value):
+        return self._lookup.get(_canonical(value))
+
+    def append(self, value):
+        c = self.code(value)
+        if c is None:
+            c = self._lookup[_canonical(value)] = len(self.values)
+            self.values.append(value)
+        self.codes.append(c)
+        self._postings = None
+
+    def set_codes(self, codes):
+        self.codes = codes
+        self._postings = None
+
+    def postings(self):
+        "The rows of each code, the inverted index of the column. Built on first use."
+        if self._postings is None:
+            if _numpy() is not None:
+                codes = np.frombuffer(self.codes, dtype=np.int32) if self.codes else np.empty(0, dtype=np.int32)
+                order = np.argsort(codes, kind='stable')
+                counts = np.bincount(codes[codes >= 0], minlength=len(self.values))
+                start = np.count_nonzero(codes < 0)
+                bounds = start + np.concatenate(([0], np.cumsum(counts)))
+                self._postings = [order[bounds[i]:bounds[i+1]] for i in range(len(self.values))]
+                del codes # release the buffer of self.codes
+            else:
+                self._postings = [[] for _ in self.values]
+                for row, c in enumerate(self.codes):
+                    if c >= 0:
+                        self._postings[c].append(row)
+        return self._postings
+
+
+class StatepointIndex(object):
+    """
+    A columnar index of the state points and the submission status of all jobs
+    in a workspace. Each state point key (nested keys in dot notation) is stored
+    as a dictionary encoded column, so a job can be matched by its state point
+    without opening it. The index is brought up to date with :meth:`update`,
+    which only reads the state points of new jobs and the documents that changed.
+
+    .. code-block:: python
+
+        index = project.statepoint_index()
+        job_ids = index.find_job_ids({'shape.name': 'cube'})
+    """
+
+    def __init__(self, filename=None):
+        self._filename = filename
+        self._ids = []
+        self._rows = dict()
+        self._stamps = array('d')
+        self._status = []
+        self._columns = dict()
+        if filename is not None and os.path.isfile(filename):
+            self._load(_read_json(filename, dict()))
+
+    def _load(self, data):
+        try:
+            ids = data['ids']
+            stamps = _decode('d', data['stamps'])
+            columns = dict(
+                (k, _Column(c['values'], _decode('i', c['codes'])))
+                for k, c in data['columns'].items())
+            status = data['status']
+            if any(len(c._lookup) != len(c.values) for c in columns.values()):
+                raise ValueError("duplicate values") # written with another normalization
+        except (KeyError, TypeError, ValueError):
+            logger.warning("Ignoring corrupted state point index {!r}.".format(self._filename))
+            return
+        self._ids = ids
+        self._rows = dict((jid, i) for i, jid in enumerate(ids))
+        self._stamps = stamps
+        self._status = status
+        self._columns = columns
+
+    def save(self, filename=None):
+        filename = self._filename if filename is None else filename
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        data = dict(
+            ids=self._ids,
+            stamps=_encode(self._stamps),
+            status=self._status,
+            columns=dict(
+                (k, dict(values=c.values, codes=_encode(c.codes)))
+                for k, c in self._columns.items()))
+        tmp = filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp, filename)
+
+    def _append(self, jid, statepoint, stamp, status):
+        row = len(self._ids)
+        flat = _flatten(statepoint)
+        for key in flat:
+            if key not in self._columns:
+                self._columns[key] = _Column(codes=array('i', [-1] * row))
+        for key, column in self._columns.items():
+            if key in flat:
+                column.append(flat[key])
+            else:
+                column.codes.append(-1)
+        self._ids.append(jid)
+        self._rows[jid] = row
+        self._stamps.append(stamp)
+        self._status.append(status)
+
+    def _remove(self, removed):
+        keep = [i for i, jid in enumerate(self._ids) if jid not in removed]
+        self._ids = [self._ids[i] for i in keep]
+        self._rows = dict((jid, i) for i, jid in enumerate(self._ids))
+        self._stamps = array('d', (self._stamps[i] for i in keep))
+        self._status = [self._status[i] for i in keep]
+        for column in self._columns.values():
+            column.set_codes(array('i', (column.codes[i] for i in keep)))
+
+    def update(self, workspace, documents=True):
+        """
+        Synchronize the index with the job directories in workspace. Returns
+        the number of jobs that were added, removed or changed. If documents is
+        False only new and removed jobs are synchronized, the status of new jobs
+        is then read on the next update with documents.
+        """
+        try:
+            job_ids = set(os.listdir(workspace))
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+            job_ids = set()
+        changed = 0
+        removed = set(self._ids).difference(job_ids)
+        if removed:
+            self._remove(removed)
+            changed += len(removed)
+        for jid in job_ids:
+            path = os.path.join(workspace, jid)
+            row = self._rows.get(jid)
+            if not documents:
+                if row is not None:
+                    continue
+                stamp, status = -1.0, dict()
+            else:
+                stamp = _mtime(os.path.join(path, FN_DOCUMENT))
+                if row is not None and self._stamps[row] == stamp:
+                    continue
+                document = _read_json(os.path.join(path, FN_DOCUMENT), dict())
+                status = dict(document.get('status', dict()))
+            if row is None:
+                statepoint = _read_json(os.path.join(path, FN_STATEPOINT))
+                if statepoint is None: # not a job directory.
+                    continue
+                self._append(jid, statepoint, stamp, status)
+            else:
+                self._stamps[row] = stamp
+                self._status[row] = status
+            changed += 1
+        return changed
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, job_id):
+        return job_id in self._rows
+
+    def job_ids(self):
+        return list(self._ids)
+
+    def keys(self):
+        return list(self._columns.keys())
+
+    def values(self, key):
+        "The distinct values of key."
+        return list(self._columns[key].values)
+
+    def column(self, key, job_ids):
+        """
+        The dictionary encoded values of key for job_ids. Returns the distinct
+        values and an array('i') of the code of each job, -1 where the key or
+        the job is missing.
+        """
+        column = self._columns.get(key)
+        if column is None:
+            return [], array('i', [-1] * len(job_ids))
+        rows = self._rows
+        return list(column.values), array('i', (
+            column.codes[rows[jid]] if jid in rows else -1 for jid in job_ids))
+
+    def get(self, job_id, key, default=None):
+        "The value of key for job_id, default where the key or the job is missing."
+        column = self._columns.get(key)
+        row = self._rows.get(job_id)
+        if column is None or row is None:
+            return default
+        code = column.codes[row]
+        return default if code < 0 else column.values[code]
+
+    def lookup(self, key, value):
+        "The ids of the jobs whose state point has value at key, from the inverted index."
+        column = self._columns.get(key)
+        code = None if column is None else column.code(value)
+        if code is None:
+            return frozenset()
+        ids = self._ids
+        return frozenset(ids[r] for r in column.postings()[code])
+
+    def find_job_ids(self, filter_map):
+        "The ids of the jobs whose state point contains all key-value pairs of filter_map."
+        rows = None
+        for key, value in _flatten(filter_map).items():
+            column = self._columns.get(key)
+            if column is None:
+                return []
+            code = column.code(value)
+            found = set() if code is None else set(column.postings()[code])
+            rows = found if rows is None else rows.intersection(found)
+            if not rows:
+                return []
+        if rows is None:
+            return list(self._ids)
+        return [self._ids[i] for i in sorted(rows)]
+
+    def match(self, key, value, job_ids, missing=False):
+        """
+        Compare the value of key for each of job_ids with value. Jobs without the
+        key, and jobs that are not indexed yet, match if missing is True. Returns
+        a numpy boolean array if numpy is available, otherwise a list.
+        """
+        column = self._columns.get(key)
+        if column is None:
+            return [missing] * len(job_ids) if _numpy() is None else np.full(len(job_ids), missing, dtype=bool)
+        code = column.code(value)
+        code = -2 if code is None else code
+        codes = self.column(key, job_ids)[1]
+        if _numpy() is not None:
+            codes = np.frombuffer(codes, dtype=np.int32) if codes else np.empty(0, dtype=np.int32)
+            mask = codes == code
+            return mask | (codes == -1) if missing else mask
+        return [c == code or (missing and c == -1) for c in codes]
+
+    def status(self, job_id, submit_name, default=0):
+        "The submission status of submit_name stored in the document of job_id, default for jobs that are not indexed."
+        row = self._rows.get(job_id)
+        return default if row is None else self._status[row].get(submit_name, default)
@@ -1,3 +1,4 @@
 from .selector import Selector
+from .loader import load, Batch
 
-__all__ = ['Selector']
+__all__ = ['Selector', 'load', 'Batch']
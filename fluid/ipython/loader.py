@@ -0,0 +1,239 @@
+# Copyright (c) 2017 The Regents of the University of Michigan
+# All rights reserved.
+# This software is licensed under the BSD 3-Clause License.
+import os
+import glob
+import json
+import shutil
+import logging
+import threading
+from hashlib import sha1
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+try:
+    import gsd.fl
+except ImportError:
+    gsd = None
+
+logger = logging.getLogger("flow.{}".format(__name__))
+
+
+def _read_npy(fn, mmap):
+    name = os.path.splitext(os.path.basename(fn))[0]
+    return {name: np.load(fn, mmap_mode='r' if mmap else None)}
+
+def _read_npz(fn, mmap):
+    with np.load(fn) as data:
+        return dict((name, data[name]) for name in data.files)
+
+def _read_hdf5(fn, mmap):
+    if h5py is None:
+        raise RuntimeError("Reading {} requires h5py.".format(fn))
+    arrays = dict()
+    def visit(name, item):
+        if isinstance(item, h5py.Dataset):
+            arrays[name] = item[()]
+    with h5py.File(fn, 'r') as file:
+        file.visititems(visit)
+    return arrays
+
+def _read_gsd(fn, mmap):
+    "Each chunk of a gsd file, stacked over the frames if the shapes agree."
+    if gsd is None:
+        raise RuntimeError("Reading {} requires gsd.".format(fn))
+    arrays = dict()
+    with gsd.fl.open(name=fn, mode='r') as file:
+        for name in file.find_matching_chunk_names(''):
+            frames = [file.read_chunk(frame=i, name=name) for i in range(file.nframes)
+                      if file.chunk_exists(frame=i, name=name)]
+            arrays[name] = _stack(frames)
+    return arrays
+
+_readers = {
+    '.npy': _read_npy,
+    '.npz': _read_npz,
+    '.h5': _read_hdf5,
+    '.hdf5': _read_hdf5,
+    '.gsd': _read_gsd,
+}
+
+def _stack(arrays):
+    "Stack arrays along a new first axis if they have the same shape and dtype, otherwise return the list."
+    if arrays and all(isinstance(a, np.ndarray) for a in arrays):
+        first = arrays[0]
+        if all(a.shape == first.shape and a.dtype == first.dtype for a in arrays):
+            return np.stack(arrays)
+    return list(arrays)
+
+
+class _FileCache(object):
+    """
+    Stores the arrays read from a file as .npy files in cache_dir, in a directory
+    per file keyed by its path, and below it by the size and modification time
+    of the file, so they are memory mapped on the next read. The entries of
+    older versions of a file are removed when a new one is stored. Files that
+    are memory mapped anyway (.npy) are not cached.
+    """
+
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+
+    def _dir(self, fn):
+        return os.path.join(self._cache_dir, sha1(os.path.abspath(fn).encode()).hexdigest())
+
+    def _path(self, fn):
+        st = os.stat(fn)
+        key = json.dumps([st.st_size, st.st_mtime])
+        return os.path.join(self._dir(fn), sha1(key.encode()).hexdigest())
+
+    def get(self, fn, mmap):
+        path = self._path(fn)
+        try:
+            with open(os.path.join(path, 'names.json')) as file:
+                names = json.load(file)
+            return dict((name, np.load(os.path.join(path, '{}.npy'.format(i)), mmap_mode='r' if mmap else None))
+                        for i, name in enumerate(names))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def set(self, fn, arrays):
+        names = [name for name, a in arrays.items() if isinstance(a, np.ndarray) and a.dtype != object]
+        if len(names) != len(arrays):
+            return # only plain arrays are cached.
+        path = self._path(fn)
+        dirname = os.path.dirname(path)
+        if os.path.isdir(dirname): # drop the arrays of older versions of fn
+            for name in os.listdir(dirname):
+                if not name.endswith('.tmp'):
+                    shutil.rmtree(os.path.join(dirname, name), ignore_errors=True)
+        tmp = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        os.makedirs(tmp)
+        for i, name in enumerate(names):
+            np.save(os.path.join(tmp, '{}.npy'.format(i)), arrays[name])
+        with open(os.path.join(tmp, 'names.json'), 'w') as file:
+            json.dump(names, file)
+        try:
+            os.rename(tmp, path)
+        except OSError: # written concurrently
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+class Batch(object):
+    """
+    The arrays loaded by :func:`load`. The arrays of each name are stacked
+    along a new first axis, one entry per file, if their shapes and types
+    agree and they are not memory mapped (see :func:`load`), and otherwise
+    kept as a list with None for the files without it.
+    """
+
+    def __init__(self, job_ids, files, arrays):
+        self._job_ids = job_ids
+        self._files = files
+        self._arrays = arrays
+
+    def __len__(self):
+        return len(self._files)
+
+    def __getitem__(self, name):
+        return self._arrays[name]
+
+    def __contains__(self, name):
+        return name in self._arrays
+
+    def keys(self):
+        return list(self._arrays.keys())
+
+    def job_ids(self):
+        "The id of the job of each file."
+        return list(self._job_ids)
+
+    def files(self):
+        return list(self._files)
+
+
+def load(jobs, pattern, project=None, cache_dir=None, max_workers=8, mmap=False, stack=True):
+    """
+    Load the files matching pattern in the workspace of each job concurrently.
+
+    The supported formats are .npy, .npz, HDF5 (.h5, .hdf5, requires h5py)
+    and gsd (requires gsd). The arrays read from the other formats are cached
+    as .npy files in cache_dir, by default <root>/.flow/cache if project is
+    given, and read from the cache when loaded again. The arrays of each name
+    are stacked unless they are memory mapped.
+
+    .. code-block:: python
+
+        s = Selector(project, ['N', 'kT'])
+        batch = load(s.value, 'data/*.npz', project=project)
+        energy = batch['energy']  # one row per file
+
+    :param jobs: The jobs, e.g. :attr:`Selector.value`.
+    :param pattern: A glob pattern relative to the job workspace.
+    :param project: The project of the jobs, used to locate the cache.
+    :param cache_dir: The cache directory, None and no project disables the cache.
+    :param max_workers: The number of threads reading files.
+    :param mmap: Memory map the .npy files and the cached arrays. The arrays
+        are then kept as lists, stacking them would copy them into memory.
+    :param stack: Stack the arrays of each name, otherwise keep them as lists.
+    :rtype: :class:`Batch`
+    :raises RuntimeError: If numpy is not installed.
+    """
+    if np is None:
+        raise RuntimeError("load() requires numpy.")
+    if cache_dir is None and project is not None:
+        cache_dir = os.path.join(project.root_directory(), '.flow', 'cache')
+    cache = None
+    if cache_dir is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        cache = _FileCache(cache_dir)
+
+    job_ids, files = [], []
+    for job in jobs:
+        for fn in sorted(glob.glob(os.path.join(job.workspace(), pattern))):
+            ext = os.path.splitext(fn)[1].lower()
+            if ext not in _readers:
+                logger.warning("Skipping {}, the format is not supported.".format(fn))
+                continue
+            job_ids.append(job.get_id())
+            files.append(fn)
+
+    def read(fn):
+        ext = os.path.splitext(fn)[1].lower()
+        if cache is None or ext == '.npy':
+            return _readers[ext](fn, mmap)
+        arrays = cache.get(fn, mmap)
+        if arrays is None:
+            arrays = _readers[ext](fn, mmap)
+            cache.set(fn, arrays)
+        return arrays
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        results = list(executor.map(read, files))
+
+    names = dict() # the names in the order of their first occurrence
+    for arrays in results:
+        for name in arrays:
+            names.setdefault(name, None)
+    columns = dict()
+    for name in names:
+        column = [arrays.get(name) for arrays in results]
+        columns[name] = _stack(column) if stack and not mmap else column
+    return Batch(job_ids, files, columns)
+
+
+def clear_cache(project=None, cache_dir=None):
+    "Remove the cache of :func:`load`."
+    if cache_dir is None:
+        cache_dir = os.path.join(project.root_directory(), '.flow', 'cache')
+    shutil.rmtree(cache_dir, ignore_errors=True)
@@ -1,51 +1,42 @@
+import os
+import json
+from collections import OrderedDict
+
 from ipywidgets import IntSlider, Dropdown
 from IPython.display import display
 
-def _get_value(d, keys, i=0):
-    if type(d) != dict:
-        return d;
-    if type(keys) == str:
-        ks = keys.split('.');
-    else:
-        ks = keys;
-    if i == len(keys):
-        return d;
-    assert ks[i] in d;
-    return _get_value(d[ks[i]], ks, i+1)
-
-def __get_keys(d):
-    keys = set();
-    for k in d:
-        if type(d[k]) == dict:
-            nested = __get_keys(d[k]);
-            for _k in nested:
-                keys.add(k + '.' + _k);
-        else:
-            keys.add(k);
-    return keys;
-
-def _get_statepoint_keys(project, n=10, job_filter=None):
-    ct=0;
-    keys = set();
-    for job in project.find_jobs(job_filter):
-        statepoint = job.statepoint();
-        if n > 0 and ct < n:
-            keys.update(__get_keys(statepoint));
-        else:
-            break;
-        ct+=1;
-    return keys;
-
-def _get_statepoint_options(project, keys, job_filter=None):
-    ct=0;
-    options = dict();
-    for k in keys:
-        options[k] = set();
-    for job in project.find_jobs(job_filter):
-        statepoint = job.statepoint();
-        for k in keys:
-            options[k].add(_get_value(statepoint, k))
-    return options;
+from ..index import StatepointIndex, _canonical
+from .loader import load
+
+_indexes = dict();
+
+def _get_index(project):
+    """
+    The state point index of project. The index is kept for the lifetime of the
+    process and stored in the project root, it is synchronized with the
+    workspace on each call, which only reads the state points of new jobs.
+    """
+    root = project.root_directory();
+    index = _indexes.get(root);
+    if index is None:
+        index = _indexes[root] = StatepointIndex(os.path.join(root, '.flow', 'index.json'));
+    if index.update(project.workspace(), documents=False):
+        index.save();
+    return index;
+
+def _filter_job_ids(project, index, job_filter=None):
+    "The ids of the jobs matching job_filter, from the index unless the filter uses operators."
+    if not job_filter:
+        return frozenset(index.job_ids());
+    if '"$' in json.dumps(job_filter):
+        return frozenset(job.get_id() for job in project.find_jobs(job_filter));
+    return frozenset(index.find_job_ids(job_filter));
+
+def _sorted(values):
+    try:
+        return sorted(values);
+    except TypeError: # mixed types
+        return sorted(values, key=str);
 
 def _expand_keys(d):
     _d = dict();
@@ -64,28 +55,124 @@ def _expand_keys(d):
 
 
 class Selector:
+    """
+    Dropdowns to select jobs by the values of state point keys. The keys, their
+    values and the jobs with each value are looked up in the state point index of
+    the project, so the project is not scanned. The options of each dropdown are
+    narrowed to the values that are compatible with the selection of the
+    dropdowns before it.
+
+    A selection is resolved by intersecting the sets of the jobs with each of
+    the selected values, the results of the last memo_size selections are kept.
+    Callbacks registered with :meth:`observe` are called with the selected jobs
+    whenever the set of selected jobs changes.
+
+    .. code-block:: python
+
+        s = Selector(project, select=['shape_data.short_name', 'shape_move'])
+        s.observe(lambda jobs: plot(jobs))
+        s.display()
 
-    def __init__(self, project, select, job_filter=None, n=1, **kwargs):
+    The argument n is no longer used, all keys of the index are available.
+    """
 
-        avail = _get_statepoint_keys(project, n, job_filter);
+    def __init__(self, project, select, job_filter=None, n=1, memo_size=128, **kwargs):
+
+        self._index = _get_index(project);
+        avail = set(self._index.keys());
         self._value = None;
         self._dropdowns = [];
         self._filter = job_filter if job_filter is not None else dict();
         self._project = project;
+        self._updating = False;
+        self._sets = dict();
+        self._memo = OrderedDict();
+        self._memo_size = memo_size;
+        self._observers = [];
 
         for s in select:
             if not s in avail: # now we can add a drop down.
-                raise RuntimeError("Error! The key {} is not found in the statepoint. \nOptions are: {}".format(s, ', '.join(avail)))
+                raise RuntimeError("Error! The key {} is not found in the statepoint. \nOptions are: {}".format(s, ', '.join(sorted(avail))))
 
-        opts = _get_statepoint_options(project, select, job_filter)
-        for opt in opts:
+        self._job_ids = _filter_job_ids(project, self._index, job_filter);
+        for s in select:
             self._dropdowns.append(
                 Dropdown(
-                    options = sorted(list(opts[opt])),
-                    description = opt,
+                    options = self._options(s, self._job_ids),
+                    description = s,
                     button_style = ''
                 )
             )
+        self._narrow();
+        self._value = self._selected();
+        for d in self._dropdowns:
+            d.observe(self._on_change, names='value');
+
+    def _options(self, key, job_ids):
+        "The distinct values of key among job_ids."
+        values, codes = self._index.column(key, list(job_ids));
+        return _sorted(values[c] for c in set(codes) if c >= 0);
+
+    def _set(self, key, value):
+        "The ids of the jobs with value at key, computed once per key and value."
+        k = (key, _canonical(value));
+        job_ids = self._sets.get(k);
+        if job_ids is None:
+            job_ids = self._sets[k] = self._index.lookup(key, value);
+        return job_ids;
+
+    def _selected(self, count=None):
+        "The ids of the jobs matching the selection of the first count dropdowns, all by default."
+        dropdowns = self._dropdowns[:count];
+        selection = tuple((d.description, _canonical(d.value)) for d in dropdowns);
+        job_ids = self._memo.get(selection);
+        if job_ids is not None:
+            self._memo.move_to_end(selection);
+            return job_ids;
+        job_ids = self._job_ids;
+        for job_set in sorted((self._set(d.description, d.value) for d in dropdowns), key=len):
+            if not job_ids:
+                break;
+            job_ids = job_ids.intersection(job_set);
+        self._memo[selection] = job_ids;
+        if len(self._memo) > self._memo_size:
+            self._memo.popitem(last=False);
+        return job_ids;
+
+    def _narrow(self):
+        "Restrict the options of each dropdown to the values compatible with the dropdowns before it."
+        if self._updating:
+            return;
+        self._updating = True;
+        try:
+            for i, d in enumerate(self._dropdowns):
+                options = self._options(d.description, self._selected(i));
+                if list(d.options) != options:
+                    value = d.value;
+                    d.options = options;
+                    if value in options:
+                        d.value = value;
+        finally:
+            self._updating = False;
+
+    def _on_change(self, change):
+        if self._updating:
+            return;
+        self._narrow();
+        job_ids = self._selected();
+        if job_ids != self._value:
+            self._value = job_ids;
+            if self._observers:
+                jobs = self.value;
+                for callback in list(self._observers):
+                    callback(jobs);
+
+    def observe(self, callback):
+        "Call callback with the list of selected jobs whenever the selected set of jobs changes."
+        self._observers.append(callback);
+
+    def unobserve(self, callback):
+        self._observers.remove(callback);
 
     def display(self):
         for d in self._dropdowns:
@@ -99,9 +186,18 @@ class Selector:
         job_filter.update(_expand_keys(opts));
         return job_filter;
 
+    @property
+    def job_ids(self):
+        "The ids of the selected jobs."
+        return self._selected();
+
+    def load(self, pattern, **kwargs):
+        "Load the files matching pattern of the selected jobs, see :func:`~.loader.load`."
+        return load(self.value, pattern, project=self._project, **kwargs);
+
     @property
     def value(self):
-        return list(self._project.find_jobs(filter=self._get_filter()));
+        return [self._project.open_job(id=jid) for jid in sorted(self._selected())];
 
 
 # s = Selector(project, select = ['shape_data.short_name', 'shape_move'])
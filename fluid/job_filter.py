@@ -1,123 +1,426 @@
 # Copyright (c) 2017 The Regents of the University of Michigan
 # All rights reserved.
 # This software is licensed under the BSD 3-Clause License.
+import numbers
+
 from . import scheduler
 
-# the logical clases are for internal use only.
+# numpy is imported on first use by _numpy(), importing it takes longer than
+# importing the rest of the package.
+np = False
+
+def _numpy():
+    "Returns numpy, or None if it is not installed."
+    global np
+    if np is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        np = numpy
+    return np
+
+# the logical clases are for internal use only. Combining filters builds a tree
+# of these nodes, which is simplified once and then evaluated over a whole batch
+# of (job, op) pairs at a time. The masks are numpy boolean arrays if numpy is
+# available and lists of bool otherwise.
 # TODO: could also be applied to the FlowCondition's
 
-class _and:
-    def __init__(self, f1, f2):
-        self._f1 = f1
-        self._f2 = f2
+def _full(n, value):
+    if _numpy() is not None:
+        return np.full(n, value, dtype=bool)
+    return [value] * n
+
+def _from_list(values):
+    if _numpy() is not None:
+        return np.array(values, dtype=bool)
+    return values
+
+def _indices(mask, value):
+    if _numpy() is not None:
+        return np.flatnonzero(mask == value)
+    return [i for i, v in enumerate(mask) if v == value]
+
+def _assign(mask, idx, values):
+    if _numpy() is not None:
+        mask[idx] = values
+    else:
+        for i, v in zip(idx, values):
+            mask[i] = bool(v)
+
+def _invert(mask):
+    if _numpy() is not None:
+        return ~mask
+    return [not v for v in mask]
+
+def _differ(mask1, mask2):
+    if _numpy() is not None:
+        return mask1 != mask2
+    return [a != b for a, b in zip(mask1, mask2)]
+
+_missing = object()
+
+def _get_value(statepoint, key):
+    for k in key.split('.'):
+        if not isinstance(statepoint, dict) or k not in statepoint:
+            return _missing
+        statepoint = statepoint[k]
+    return statepoint
+
+
+class _node(object):
+    cost = 1.0
+
+    def simplify(self):
+        return self
+
+    def key(self):
+        return id(self)
+
+    def mask(self, pairs):
+        return _from_list([bool(self(job, op)) for job, op in pairs])
+
+class _const(_node):
+    cost = 0.0
+
+    def __init__(self, value):
+        self.value = bool(value)
+
+    def __call__(self, job, op):
+        return self.value
+
+    def key(self):
+        return ('const', self.value)
+
+    def mask(self, pairs):
+        return _full(len(pairs), self.value)
+
+    def __repr__(self):
+        return repr(self.value)
+
+class _predicate(_node):
+    def __init__(self, callback, cost=1.0):
+        self._callback = callback
+        self.cost = cost
+
+    def __call__(self, job, op):
+        return self._callback(job, op)
+
+    def key(self):
+        return ('predicate', self._callback)
+
+    def __repr__(self):
+        return getattr(self._callback, '__name__', repr(self._callback))
+
+class _statepoint(_node):
+    """
+    Compares the state point value of key with value, jobs without the key do
+    not match. The comparison is done on the whole column at once if possible,
+    if an index is given only the jobs that are not indexed yet are opened.
+    """
+    cost = 0.5
+
+    def __init__(self, key, value, index=None):
+        self._key = key
+        self._value = value
+        self._index = index
+        if index is not None:
+            self.cost = 0.1
+
+    def __call__(self, job, op):
+        v = _get_value(job.statepoint(), self._key)
+        return v is not _missing and v == self._value
+
+    def key(self):
+        return ('statepoint', self._key, repr(self._value))
+
+    def column(self, pairs):
+        statepoints = dict()
+        column = []
+        for job, op in pairs:
+            jid = job.get_id()
+            if jid not in statepoints:
+                statepoints[jid] = job.statepoint()
+            column.append(_get_value(statepoints[jid], self._key))
+        return column
+
+    def mask(self, pairs):
+        if self._index is not None:
+            job_ids = [job.get_id() for job, op in pairs]
+            mask = self._index.match(self._key, self._value, job_ids)
+            new = [i for i, jid in enumerate(job_ids) if jid not in self._index]
+            if new: # created after the last update of the index
+                _assign(mask, new, [self(*pairs[i]) for i in new])
+            return mask
+        column = self.column(pairs)
+        array = self._array(column)
+        if array is not None:
+            return array == self._value
+        return _from_list([v == self._value for v in column])
+
+    def _array(self, column):
+        """
+        The column as a one dimensional numpy array, if all values are scalars
+        of the same kind as the filter value, so comparing the array gives the
+        same result as comparing each value. Otherwise None.
+        """
+        if _numpy() is None or not column:
+            return None
+        types = set(map(type, column))
+        value = self._value
+        if isinstance(value, bool):
+            scalar = types == {bool}
+        elif isinstance(value, numbers.Real):
+            scalar = types <= {int, float}
+        elif isinstance(value, str):
+            scalar = types == {str}
+        else:
+            scalar = False
+        if not scalar:
+            return None
+        array = np.asarray(column)
+        return array if array.ndim == 1 and array.dtype.kind in 'biufU' else None
+
+    def __repr__(self):
+        return "statepoint[{!r}] == {!r}".format(self._key, self._value)
+
+class _and(_node):
+    _identity = True
+
+    def __init__(self, children):
+        self._children = list(children)
+        self.cost = sum(c.cost for c in self._children)
 
     def __call__(self, job, op):
-        return self._f1(job, op) and self._f2(job, op)
+        return all(c(job, op) for c in self._children)
+
+    def key(self):
+        return (type(self).__name__,) + tuple(c.key() for c in self._children)
+
+    def simplify(self):
+        children = []
+        seen = set()
+        for child in self._children:
+            child = child.simplify()
+            nested = child._children if type(child) is type(self) else [child]
+            for c in nested:
+                if isinstance(c, _const):
+                    if c.value != self._identity:
+                        return _const(c.value)
+                    continue
+                if c.key() not in seen:
+                    seen.add(c.key())
+                    children.append(c)
+        if len(children) == 0:
+            return _const(self._identity)
+        if len(children) == 1:
+            return children[0]
+        # evaluate the cheap predicates first, the expensive ones only see
+        # the pairs that are left.
+        return type(self)(sorted(children, key=lambda c: c.cost))
 
-class _or:
-    def __init__(self, f1, f2):
-        self._f1 = f1
-        self._f2 = f2
+    def mask(self, pairs):
+        result = _full(len(pairs), self._identity)
+        for child in self._children:
+            idx = _indices(result, self._identity)
+            if not len(idx):
+                break
+            _assign(result, idx, child.mask([pairs[i] for i in idx]))
+        return result
+
+    def __repr__(self):
+        return "({})".format(' & '.join(repr(c) for c in self._children))
+
+class _or(_and):
+    _identity = False
 
     def __call__(self, job, op):
-        return self._f1(job, op) or self._f2(job, op)
+        return any(c(job, op) for c in self._children)
 
-class _not:
-    def __init__(self, f1):
-        self._f1 = f1
+    def __repr__(self):
+        return "({})".format(' | '.join(repr(c) for c in self._children))
+
+class _not(_node):
+    def __init__(self, child):
+        self._child = child
+        self.cost = child.cost
 
     def __call__(self, job, op):
-        return not self._f1(job, op)
+        return not self._child(job, op)
+
+    def key(self):
+        return ('not', self._child.key())
 
-class _xor:
-    def __init__(self, f1, f2):
-        self._f1 = f1
-        self._f2 = f2
+    def simplify(self):
+        child = self._child.simplify()
+        if isinstance(child, _const):
+            return _const(not child.value)
+        if isinstance(child, _not):
+            return child._child
+        return _not(child)
+
+    def mask(self, pairs):
+        return _invert(self._child.mask(pairs))
+
+    def __repr__(self):
+        return "~{!r}".format(self._child)
+
+class _xor(_node):
+    def __init__(self, child1, child2):
+        self._child1 = child1
+        self._child2 = child2
+        self.cost = child1.cost + child2.cost
 
     def __call__(self, job, op):
-        return self._f1(job, op) != self._f2(job, op)
+        return bool(self._child1(job, op)) != bool(self._child2(job, op))
+
+    def key(self):
+        return ('xor', self._child1.key(), self._child2.key())
+
+    def simplify(self):
+        c1 = self._child1.simplify()
+        c2 = self._child2.simplify()
+        if c1.key() == c2.key():
+            return _const(False)
+        if isinstance(c1, _const):
+            c1, c2 = c2, c1
+        if isinstance(c2, _const):
+            return _not(c1).simplify() if c2.value else c1
+        return _xor(c1, c2)
+
+    def mask(self, pairs):
+        return _differ(self._child1.mask(pairs), self._child2.mask(pairs))
+
+    def __repr__(self):
+        return "({!r} ^ {!r})".format(self._child1, self._child2)
 
 
 class JobFilter(object):
+    """
+    Selects (job, operation) pairs. Filters are combined with the &, |, ^ and ~
+    operators into an expression tree, which can be inspected with
+    :meth:`expression`. Before evaluation the tree is simplified (constants are
+    folded, duplicates removed and cheap predicates moved before expensive ones)
+    and :meth:`job_ops` evaluates it over all pairs at once.
 
-    def __init__(self, callback=None):
-        self._callback = callback
+    :param callback: A function of (job, op) returning True if the pair passes.
+    :param cost: The relative cost of calling callback, used to order predicates.
+    """
+
+    def __init__(self, callback=None, cost=1.0):
+        self._expr = _const(True) if callback is None else _predicate(callback, cost)
+        self._simplified = None
+
+    @classmethod
+    def _from_expr(cls, expr):
+        job_filter = JobFilter()
+        job_filter._expr = expr
+        return job_filter
 
     def __and__(self, other):
         """
         filter3 = filter1 & filter2
         filter3 will be the intersecion of filter1 and filter2
         """
-        return JobFilter(callback=_and(self._callback, other._callback));
+        return JobFilter._from_expr(_and([self._expr, other._expr]))
 
     def __or__(self, other):
         """
         filter3 = filter1 | filter2
         filter3 will be the union of filter1 and filter2
         """
-        return JobFilter(callback=_or(self._callback, other._callback));
+        return JobFilter._from_expr(_or([self._expr, other._expr]))
 
     def __invert__(self):
         """
         filter2 = ~filter1
         filter2 will be the compliment of filter1
         """
-        return JobFilter(callback=_not(self._callback));
+        return JobFilter._from_expr(_not(self._expr))
 
     def __xor__(self, other):
         """
         filter3 = filter1 ^ filter2
         filter3 will be the intersecion of filter1 or filter2
         """
-        return JobFilter(callback=_xor(self._callback, other._callback));
+        return JobFilter._from_expr(_xor(self._expr, other._expr))
+
+    def expression(self):
+        "The simplified expression tree of this filter."
+        if self._simplified is None:
+            self._simplified = self._expr.simplify()
+        return self._simplified
 
     def _eval(self, job, op):
-        if callback is not None:
-            return bool(self._callback(job))
-        return True
+        return bool(self.expression()(job, op))
+
+    def mask(self, pairs):
+        "Evaluate the filter for a sequence of (job, op) pairs at once."
+        return self.expression().mask(pairs)
 
     def job_ops(self, iterable): # find the eligible job operation pairs
-        for job,op in iterable:
-            if self._eval(job,op):
-                yield (job,op)
-
-# class SignacJobFilter(JobFilter):
-#
-#     def __init__(self, filter_map=None):
-#         self._filter_map = filter_map
-#         JobFilter.__init__(self, callback=self._search)
-#
-#     def _search(self, job):
-#         if self._filter_map is None:
-#             return True
-#         sp = job.statepoint()
-#         for key,val in self._filter_map.items():
-#             if key in sp.keys() and sp[key] != val:
-#                 return False
-#         return True
+        pairs = list(iterable)
+        for i in _indices(self.mask(pairs), True):
+            yield pairs[i]
+
+class StatepointFilter(JobFilter):
+    """
+    Selects the jobs whose state point matches all key-value pairs in filter_map,
+    nested keys are given in dot notation e.g. 'shape.name'. Jobs without a key
+    do not match. If a :class:`~.index.StatepointIndex` is given, the values are
+    looked up in the index instead of the job's state point, except for the
+    jobs that are not in the index yet.
+    """
+
+    def __init__(self, filter_map=None, index=None):
+        JobFilter.__init__(self)
+        if filter_map:
+            self._expr = _and([_statepoint(k, v, index) for k, v in filter_map.items()])
 
 class EligibleOperationFilter(JobFilter):
+    """
+    Selects the job-operation pairs that are eligible for execution. The
+    eligible operations of the whole project are determined in a single
+    (optionally parallel) pass with :meth:`FluidProject.eligible_operations`
+    the first time the filter is evaluated, after that each pair is a lookup.
+    """
 
-    def __init__(self, project, operation=None):
+    def __init__(self, project, operation=None, pool=None, eligible=None):
         self._project = project
         self._op = operation
-        JobFilter.__init__(self, callback=self._eligible)
+        self._pool = pool
+        self._eligible_map = eligible
+        JobFilter.__init__(self, callback=self._eligible, cost=10.0)
+
+    def _eligible_names(self, job):
+        if self._eligible_map is None:
+            self._eligible_map = self._project.eligible_operations(pool=self._pool)
+        jid = job.get_id()
+        if jid not in self._eligible_map: # job was created after the scan.
+            self._eligible_map.update(self._project.eligible_operations([job]))
+        return self._eligible_map[jid]
 
     def _eligible(self, job, op):
-        if self._op is None:
-            return op in [o.name for o in self._project.next_operations(job)]
-        return op == self._op and project.operation(self._op).eligible(job)
+        if self._op is not None and op != self._op:
+            return False
+        return op in self._eligible_names(job)
 
 class StatusJobFilter(JobFilter):
+    """
+    Selects the job-operation pairs that have not been submitted yet. If a
+    :class:`~.index.StatepointIndex` is given, the status is read from the index
+    instead of the job document.
+    """
 
-    def __init__(self, project):
+    def __init__(self, project, index=None):
         self._project = str(project)
-        JobFilter.__init__(self, callback=self._eligible_status)
+        self._index = index
+        JobFilter.__init__(self, callback=self._eligible_status, cost=2.0 if index is None else 0.1)
 
     def _eligible_status(self, job, op):
-        state = 0
-        sub_name = util.make_submit_name(op, job, project)
-        status = job.document.get('status',None)
-        if status is not None and sub_name in status:
-            state = status[sub_name]
+        sub_name = scheduler.make_submit_name(op, job, self._project)
+        if self._index is not None and job.get_id() in self._index:
+            state = self._index.status(job.get_id(), sub_name)
+        else:
+            state = job.document.get('status', dict()).get(sub_name, 0)
         return state < scheduler.JobStatus.submitted
@@ -1,56 +1,166 @@
+import logging
+
+# numpy is imported on first use by _numpy(), importing it takes longer than
+# importing the rest of the package.
+np = False
+
+def _numpy():
+    "Returns numpy, or None if it is not installed."
+    global np
+    if np is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        np = numpy
+    return np
+
+logger = logging.getLogger("flow.{}".format(__name__))
+
 # TODO: Remove from project
 _params_warned_once = False
+
+def _read_values(job, names, defaults):
+    document = job.document()
+    return [document.get(name, default) for name, default in zip(names, defaults)]
+
+def _uniform(values):
+    "Whether the values are scalars of one kind or sequences of uniform values of one length."
+    types = set(map(type, values))
+    if types <= {int, float} or types == {bool} or types == {str}:
+        return True
+    if types == {list} or types == {tuple}:
+        return len(set(map(len, values))) == 1 and _uniform([v for value in values for v in value])
+    return False
+
+def _column(values):
+    """
+    The values as a numpy array. The array is of dtype object, an entry per value,
+    if the values are of different types or shapes, so none of them is coerced.
+    """
+    if _numpy() is None:
+        return values
+    if _uniform(values):
+        return np.asarray(values)
+    column = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        column[i] = value
+    return column
+
 class FluidParams(dict):
+    """
+    The parameters of a job, stored in the job document. The document is read
+    once by :meth:`load` and :meth:`save` writes only the parameters that were
+    modified, all in a single document write. Under MPI rank 0 does all of the
+    I/O: it reads the document and broadcasts the values to the other ranks, and
+    it is the only rank that writes. The parameters are expected to be modified
+    identically on all ranks.
+
+    .. code-block:: python
+
+        with MyParams(job) as params:
+            params['steps'] += 1000
+        # the modified parameters are written on exit.
+    """
     defaults = dict() # the default values of the parameters
-    def __init__(self, job, readonly=None):
+    def __init__(self, job, readonly=None, comm=None):
+        global _params_warned_once
         dict.__init__(self)
-        try:
-            # TODO: this may not really be the right case.
-            from mpi4py import MPI
-            self._comm = MPI.COMM_WORLD
+        rank = 0
+        if comm is None:
+            try:
+                # TODO: this may not really be the right case.
+                from mpi4py import MPI
+                comm = MPI.COMM_WORLD
+            except ImportError as err:
+                #TODO:handle error.
+                if not _params_warned_once:
+                    logger.warning("Could not import mpi4py. parameters will default to read only.")
+                    _params_warned_once = True
+                if readonly is None:
+                    readonly = True
+        if comm is not None:
             rank = comm.Get_rank()
-        except ImportError as err:
-            #TODO:handle error.
-            if not _params_warned_once:
-                logger.warning("Could not import mpi4py. parameters will default to read only.")
-                _params_warned_once = True
-            if readonly is None:
-                readonly = True
 
         if readonly is None or type(readonly) is not bool:
             readonly = (rank != 0)
-        self.__dict__.update(dict(_job=job, defaults=self.defaults, _readonly=readonly))
+        self.__dict__.update(dict(_job=job, defaults=self.defaults, _readonly=readonly,
+                                  _comm=comm, _rank=rank, _dirty=set()))
         self.load()
 
     def load(self):
-        for key in self.defaults:
-            self[key] = self._job.document.get(key, self.defaults[key])
+        values = None
+        if self._rank == 0:
+            document = self._job.document() # a single read of the document.
+            values = dict((key, document.get(key, self.defaults[key])) for key in self.defaults)
+        if self._comm is not None:
+            values = self._comm.bcast(values, root=0)
+        dict.update(self, values)
+        self._dirty.clear()
 
     def save(self):
-        if _comm: _comm.Barrier() # ensure all ranks are not accessing the data.
         ret = False
-        if not self._readonly:
-            for key in self.keys():
-                self._job.document[key] = self[key]
+        if not self._readonly and self._rank == 0 and self._dirty:
+            self._job.document.update(dict((key, self[key]) for key in self._dirty))
             ret = True
-        if _comm: _comm.Barrier() # ensure all ranks are not accessing the data.
-        return True
+        self._dirty.clear()
+        if self._comm is not None:
+            self._comm.Barrier() # ensure the document is written before any rank continues.
+        return ret
+
+    def dirty(self):
+        "The names of the parameters modified since the last load or save."
+        return set(self._dirty)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.save()
 
     def __getitem__(self, key):
-        return super(FlowParams, self).__getitem__(key)
+        return super(FluidParams, self).__getitem__(key)
+
+    def __setitem__(self, key, value):
+        super(FluidParams, self).__setitem__(key, value)
+        self._dirty.add(key)
 
     def __setattr__(self, name, value):
         if not hasattr(self.defaults, name):
             raise AttributeError('{} instance has no attribute {!r}'.format(type(self).__name__, name))
-        super(FlowParams, self).__setattr__(name, value)
+        super(FluidParams, self).__setattr__(name, value)
 
     @classmethod
     def get_value(cls, job, name):
         return job.document.get(name, cls.defaults[name])
 
+    @classmethod
+    def get_values(cls, jobs, names, pool=None):
+        """
+        Returns the values of the parameters names for all jobs, reading each
+        job document once. Missing values are filled in from defaults.
+
+        :param jobs: An iterable of jobs.
+        :param names: The names of the parameters.
+        :param pool: A multiprocessing or threading pool to read the documents in parallel.
+        :returns: A dictionary of name to a column of values in the order of jobs,
+            the columns are numpy arrays if numpy is available and lists otherwise.
+        """
+        names = list(names)
+        defaults = [cls.defaults[name] for name in names]
+        jobs = list(jobs)
+        if pool is None:
+            rows = [_read_values(job, names, defaults) for job in jobs]
+        else:
+            rows = pool.starmap(_read_values, [(job, names, defaults) for job in jobs])
+        columns = list(zip(*rows)) if rows else [()] * len(names)
+        return dict((name, _column(list(column))) for name, column in zip(names, columns))
+
     def update(self, src):
-        extra, override = self.extract(src)
-        super(FlowParams, self).update(override)
+        params, unused = self.extract(src)
+        for key in params:
+            self[key] = params[key]
 
     @classmethod
     def extract(cls, src):
@@ -4,15 +4,22 @@
 from __future__ import print_function
 import sys
 import os
+import json
 import errno
+import threading
+import weakref
 from hashlib import sha1
 import logging
 
 import signac
 import flow
+from flow.project import JobOperation
 
 from .config import load_config
+from .condition import FluidCondition, ConditionCache, PersistentConditionCache
 from .job_filter import EligibleOperationFilter
+from .index import StatepointIndex
+from .scheduler import StatusTracker
 from .formatter import ScriptFormatter
 
 
@@ -26,47 +33,105 @@ def _mkdir_p(path):
             raise
 
 
+def _write_atomic(fn, content):
+    "Write content to a temporary file next to fn, unique per process and thread, and rename it to fn."
+    _mkdir_p(os.path.dirname(fn))
+    tmp = "{}.{}.{}.tmp".format(fn, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp, 'w') as f:
+            f.write(content)
+        os.rename(tmp, fn)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _file_hash(fn):
+    try:
+        with open(fn, 'rb') as f:
+            return sha1(f.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+_operation_conditions = weakref.WeakKeyDictionary()
+
+def _fluid_conditions(op):
+    "The conditions of a flow operation as :class:`FluidCondition` lists, so they can be cached."
+    conditions = _operation_conditions.get(op)
+    if conditions is None:
+        conditions = _operation_conditions[op] = (
+            [FluidCondition(cond._callback) for cond in op._prereqs],
+            [FluidCondition(cond._callback) for cond in op._postconds])
+    return conditions
+
+
+def _eligible_chunk(args):
+    "Determine the eligible operations for a chunk of job ids, used by the pool workers."
+    project, job_ids, persistent = args
+    cached = type(project).next_operations is FluidProject.next_operations # not overridden
+    result = dict()
+    with project.condition_cache(persistent) as cache:
+        for jid in job_ids:
+            job = project.open_job(id=jid)
+            ops = project.next_operations(job, cache) if cached else project.next_operations(job)
+            result[jid] = frozenset(op.name for op in ops)
+            cache.clear() # the values of one job are not needed for the next.
+    return result
+
+
+def _project_classes():
+    "The subclasses of FluidProject without subclasses of their own, by class name."
+    classes = dict()
+    stack = list(FluidProject.__subclasses__())
+    while stack:
+        clss = stack.pop()
+        subclasses = clss.__subclasses__()
+        if subclasses:
+            stack.extend(subclasses)
+        else:
+            classes[clss.__name__] = clss
+    return classes
+
+
 def _get_project(root=None, alias=None):
-    assert hasattr(FlowProject, 'registry');
-    registry = FlowProject.registry;
-    logger.debug("FlowProject registry: {}".format(', '.join([k for k in registry.keys()])));
-    clss=None;
+    registry = _project_classes()
+    logger.debug("FluidProject classes: {}".format(', '.join(sorted(registry.keys()))))
     if alias is None:
-        if len(registry) == 0: # no user definitions have been found.
-            logger.error("Could not find flow project definitions.")
-            raise LookupError("signac-flow project not found.");
+        if len(registry) == 0: # no user definitions, use the base class.
+            alias, clss = FluidProject.__name__, FluidProject
         elif len(registry) == 1: # one unambiguous project
-            print(registry)
-            print(list(registry.items()));
-            alias, clss = list(registry.items())[0];
+            alias, clss = list(registry.items())[0]
         else: # ambiguous case. must supply alias.
             logger.error("More than one flow project found, must provide the class alias.")
-            raise LookupError("signac-flow project is ambiguous.");
+            raise LookupError("signac-flow project is ambiguous.")
+    elif alias in registry:
+        clss = registry[alias]
+    elif alias == FluidProject.__name__:
+        clss = FluidProject
     else:
-        if alias in registry:
-            clss = registry[alias];
-        else:
-            logger.error("Could not find flow project named {!r}.".format(alias))
-            raise LookupError("signac-flow project not found.");
-    assert clss is not None; # should never happen at this point.
-    logger.debug("Creating project from {!r}".format(alias));
-    return clss() # TODO: use clss.get_project()? need to overload for flow
+        logger.error("Could not find flow project named {!r}.".format(alias))
+        raise LookupError("signac-flow project not found.")
+    logger.debug("Creating project from {!r}".format(alias))
+    return clss.get_project(root=root)
 
 
 class FluidOperation:
 
-    def __init__(self, prereqs, postconds, script, formatter):
+    def __init__(self, prereqs, postconds, script, formatter, name=None):
         if prereqs is None: prereqs = [ None ]
         if postconds is None: postconds = [ None ]
 
-        self._prerequistes = [ FlowCondition(cond) for cond in prereqs ]
-        self._postconditions = [ FlowCondition(cond) for cond in postconds ]
+        self._prerequistes = [ FluidCondition(cond) for cond in prereqs ]
+        self._postconditions = [ FluidCondition(cond) for cond in postconds ]
         self._script = script
         self._formatter = formatter
+        self.name = name
+
+    def __str__(self):
+        return str(self.name)
 
-    # def __str__(self):
-    #     return self.name;
-    #
     # def is_callable(self):
     #     return self._operation is not None and callable(self._operation)
     #
@@ -74,46 +139,198 @@ class FluidOperation:
     #     assert self.is_callable();
     #     return self._operation(*args, **kwargs)
 
-    def eligible(self, job):
+    def eligible(self, job, cache=None):
         # if preconditions are all true and at least one post condition is false.
-        pre = all([cond(job) for cond in self._prerequistes])
-        post = not all([cond(job) for cond in self._postconditions])
-        return pre and post
+        return all(cond(job, cache) for cond in self._prerequistes) and \
+            not all(cond(job, cache) for cond in self._postconditions)
 
-    def complete(self, job):
-        return all([cond(job) for cond in self._postconditions]) and all([cond(job) for cond in self._prerequistes])
+    def complete(self, job, cache=None):
+        return all(cond(job, cache) for cond in self._prerequistes) and \
+            all(cond(job, cache) for cond in self._postconditions)
 
     def format_script(self, project, job, nprocs=None, ngpus=None, walltime=None, memory=None, mpicmd=None, **kwargs):
         return self._formatter.format(script=self._script, project=project, operation=self, job=job, nprocs=nprocs, ngpus=ngpus, walltime=walltime, memory=memory, mpicmd=mpicmd, **kwargs)
 
+    def _script_input_hash(self, project, job, **kwargs):
+        """
+        A hash of everything the formatted script depends on. The state point is
+        determined by the job id, the job document is hashed as a file, so the
+        script is formatted again if the document changed.
+        """
+        inputs = [type(self._formatter).__name__, self._script, str(self), job.get_id(),
+                  _file_hash(os.path.join(job.workspace(), job.FN_DOCUMENT)),
+                  project.root_directory(), sorted((k, repr(v)) for k, v in kwargs.items())]
+        return sha1(json.dumps(inputs).encode()).hexdigest()
+
     # TODO: Add to fluid project
-    def write_script(self, project, job, nprocs=None, ngpus=None, walltime=None, memory=None, mpicmd=None, **kwargs):
-        root = os.path.join(job.workspace(), '.flow');
-        _mkdir_p(root);
-        script = self.format_script(project, job, nprocs=nprocs, ngpus=ngpus, walltime=walltime, memory=memory, mpicmd=mpicmd, **kwargs);
-        # hexcode = sha1(script.encode()).hexdigest()
-        fn = os.path.join(root, "{operation}.sh".format(operation=self))
-        logger.debug("writing job-operation script to: {}".format(fn));
-        with open(fn, 'w') as f:
-            f.write(script)
-            f.write("\n");
+    def write_script(self, project, job, nprocs=None, ngpus=None, walltime=None, memory=None, mpicmd=None, index=None, **kwargs):
+        """
+        Writes the script of this operation for job to <workspace>/.flow/<operation>.sh
+        and returns the file name. The file is only rewritten if its content
+        changed. If a :class:`ScriptIndex` is given, the script is not even
+        formatted when the inputs to the script are the same as the last time
+        it was written.
+        """
+        fn = os.path.join(job.workspace(), '.flow', "{operation}.sh".format(operation=self))
+        input_hash = None
+        if index is not None:
+            input_hash = self._script_input_hash(
+                project, job, nprocs=nprocs, ngpus=ngpus, walltime=walltime, memory=memory, mpicmd=mpicmd, **kwargs)
+            entry = index.get(job, self)
+            if entry is not None and entry['input'] == input_hash and os.path.isfile(fn):
+                return fn;
+        script = self.format_script(project, job, nprocs=nprocs, ngpus=ngpus, walltime=walltime, memory=memory, mpicmd=mpicmd, **kwargs) + "\n";
+        hexcode = sha1(script.encode()).hexdigest()
+        entry = index.get(job, self) if index is not None else None
+        if entry is not None and entry['content'] == hexcode and os.path.isfile(fn):
+            unchanged = True
+        else:
+            unchanged = _file_hash(fn) == hexcode
+        if not unchanged:
+            logger.debug("writing job-operation script to: {}".format(fn));
+            _write_atomic(fn, script)
+        if index is not None:
+            index.set(job, self, input_hash, hexcode)
         return fn;
 
 
+class ScriptIndex(object):
+    """
+    The hashes of the inputs and of the content of the scripts written by
+    :meth:`FluidOperation.write_script` for each (job, operation), stored in
+    a single json file in the project root.
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._data = dict()
+        self._modified = False
+        if os.path.isfile(filename):
+            try:
+                with open(filename) as f:
+                    self._data = json.load(f)
+            except ValueError:
+                logger.warning("Ignoring corrupted script index {!r}.".format(filename))
+
+    @staticmethod
+    def _key(job, operation):
+        return "{}/{}".format(job.get_id(), operation)
+
+    def get(self, job, operation):
+        return self._data.get(self._key(job, operation))
+
+    def set(self, job, operation, input_hash, content_hash):
+        entry = dict(input=input_hash, content=content_hash)
+        key = self._key(job, operation)
+        if self._data.get(key) != entry:
+            self._data[key] = entry
+            self._modified = True
+
+    def save(self):
+        if self._modified:
+            _mkdir_p(os.path.dirname(self._filename))
+            _write_atomic(self._filename, json.dumps(self._data))
+            self._modified = False
+
+
 class FluidProject(flow.FlowProject):
-    pass
+
+    def _fn_condition_cache(self):
+        return os.path.join(self.root_directory(), '.flow', 'conditions.json')
+
+    def condition_cache(self, persistent=False):
+        """
+        Returns a cache for the conditions evaluated during one pass over the
+        project. Pass it to :meth:`FluidOperation.eligible` and
+        :meth:`FluidOperation.complete` to share condition values between the
+        operations. If persistent is True, the values are also stored in the
+        project root and reused until the job document or workspace changes.
+        """
+        if persistent:
+            return ConditionCache(PersistentConditionCache(self._fn_condition_cache()))
+        return ConditionCache()
+
+    def script_index(self):
+        "Returns the :class:`ScriptIndex` of the operation scripts, call save() after writing scripts."
+        return ScriptIndex(os.path.join(self.root_directory(), '.flow', 'scripts.json'))
+
+    def statepoint_index(self, update=True):
+        """
+        Returns the columnar index of the state points and submission status of
+        all jobs, stored in the project root. If update is True, the index is
+        synchronized with the workspace first and saved if anything changed.
+
+        :rtype: :class:`~.index.StatepointIndex`
+        """
+        index = StatepointIndex(os.path.join(self.root_directory(), '.flow', 'index.json'))
+        if update and index.update(self.workspace()):
+            index.save()
+        return index
+
+    def status_tracker(self, scheduler, **kwargs):
+        """
+        Returns a :class:`~.scheduler.StatusTracker` that writes the status
+        transitions reported by scheduler to the job documents, with its
+        snapshot stored in the project root.
+        """
+        return StatusTracker(scheduler, self, **kwargs)
+
+    def next_operations(self, job, cache=None):
+        """
+        Determine the next operations for job, see :meth:`flow.FlowProject.next_operations`.
+        The conditions are evaluated through cache, a :class:`~.condition.ConditionCache`,
+        so a condition shared by several operations is evaluated once per job.
+        A new cache is used if cache is None.
+        """
+        if cache is None:
+            cache = ConditionCache()
+        for name, op in self.operations.items():
+            prereqs, postconds = _fluid_conditions(op)
+            if all(cond(job, cache) for cond in prereqs) and \
+                    not (postconds and all(cond(job, cache) for cond in postconds)):
+                yield JobOperation(name=name, job=job, cmd=op(job), np=op.np(job), mpi=op.mpi)
+
+    def eligible_operations(self, jobs=None, pool=None, chunksize=256, persistent=False):
+        """
+        Determine the eligible operations of many jobs in a single pass. The
+        conditions are evaluated once per job through a :meth:`condition_cache`.
+
+        :param jobs: The jobs to scan, defaults to all jobs of the project.
+        :param pool: A multiprocessing or threading pool. Providing a pool
+            distributes the jobs in chunks across its workers. A process pool
+            requires the project to be picklable.
+        :param chunksize: The number of jobs per chunk.
+        :param persistent: Reuse the condition values stored in the project
+            root, see :meth:`condition_cache`. Ignored if a pool is given, the
+            workers would overwrite each other's values.
+        :returns: A mapping of job id to the names of the eligible operations.
+        :rtype: dict of str to frozenset
+        """
+        if jobs is None:
+            jobs = self.find_jobs()
+        job_ids = [job.get_id() for job in jobs]
+        persistent = persistent and pool is None
+        chunks = [(self, job_ids[i:i+chunksize], persistent) for i in range(0, len(job_ids), chunksize)]
+        if pool is None:
+            results = map(_eligible_chunk, chunks)
+        else:
+            results = pool.imap_unordered(_eligible_chunk, chunks)
+        eligible = dict()
+        for result in results:
+            eligible.update(result)
+        return eligible
 
 
 def get_project(root=None, alias=None):
     """
-    Determine the next operation for job.
-
-    You can, but don't have to use this function to simplify
-    the submission process. The default method returns None.
+    Returns the project in root, an instance of the subclass of
+    :class:`FluidProject` that has been defined (imported), or of
+    :class:`FluidProject` itself if there is none.
 
     :param root: same as signac.
     :type str:
-    :param alias: alias for the flow project
+    :param alias: The class name of the project, required if more than one
+        project class has been defined.
     :type str:
     :returns: a flow project
     :rtype: :class: `FlowProject`
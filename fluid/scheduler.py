@@ -2,16 +2,46 @@
 # All rights reserved.
 # This software is licensed under the BSD 3-Clause License.
 
+import os
+import json
 import logging
 import enum
 import time
 import getpass
+import tempfile
+import threading
+import subprocess
+from array import array
+from collections import Counter
+from hashlib import sha1
+
+try:
+    import fcntl
+except ImportError: # not available on windows, snapshots are then shared without a lock.
+    fcntl = None
+
+# numpy is imported on first use by _numpy(), importing it takes longer than
+# importing the rest of the package.
+np = False
+
+def _numpy():
+    "Returns numpy, or None if it is not installed."
+    global np
+    if np is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        np = numpy
+    return np
 
 from . import config
 from . import bundler as bund
 from . import job_filter
 # from . import project as proj
 
+logger = logging.getLogger("flow.{}".format(__name__))
+
 
 def format_timedelta(delta):
     hours, r = divmod(delta.seconds, 3600)
@@ -19,6 +49,10 @@ def format_timedelta(delta):
     hours += delta.days * 24
     return "{:0>2}:{:0>2}:{:0>2}".format(hours, minutes, seconds)
 
+def make_submit_name(operation, job, project):
+    "The name of the scheduler job that executes operation for job."
+    return "{}-{}-{}".format(job, operation, project)
+
 class JobStatus(enum.IntEnum):
     """Classifies the job's execution status.
 
@@ -46,6 +80,7 @@ class JobStatus(enum.IntEnum):
     user = 128
 
 class ClusterJob(object):
+    __slots__ = ('_id', '_name', '_status')
 
     def __init__(self, jobid, name, status):
         self._id = jobid
@@ -53,7 +88,7 @@ class ClusterJob(object):
         self._status = status
 
     def __str__(self):
-        return str(self._job_id())
+        return str(self._id)
 
     def name(self):
         return self._name
@@ -64,48 +99,528 @@ class ClusterJob(object):
     def status(self):
         return self._status
 
+class ClusterJobTable(object):
+    """
+    The jobs known to the scheduler stored column-wise: lists of the ids and
+    names and the :class:`JobStatus` codes in an unsigned byte array. The names
+    are indexed, so the status of a submit name is a dictionary lookup. If there
+    are several jobs with the same name, the name refers to the one with the
+    most significant status.
+
+    .. code-block:: python
+
+        table = scheduler.table()
+        status = table.status(submit_name)
+        counts = table.counts()
+    """
+
+    def __init__(self, records=()):
+        self._ids = []
+        self._names = []
+        self._status = array('B')
+        self._rows = dict()
+        for jobid, name, status in records:
+            self.append(jobid, name, status)
+
+    @classmethod
+    def from_jobs(cls, jobs):
+        "Build a table from an iterable of :class:`ClusterJob`."
+        return cls((job.id(), job.name(), job.status()) for job in jobs)
+
+    def append(self, jobid, name, status):
+        row = len(self._ids)
+        self._ids.append(jobid)
+        self._names.append(name)
+        self._status.append(int(status))
+        other = self._rows.get(name)
+        if other is None or self._status[other] < self._status[row]:
+            self._rows[name] = row
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, row):
+        return ClusterJob(self._ids[row], self._names[row], JobStatus(self._status[row]))
+
+    def __iter__(self):
+        for row in range(len(self._ids)):
+            yield self[row]
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    def row(self, name, default=None):
+        "The row of the job named name."
+        return self._rows.get(name, default)
+
+    def ids(self):
+        return list(self._ids)
+
+    def names(self):
+        return list(self._names)
+
+    def stati(self):
+        "The status codes of all rows, a numpy uint8 array if numpy is available."
+        if _numpy() is not None:
+            return np.array(self._status, dtype=np.uint8) # a copy, the table can still grow.
+        return array('B', self._status)
+
+    def status(self, name, default=JobStatus.unknown):
+        "The status of the job named name."
+        row = self._rows.get(name)
+        return default if row is None else JobStatus(self._status[row])
+
+    def items(self):
+        "Yield each distinct name and its status."
+        for name, row in self._rows.items():
+            yield name, JobStatus(self._status[row])
+
+    def counts(self):
+        "The number of jobs with each status, a dict of :class:`JobStatus` to count."
+        if _numpy() is not None:
+            bins = np.bincount(self.stati(), minlength=len(JobStatus) + 1)
+            counts = ((code, int(n)) for code, n in enumerate(bins) if n)
+        else:
+            counts = Counter(self._status).items()
+        return dict((JobStatus(code), n) for code, n in counts)
+
+
+class SubmitResult(object):
+    "The outcome of one submission in :meth:`Scheduler.submit_many`."
+
+    def __init__(self, index, jobid=None, error=None, attempts=1):
+        self._index = index
+        self._jobid = jobid
+        self._error = error
+        self._attempts = attempts
+
+    def __str__(self):
+        return str(self._jobid) if self.ok() else "error: {}".format(self._error)
+
+    def ok(self):
+        return self._error is None
+
+    def index(self):
+        return self._index
+
+    def jobid(self):
+        return self._jobid
+
+    def error(self):
+        return self._error
+
+    def attempts(self):
+        return self._attempts
+
+class _SnapshotLock(object):
+    "An exclusive lock on a file, a no-op if there is no file or no fcntl."
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._file = None
+
+    def __enter__(self):
+        if self._filename is not None and fcntl is not None:
+            self._file = open(self._filename, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
 class Scheduler(object):
-    _last_query = None
+    """
+    Interface to the job scheduler of a compute environment.
+
+    The result of a status query is kept as a snapshot that is shared by all
+    Scheduler instances in the process, and on disk as well if cache_dir is given
+    so concurrent processes on the same host reuse it. A snapshot younger than
+    ttl seconds is returned without querying the scheduler, the scheduler is never
+    queried more than once every _dos_timeout seconds and if a query fails a
+    snapshot younger than max_age seconds is returned instead.
+
+    :param conf: The submission configuration e.g. :class:`~.config.pbs.PBSConfig`.
+    :param ttl: The time in seconds a snapshot is considered up to date.
+    :param max_age: The maximum age in seconds of a snapshot used when a query fails.
+    :param cache_dir: The directory to store the snapshots in.
+    """
+    _snapshots = dict()
     _dos_timeout = 10
+    _print_lock = threading.Lock()
+    _transient_messages = (
+        'try again', 'timed out', 'timeout', 'too busy', 'temporarily unavailable',
+        'connection refused', 'connection reset', 'socket')
 
-    def __init__(self, conf):
+    def __init__(self, conf, ttl=30, max_age=600, cache_dir=None):
         self._config = conf;
+        self._ttl = ttl
+        self._max_age = max_age
+        self._cache_dir = cache_dir
         # self._users = set([]+users)
 
-    @classmethod
-    def _prevent_dos(cls):
-        if cls._last_query is not None:
-            if time.time() - cls._last_query < cls._dos_timeout:
-                raise RuntimeError(
-                    "Too many scheduler requests within a short time!")
-        cls._last_query = time.time()
+    def _fn_snapshot(self, cmd):
+        if self._cache_dir is None:
+            return None
+        return os.path.join(self._cache_dir, 'scheduler-{}.json'.format(sha1(cmd.encode()).hexdigest()))
+
+    def _read_snapshot(self, cmd):
+        snapshot = self._snapshots.get(cmd)
+        fn = self._fn_snapshot(cmd)
+        if fn is not None and os.path.isfile(fn):
+            try:
+                with open(fn) as file:
+                    data = json.load(file)
+                if snapshot is None or data['time'] > snapshot[0]:
+                    snapshot = self._snapshots[cmd] = (data['time'], [tuple(r) for r in data['jobs']])
+            except (IOError, OSError, ValueError, KeyError) as error:
+                logger.warning("Could not read scheduler snapshot {!r}: {}".format(fn, error))
+        return snapshot
+
+    def _write_snapshot(self, cmd, snapshot):
+        self._snapshots[cmd] = snapshot
+        fn = self._fn_snapshot(cmd)
+        if fn is not None:
+            tmp = "{}.{}.tmp".format(fn, os.getpid())
+            with open(tmp, 'w') as file:
+                json.dump(dict(time=snapshot[0], jobs=snapshot[1]), file)
+            os.rename(tmp, fn)
+
+    def _query(self, cmd):
+        # the status is parsed from the pipe while the command is still writing.
+        try:
+            proc = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE)
+        except (IOError, OSError):
+            raise RuntimeError("{} not available.".format(cmd.split()[0]));
+        try:
+            with proc.stdout:
+                records = [(i, n, int(s)) for i, n, s in self._config.job_status(proc.stdout)]
+        except Exception:
+            proc.kill()
+            proc.wait()
+            raise
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+        return records
+
+    def _status_records(self, user=None, refresh=False):
+        if user is None:
+            user = getpass.getuser()
+        cmd = self._config.status_cmd.format(user=user)
+        if self._cache_dir is not None and not os.path.isdir(self._cache_dir):
+            os.makedirs(self._cache_dir)
+        fn = self._fn_snapshot(cmd)
+        with _SnapshotLock(None if fn is None else fn + '.lock'):
+            snapshot = self._read_snapshot(cmd)
+            if snapshot is not None:
+                age = time.time() - snapshot[0]
+                if age < self._dos_timeout or (age < self._ttl and not refresh):
+                    return snapshot[1]
+            try:
+                records = self._query(cmd)
+            except (RuntimeError, subprocess.CalledProcessError) as error:
+                if snapshot is None or time.time() - snapshot[0] > self._max_age:
+                    raise
+                logger.warning("Scheduler query failed ({}), using the status from {:.0f} seconds ago.".format(
+                    error, time.time() - snapshot[0]))
+                return snapshot[1]
+            self._write_snapshot(cmd, (time.time(), records))
+            return records
+
+    def _submit_cmd(self, remainder=None):
+        return self._config.submit_cmd.split() + (remainder.split() if remainder else [])
+
+    def _submit_script(self, script, submit_cmd, timeout=None, pretend=False):
+        """
+        Writes script to a temporary file and submits it with submit_cmd. In
+        pretend mode the command is printed instead of executed and None is
+        returned.
+        """
+        with tempfile.NamedTemporaryFile() as tmp_submit_script:
+            tmp_submit_script.write(script.encode('utf-8'))
+            tmp_submit_script.flush()
+            cmd = submit_cmd + [tmp_submit_script.name]
+            if pretend:
+                with self._print_lock:
+                    print("# Submit command: {}\n{}\n".format(' '.join(cmd), script))
+                return None
+            output = subprocess.check_output(cmd, stderr=subprocess.PIPE, timeout=timeout)
+        return output.decode('utf-8').strip()
 
     def submit(self, script, pretend=False, remainder=None):
-        submit_cmd = [self._config.submit_cmd]
-        if remainder is not None:
-            remainder = remainder.split()
-        else:
-            remainder = []
-        if pretend:
-            print("# Submit command: {}".format(' '.join(submit_cmd+remainder)))
-            print(script.read())
-            print()
-        else:
-            with tempfile.NamedTemporaryFile() as tmp_submit_script:
-                tmp_submit_script.write(script.read().encode('utf-8'))
-                tmp_submit_script.flush()
-                output = subprocess.check_output(
-                    submit_cmd + [tmp_submit_script.name])
-            jobsid = output.decode('utf-8').strip()
-            return jobsid
-
-    def jobs(user=None):
-        self._prevent_dos();
+        return self._submit_script(script.read(), self._submit_cmd(remainder), pretend=pretend)
+
+    @classmethod
+    def _is_transient(cls, error):
+        """
+        Whether a failed submission is worth retrying. A submission that timed
+        out may have been queued anyway, see :meth:`_find_job`.
+        """
+        if isinstance(error, subprocess.TimeoutExpired):
+            return False
+        if isinstance(error, subprocess.CalledProcessError):
+            message = (error.stderr or b'') + (error.output or b'')
+            message = message.decode('utf-8', 'replace').lower()
+            return any(m in message for m in cls._transient_messages)
+        return False
+
+    def _find_job(self, name):
+        """
+        The id of the job named name that the scheduler lists right now, None
+        if there is none. The snapshots are bypassed, they may be older than
+        the submission.
+        """
+        records = self._query(self._config.status_cmd.format(user=getpass.getuser()))
+        return next((jobid for jobid, jobname, status in records if jobname == name), None)
+
+    def _submit_with_retry(self, index, script, submit_cmd, pretend, retries, backoff, timeout, name=None):
+        if not isinstance(script, str):
+            script = script.read()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                jobid = self._submit_script(script, submit_cmd, timeout, pretend)
+                if pretend:
+                    jobid = "pretend-{}".format(index)
+                return SubmitResult(index, jobid=jobid, attempts=attempt)
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as error:
+                timed_out = isinstance(error, subprocess.TimeoutExpired) and name is not None
+                if attempt > retries or not (timed_out or self._is_transient(error)):
+                    return SubmitResult(index, error=error, attempts=attempt)
+                delay = backoff * 2 ** (attempt - 1)
+                logger.warning("Submission {} failed ({}), retrying in {:.1f} seconds.".format(index, error, delay))
+                time.sleep(delay)
+                if timed_out:
+                    try:
+                        jobid = self._find_job(name)
+                    except (RuntimeError, subprocess.CalledProcessError) as query_error:
+                        logger.warning("Could not check whether submission {} was queued ({}), "
+                                       "not retrying.".format(index, query_error))
+                        return SubmitResult(index, error=error, attempts=attempt)
+                    if jobid is not None: # queued despite the timeout
+                        return SubmitResult(index, jobid=jobid, attempts=attempt)
+
+    def submit_many(self, scripts, pretend=False, remainder=None, concurrency=8,
+                    retries=3, backoff=1.0, timeout=None, names=None):
+        """
+        Submit many scripts concurrently.
+
+        The scripts are submitted by a pool of at most concurrency threads. A
+        submission that fails with a transient scheduler error (see
+        _transient_messages) is retried up to retries times, waiting backoff
+        seconds before the first retry and twice as long before each following
+        one. A submission that timed out may have been queued anyway, so it is
+        only retried if names are given and the scheduler does not list a job
+        of that name after the wait. In pretend mode the scripts pass through
+        the same pipeline and the submit commands are printed instead of executed.
+
+        :param scripts: An iterable of scripts as strings or file objects.
+        :param concurrency: The maximum number of concurrent submissions.
+        :param retries: The maximum number of retries per script.
+        :param backoff: The initial delay between retries in seconds.
+        :param timeout: The timeout in seconds of a single submit command.
+        :param names: The job name set by each script, see :func:`make_submit_name`.
+        :returns: A list of :class:`SubmitResult`, in the order of scripts.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        submit_cmd = self._submit_cmd(remainder)
+        scripts = list(scripts)
+        if names is None:
+            names = [None] * len(scripts)
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            futures = [
+                executor.submit(self._submit_with_retry, i, script, submit_cmd,
+                                pretend, retries, backoff, timeout, name)
+                for i, (script, name) in enumerate(zip(scripts, names))]
+            return [future.result() for future in futures]
+
+    def jobs(self, user=None, refresh=False, registry=None, bundle_dir=None):
+        """
+        Returns the jobs of user known to the scheduler.
+
+        :param user: The user name, defaults to the current user.
+        :param refresh: Query the scheduler even if the snapshot is within its ttl.
+        :param registry: A :class:`~.bundler.BundleRegistry`, if given bundles and
+            job arrays are expanded into the job-operations they execute.
+        :param bundle_dir: The directory of the bundle map files, used to expand
+            job arrays if there is no registry.
+        """
+        jobs = [ClusterJob(i, n, JobStatus(s)) for i, n, s in self._status_records(user, refresh)]
+        return self._expand(jobs, registry, bundle_dir)
+
+    def table(self, user=None, refresh=False, registry=None, bundle_dir=None):
+        """
+        Returns the jobs of user known to the scheduler as a :class:`ClusterJobTable`,
+        the arguments are the same as for :meth:`jobs`.
+        """
+        records = self._status_records(user, refresh)
+        if registry is None and bundle_dir is None:
+            return ClusterJobTable(records)
+        return ClusterJobTable.from_jobs(
+            self._expand((ClusterJob(i, n, JobStatus(s)) for i, n, s in records), registry, bundle_dir))
+
+    @staticmethod
+    def _expand(jobs, registry=None, bundle_dir=None):
+        if registry is not None:
+            return list(registry.expand(jobs))
+        elif bundle_dir is not None:
+            return list(bund.expand_array_jobs(jobs, bundle_dir))
+        return jobs
+
+    def has_history(self):
+        "Whether the scheduler can list the jobs that changed since a given time."
+        return getattr(self._config, 'history_cmd', None) is not None
+
+    def history(self, since, user=None, registry=None, bundle_dir=None):
+        """
+        Returns the jobs of user that were queued, running or finished after
+        since, e.g. with sacct --starttime. The result is not cached.
+
+        :param since: The start of the period, in seconds since the epoch.
+        :raises NotImplementedError: If the submission configuration has no history_cmd.
+        """
+        if not self.has_history():
+            raise NotImplementedError("{} has no history_cmd.".format(type(self._config).__name__))
         if user is None:
             user = getpass.getuser()
-        cmd = status_cmd.format(user=user)
-        try:
-            result = io.BytesIO(subprocess.check_output(cmd.split()))
-        except FileNotFoundError:
-            raise RuntimeError("{} not available.".format(cmd.split()[0]));
-        return [ClusterJob(i,n,s) for i,n,s in self._config.parse_status(result)] # TODO: fix this later
+        cmd = self._config.history_cmd.format(
+            user=user, since=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(since)))
+        jobs = [ClusterJob(i, n, JobStatus(s)) for i, n, s in self._query(cmd)]
+        return self._expand(jobs, registry, bundle_dir)
+
+
+class StatusTracker(object):
+    """
+    Keeps the scheduler status of the job-operations of a project between polls
+    and writes only the transitions to the job documents, so that updating the
+    status touches only the documents of jobs whose status changed.
+
+    The last snapshot is stored in <root>/.flow/tracker.json. If the scheduler
+    supports it (see :meth:`Scheduler.has_history`) only the jobs that changed
+    since the previous poll are queried, otherwise the full status is queried
+    and the jobs that disappeared from the scheduler become inactive.
+
+    .. code-block:: python
+
+        tracker = StatusTracker(scheduler, project)
+        changes = tracker.update()
+
+    :param scheduler: The :class:`Scheduler` to query.
+    :param project: The project the jobs were submitted for.
+    :param filename: The file of the snapshot, defaults to <root>/.flow/tracker.json.
+    :param incremental: Use incremental queries if the scheduler supports them.
+    :param registry: A :class:`~.bundler.BundleRegistry` to expand bundles with.
+    :param bundle_dir: The directory of the bundle map files, used to expand job arrays.
+    """
+    _overlap = 60 # seconds that incremental queries overlap, to allow for clock skew.
+
+    def __init__(self, scheduler, project, filename=None, incremental=True, registry=None, bundle_dir=None):
+        self._scheduler = scheduler
+        self._project = project
+        self._suffix = '-{}'.format(project)
+        self._filename = filename if filename is not None else \
+            os.path.join(project.root_directory(), '.flow', 'tracker.json')
+        self._incremental = incremental and scheduler.has_history()
+        self._registry = registry
+        self._bundle_dir = bundle_dir
+        self._time = None
+        self._status = dict()
+        if os.path.isfile(self._filename):
+            try:
+                with open(self._filename) as file:
+                    data = json.load(file)
+                self._time, self._status = data['time'], data['status']
+            except (IOError, OSError, ValueError, KeyError):
+                logger.warning("Ignoring corrupted status snapshot {!r}.".format(self._filename))
+
+    def save(self):
+        dirname = os.path.dirname(self._filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = "{}.{}.tmp".format(self._filename, os.getpid())
+        with open(tmp, 'w') as file:
+            json.dump(dict(time=self._time, status=self._status), file)
+        os.rename(tmp, self._filename)
+
+    def _job_id(self, name):
+        "The id of the job name was submitted for, None if it belongs to another project."
+        if not name.endswith(self._suffix):
+            return None
+        jid = name.split('-', 1)[0]
+        return jid if len(jid) == 32 else None
+
+    def status(self, name, default=None):
+        "The status of the submit name in the last snapshot."
+        status = self._status.get(name)
+        return default if status is None else JobStatus(status)
+
+    def poll(self, user=None):
+        """
+        Query the scheduler and update the snapshot.
+
+        :returns: The transitions since the last poll, a dict of submit name
+            to a tuple of the previous status (None if unknown) and the new status.
+        """
+        now = time.time()
+        incremental = self._incremental and self._time is not None
+        if incremental:
+            table = ClusterJobTable.from_jobs(self._scheduler.history(
+                self._time - self._overlap, user, self._registry, self._bundle_dir))
+        else:
+            table = self._scheduler.table(
+                user, refresh=True, registry=self._registry, bundle_dir=self._bundle_dir)
+        current = dict((name, int(status)) for name, status in table.items()
+                       if self._job_id(name) is not None)
+        changes = dict()
+        for name, status in current.items():
+            old = self._status.get(name)
+            if old != status:
+                changes[name] = (None if old is None else JobStatus(old), JobStatus(status))
+        if incremental:
+            status = dict(self._status)
+            status.update(current)
+            # finished jobs are not reported again once they leave the period.
+            status = dict((name, s) for name, s in status.items()
+                          if s > JobStatus.inactive and s != JobStatus.error)
+        else:
+            for name, old in self._status.items():
+                if name not in current and JobStatus.inactive < old < JobStatus.error:
+                    changes[name] = (JobStatus(old), JobStatus.inactive)
+            status = current
+        self._time, self._status = now, status
+        return changes
+
+    def apply(self, changes):
+        """
+        Write the status transitions to the job documents, with one write per
+        job and only if the stored status differs.
+
+        :returns: The number of job documents written.
+        """
+        stati = dict()
+        for name, (old, new) in changes.items():
+            stati.setdefault(self._job_id(name), dict())[name] = int(new)
+        written = 0
+        for jid, update in stati.items():
+            try:
+                job = self._project.open_job(id=jid)
+            except (KeyError, LookupError):
+                continue
+            status = dict(job.document.get('status', dict()))
+            if all(status.get(name) == value for name, value in update.items()):
+                continue
+            status.update(update)
+            job.document['status'] = status
+            written += 1
+        return written
+
+    def update(self, user=None):
+        "Poll the scheduler, apply the transitions and save the snapshot. Returns the transitions."
+        changes = self.poll(user)
+        self.apply(changes)
+        self.save()
+        return changes
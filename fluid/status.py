@@ -1,207 +1,511 @@
 # Copyright (c) 2017 The Regents of the University of Michigan
 # All rights reserved.
 # This software is licensed under the BSD 3-Clause License.
-#
-#
-# def is_active(status):
-#     for gid, s in status.items():
-#         if s > manage.JobStatus.inactive:
-#             return True
-#     return False
-#
-#
-# def draw_progressbar(value, total, width=40):
-#     n = int(value / total * width)
-#     return '|' + ''.join(['#'] * n) + ''.join(['-'] * (width - n)) + '|'
-#
-#
-# def abbreviate(x, a):
-#     if x == a:
-#         return x
-#     else:
-#         abbreviate.table[a] = x
-#         return a
-# abbreviate.table = dict()  # noqa
-#
-#
-# def shorten(x, max_length=None):
-#     if max_length is None:
-#         return x
-#     else:
-#         return abbreviate(x, x[:max_length])
-#
-#     @classmethod
-#     def _tr(cls, x):
-#         "Use name translation table for x."
-#         return cls.NAMES.get(x, x)
-#
-#     ALIASES = dict(
-#         status='S',
-#         unknown='U',
-#         registered='R',
-#         queued='Q',
-#         active='A',
-#         inactive='I',
-#         requires_attention='!'
-#     )
-#
-#     @classmethod
-#     def _alias(cls, x):
-#         "Use alias if specified."
-#         return abbreviate(x, cls.ALIASES.get(x, x))
-#
-#     @classmethod
-#     def update_aliases(cls, aliases):
-#         "Update the ALIASES table for this class."
-#         cls.ALIASES.update(aliases)
-#
-#     def print_overview(self, stati, max_lines=None, file=sys.stdout):
-#         "Print the project's status overview."
-#         progress = defaultdict(int)
-#         for status in stati:
-#             for label in status['labels']:
-#                 progress[label] += 1
-#         progress_sorted = islice(sorted(
-#             progress.items(), key=lambda x: (x[1], x[0]), reverse=True), max_lines)
-#         table_header = ['label', 'progress']
-#         rows = ([label, '{} {:0.2f}%'.format(
-#             draw_progressbar(num, len(stati)), 100 * num / len(stati))]
-#             for label, num in progress_sorted)
-#         print("{} {}".format(self._tr("Total # of jobs:"), len(stati)), file=file)
-#         print(util.tabulate.tabulate(rows, headers=table_header), file=file)
-#         if max_lines is not None:
-#             lines_skipped = len(progress) - max_lines
-#             if lines_skipped:
-#                 print("{} {}".format(self._tr("Lines omitted:"), lines_skipped), file=file)
-#
-#     def format_row(self, status, statepoint=None, max_width=None):
-#         "Format each row in the detailed status output."
-#         row = [
-#             status['job_id'],
-#             ', '.join((self._alias(s) for s in status['submission_status'])),
-#             status['operation'],
-#             ', '.join(status.get('labels', [])),
-#         ]
-#         if statepoint:
-#             sps = self.open_job(id=status['job_id']).statepoint()
-#
-#             def get(k, m):
-#                 if m is None:
-#                     return
-#                 t = k.split('.')
-#                 if len(t) > 1:
-#                     return get('.'.join(t[1:]), m.get(t[0]))
-#                 else:
-#                     return m.get(k)
-#
-#             for i, k in enumerate(statepoint):
-#                 v = self._alias(get(k, sps))
-#                 row.insert(i + 3, None if v is None else shorten(str(v), max_width))
-#         if status['operation'] and not status['active']:
-#             row[1] += ' ' + self._alias('requires_attention')
-#         return row
-#
-#     def print_detailed(self, stati, parameters=None,
-#                        skip_active=False, param_max_width=None,
-#                        file=sys.stdout):
-#         "Print the project's detailed status."
-#         table_header = [self._tr(self._alias(s))
-#                         for s in ('job_id', 'status', 'next_operation', 'labels')]
-#         if parameters:
-#             for i, value in enumerate(parameters):
-#                 table_header.insert(i + 3, shorten(self._alias(str(value)), param_max_width))
-#         rows = (self.format_row(status, parameters, param_max_width)
-#                 for status in stati if not (skip_active and status['active']))
-#         print(util.tabulate.tabulate(rows, headers=table_header), file=file)
-#         if abbreviate.table:
-#             print(file=file)
-#             print(self._tr("Abbreviations used:"), file=file)
-#             for a in sorted(abbreviate.table):
-#                 print('{}: {}'.format(a, abbreviate.table[a]), file=file)
-#     def print_status(self, scheduler=None, job_filter=None,
-#                      overview=True, overview_max_lines=None,
-#                      detailed=False, parameters=None, skip_active=False,
-#                      param_max_width=None,
-#                      file=sys.stdout, err=sys.stderr,
-#                      pool=None):
-#         """Print the status of the project.
-#
-#         :param scheduler: The scheduler instance used to fetch the job stati.
-#         :type scheduler: :class:`~.manage.Scheduler`
-#         :param job_filter: A JSON encoded filter,
-#             that all jobs to be submitted need to match.
-#         :param detailed: Print a detailed status of each job.
-#         :type detailed: bool
-#         :param parameters: Print the value of the specified parameters.
-#         :type parameters: list of str
-#         :param skip_active: Only print jobs that are currently inactive.
-#         :type skip_active: bool
-#         :param file: Print all output to this file,
-#             defaults to sys.stdout
-#         :param err: Print all error output to this file,
-#             defaults to sys.stderr
-#         :param pool: A multiprocessing or threading pool. Providing a pool
-#             parallelizes this method."""
-#         if job_filter is not None and isinstance(job_filter, str):
-#             job_filter = json.loads(job_filter)
-#         jobs = list(self.find_jobs(job_filter))
-#         if scheduler is not None:
-#             self.update_stati(scheduler, jobs, file=err, pool=pool)
-#         print(self._tr("Generate output..."), file=err)
-#         if pool is None:
-#             stati = [self.get_job_status(job) for job in jobs]
-#         else:
-#             stati = pool.map(self.get_job_status, jobs)
-#         title = "{} '{}':".format(self._tr("Status project"), self)
-#         print('\n' + title, file=file)
-#         if overview:
-#             self.print_overview(stati, max_lines=overview_max_lines, file=file)
-#         if detailed:
-#             print(file=file)
-#             print(self._tr("Detailed view:"), file=file)
-#             self.print_detailed(stati, parameters, skip_active,
-#                                 param_max_width, file)
-#
-#     @classmethod
-#     def add_print_status_args(cls, parser):
-#         "Add arguments to parser for the :meth:`~.print_status` method."
-#         parser.add_argument(
-#             '-f', '--filter',
-#             dest='job_filter',
-#             type=str,
-#             help="Filter jobs.")
-#         parser.add_argument(
-#             '--no-overview',
-#             action='store_false',
-#             dest='overview',
-#             help="Do not print an overview.")
-#         parser.add_argument(
-#             '-m', '--overview-max-lines',
-#             type=int,
-#             help="Limit the number of lines in the overview.")
-#         parser.add_argument(
-#             '-d', '--detailed',
-#             action='store_true',
-#             help="Display a detailed view of the job stati.")
-#         parser.add_argument(
-#             '-p', '--parameters',
-#             type=str,
-#             nargs='*',
-#             help="Display select parameters of the job's "
-#                  "statepoint with the detailed view.")
-#         parser.add_argument(
-#             '--param-max-width',
-#             type=int,
-#             help="Limit the width of each parameter row.")
-#         parser.add_argument(
-#             '--skip-active',
-#             action='store_true',
-#             help="Display only jobs, which are currently not active.")
-#
-#
-#
+from __future__ import print_function
+import os
+import sys
+import json
+import zlib
+import logging
+from array import array
+from itertools import islice
+
+from flow.util import tabulate
+
+# numpy is imported on first use by _numpy(), importing it takes longer than
+# importing the rest of the package.
+np = False
+
+def _numpy():
+    "Returns numpy, or None if it is not installed."
+    global np
+    if np is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        np = numpy
+    return np
+
+from .scheduler import JobStatus
+
+logger = logging.getLogger("flow.{}".format(__name__))
+
+
+def is_active(status):
+    for gid, s in status.items():
+        if s > JobStatus.inactive:
+            return True
+    return False
+
+
+def draw_progressbar(value, total, width=40):
+    n = int(value / total * width)
+    return '|' + ''.join(['#'] * n) + ''.join(['-'] * (width - n)) + '|'
+
+
+class _Counter(object):
+    """
+    Counts the occurrences of keys in an array, each distinct key is assigned a
+    slot in the order of its first occurrence.
+    """
+
+    def __init__(self):
+        self._slots = dict()
+        self._counts = array('L')
+
+    def add(self, key):
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = len(self._counts)
+            self._counts.append(0)
+        self._counts[slot] += 1
+
+    def __len__(self):
+        return len(self._counts)
+
+    def most_common(self, n=None):
+        items = ((key, self._counts[slot]) for key, slot in self._slots.items())
+        return list(islice(sorted(items, key=lambda x: (x[1], str(x[0])), reverse=True), n))
+
+
+class _Abbreviations(object):
+    """
+    The table of the abbreviations used in the detailed view. The table holds at
+    most max_size entries, once it is full values are no longer abbreviated.
+    """
+
+    def __init__(self, max_size=256):
+        self._max_size = max_size
+        self._table = dict()
+
+    def abbreviate(self, x, a):
+        if x == a:
+            return x
+        if self._table.get(a, x) != x or (a not in self._table and len(self._table) >= self._max_size):
+            return x # a is taken or the table is full.
+        self._table[a] = x
+        return a
+
+    def shorten(self, x, max_length=None):
+        if max_length is None:
+            return x
+        return self.abbreviate(x, x[:max_length])
+
+    def __len__(self):
+        return len(self._table)
+
+    def items(self):
+        return sorted(self._table.items())
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.feather
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def _export_format(filename, format=None):
+    if format is None:
+        ext = os.path.splitext(filename)[1].lstrip('.').lower()
+        format = dict(parquet='parquet', pq='parquet', arrow='arrow', feather='arrow', npz='npz').get(ext)
+    if format is None:
+        format = 'parquet' if _pyarrow() is not None else 'npz'
+    if format not in ('parquet', 'arrow', 'npz'):
+        raise ValueError("Unknown export format {!r}.".format(format))
+    if format != 'npz' and _pyarrow() is None:
+        raise RuntimeError("The {} format requires pyarrow.".format(format))
+    if format == 'npz' and _numpy() is None:
+        raise RuntimeError("The npz format requires numpy.")
+    return format
+
+
+def _write_columns(filename, format, columns, metadata):
+    """
+    Write columns, a list of (name, values, dictionary) tuples, to filename.
+    Dictionary encoded columns hold int32 codes (-1 for missing) into dictionary,
+    which is stored as a native dictionary column by arrow and in the metadata
+    of npz files.
+    """
+    tmp = "{}.{}.tmp".format(filename, os.getpid())
+    if format == 'npz':
+        arrays = dict()
+        for name, values, dictionary in columns:
+            arrays[name] = values
+            if dictionary is not None:
+                metadata.setdefault('dictionaries', dict())[name] = dictionary
+        arrays['_metadata'] = _numpy().asarray(json.dumps(metadata))
+        with open(tmp, 'wb') as file:
+            np.savez(file, **arrays)
+    else:
+        pa = _pyarrow()
+        arrays = []
+        for name, values, dictionary in columns:
+            if dictionary is None:
+                arrays.append(pa.array(values))
+                continue
+            codes = _numpy().asarray(values, dtype=np.int32)
+            try:
+                dictionary = pa.array(dictionary)
+            except (pa.ArrowInvalid, pa.ArrowTypeError): # mixed types
+                dictionary = pa.array([json.dumps(v, sort_keys=True) for v in dictionary], pa.string())
+            arrays.append(pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes < 0), dictionary))
+        table = pa.Table.from_arrays(arrays, names=[c[0] for c in columns])
+        table = table.replace_schema_metadata({'fluid': json.dumps(metadata)})
+        if format == 'parquet':
+            pa.parquet.write_table(table, tmp)
+        else:
+            pa.feather.write_feather(table, tmp)
+    os.rename(tmp, filename)
+
+
 class Status(object):
-    pass
+    """
+    The status overview and detailed view of a project.
+
+    The status records of the jobs are consumed as a stream: the label and
+    operation counts of the overview are accumulated in a single pass and the
+    rows of the detailed view are printed in pages of page_size rows, with the
+    column widths of each page. The memory used does not depend on the number of
+    jobs. When the detailed view is requested it is printed while the records
+    are consumed and the overview follows it.
+
+    .. code-block:: python
+
+        Status(project, parameters=['a']).print_status(detailed=True)
+
+    :param project: The :class:`~.project.FluidProject`.
+    :param parameters: The state point keys shown in the detailed view.
+    :param param_max_width: The maximum width of the parameter values.
+    :param skip_active: Only show inactive jobs in the detailed view.
+    :param page_size: The number of rows per page of the detailed view.
+    :param max_abbreviations: The maximum size of the abbreviation table.
+    """
+    NAMES = {
+        'next_operation': 'next_op',
+    }
+
+    ALIASES = dict(
+        status='S',
+        unknown='U',
+        registered='R',
+        queued='Q',
+        active='A',
+        inactive='I',
+        requires_attention='!'
+    )
+
+    def __init__(self, project, parameters=None, param_max_width=None, skip_active=False,
+                 page_size=1000, max_abbreviations=256):
+        self._project = project
+        self._parameters = list(parameters or [])
+        self._param_max_width = param_max_width
+        self._skip_active = skip_active
+        self._page_size = page_size
+        self._abbreviations = _Abbreviations(max_abbreviations)
+        self._index = None
+        self._reset()
+
+    def _reset(self):
+        self._total = 0
+        self._labels = _Counter()
+        self._operations = _Counter()
+
+    @classmethod
+    def _tr(cls, x):
+        "Use name translation table for x."
+        return cls.NAMES.get(x, x)
+
+    def _alias(self, x):
+        "Use alias if specified."
+        return self._abbreviations.abbreviate(x, self.ALIASES.get(x, x))
+
+    def records(self, jobs=None, pool=None, chunksize=64):
+        """
+        Yield the status record of each job, see :meth:`flow.FlowProject.get_job_status`.
+
+        :param jobs: The jobs, defaults to all jobs of the project.
+        :param pool: A multiprocessing or threading pool, the records are
+            generated in parallel and yielded in the order of jobs.
+        """
+        if jobs is None:
+            jobs = self._project.find_jobs()
+        if pool is None:
+            for job in jobs:
+                yield self._project.get_job_status(job)
+        else:
+            for record in pool.imap(self._project.get_job_status, jobs, chunksize):
+                yield record
+
+    def _statepoint_value(self, job_id, key):
+        if self._index is None:
+            self._index = self._project.statepoint_index()
+        if job_id in self._index:
+            return self._index.get(job_id, key)
+        statepoint = self._project.open_job(id=job_id).statepoint()
+        for k in key.split('.'):
+            statepoint = statepoint.get(k) if isinstance(statepoint, dict) else None
+        return statepoint
+
+    def format_row(self, record):
+        "Format a row of the detailed view."
+        operation = record['operation']
+        row = [
+            record['job_id'],
+            ', '.join((self._alias(s) for s in record['submission_status'])),
+            None if operation is None else getattr(operation, 'name', operation),
+            ', '.join(record.get('labels', [])),
+        ]
+        for i, key in enumerate(self._parameters):
+            v = self._statepoint_value(record['job_id'], key)
+            row.insert(i + 2, None if v is None else self._abbreviations.shorten(str(v), self._param_max_width))
+        if operation is not None and not record['active']:
+            row[1] += ' ' + self._alias('requires_attention')
+        return row
+
+    def _header(self):
+        header = [self._tr(self._alias(s)) for s in ('job_id', 'status', 'next_operation', 'labels')]
+        for i, key in enumerate(self._parameters):
+            header.insert(i + 2, self._abbreviations.shorten(self._alias(str(key)), self._param_max_width))
+        return header
+
+    def _print_page(self, rows, file):
+        print(tabulate.tabulate(rows, headers=self._header()), file=file)
+        print(file=file)
+
+    def consume(self, records, detailed=False, file=sys.stdout):
+        """
+        Accumulate the overview of records in a single pass, and if detailed is
+        True print the detailed view page by page.
+        """
+        page = []
+        for record in records:
+            self._total += 1
+            for label in record.get('labels', []):
+                self._labels.add(label)
+            operation = record['operation']
+            self._operations.add(None if operation is None else getattr(operation, 'name', str(operation)))
+            if detailed and not (self._skip_active and record['active']):
+                page.append(self.format_row(record))
+                if len(page) >= self._page_size:
+                    self._print_page(page, file)
+                    page = []
+        if page:
+            self._print_page(page, file)
+
+    def export(self, filename, format=None, jobs=None, incremental=False, pool=None):
+        """
+        Export a snapshot of the status of jobs to a columnar file for dashboards.
+
+        The columns are job_id, sp.<key> for each state point key (dictionary
+        encoded), labels.<i> (64 labels per uint64 word, bit j of word i is the
+        label 64 * i + j), next_operation (int16 codes, -1 for none) and status
+        (the uint8 :class:`~.scheduler.JobStatus` code). The label and operation
+        names are stored in the file metadata, under the key 'fluid' for arrow
+        files and in the '_metadata' array of npz files.
+
+        The format is parquet or arrow (feather) if pyarrow is available and npz
+        otherwise, or is chosen by the extension of filename. A sidecar file
+        <filename>.state.json remembers the exported rows. With incremental=True
+        only the rows that changed since the last export are written, to the
+        part file <name>.part<n>.<ext>; the rows of later parts replace the rows
+        of the same job in earlier ones and jobs that were removed are written
+        with status 0.
+
+        :returns: The name of the file written, None if nothing changed.
+        """
+        fn_state = filename + '.state.json'
+        state = None
+        if incremental and os.path.isfile(fn_state):
+            try:
+                with open(fn_state) as file:
+                    state = json.load(file)
+            except (IOError, OSError, ValueError):
+                logger.warning("Ignoring corrupted export state {!r}.".format(fn_state))
+        if state is None:
+            state = dict(format=_export_format(filename, format), parts=0, labels=[], operations=[], rows=dict())
+            incremental = False
+        format = state['format']
+        label_bits = dict((label, i) for i, label in enumerate(state['labels']))
+        op_codes = dict((op, i) for i, op in enumerate(state['operations']))
+        previous = state['rows']
+        rows = dict()
+        ids, bits, operations, stati = [], [], array('h'), array('B')
+        for record in self.records(jobs, pool):
+            b = 0
+            for label in record.get('labels', []):
+                if label not in label_bits:
+                    label_bits[label] = len(state['labels'])
+                    state['labels'].append(label)
+                b |= 1 << label_bits[label]
+            operation = record['operation']
+            operation = None if operation is None else getattr(operation, 'name', str(operation))
+            if operation is None:
+                code = -1
+            elif operation in op_codes:
+                code = op_codes[operation]
+            else:
+                code = op_codes[operation] = len(state['operations'])
+                state['operations'].append(operation)
+            status = max(int(JobStatus[s]) for s in record['submission_status'])
+            jid = record['job_id']
+            rows[jid] = zlib.crc32(json.dumps([b, code, status]).encode())
+            if incremental and previous.get(jid) == rows[jid]:
+                continue
+            ids.append(jid)
+            bits.append(b)
+            operations.append(code)
+            stati.append(status)
+        if incremental:
+            for jid in previous: # removed jobs
+                if jid not in rows:
+                    ids.append(jid)
+                    bits.append(0)
+                    operations.append(-1)
+                    stati.append(0)
+            if not ids:
+                return None
+            state['parts'] += 1
+            root, ext = os.path.splitext(filename)
+            fn = "{}.part{:04d}{}".format(root, state['parts'], ext)
+        else:
+            state['parts'] = 0
+            fn = filename
+        columns = [('job_id', ids if _numpy() is None else np.asarray(ids, dtype=str), None)]
+        index = self._project.statepoint_index()
+        for key in sorted(index.keys()):
+            values, codes = index.column(key, ids)
+            columns.append(('sp.' + key, codes, values))
+        for w in range(max(1, (len(state['labels']) + 63) // 64)):
+            mask = (1 << 64) - 1
+            columns.append(('labels.{}'.format(w), array('Q', ((b >> (64 * w)) & mask for b in bits)), None))
+        columns.append(('next_operation', operations, None))
+        columns.append(('status', stati, None))
+        if np is not None:
+            columns = [(name, values if isinstance(values, np.ndarray) or dictionary is not None else np.asarray(values), dictionary)
+                       for name, values, dictionary in columns]
+        metadata = dict(labels=state['labels'], operations=state['operations'], part=state['parts'])
+        _write_columns(fn, format, columns, metadata)
+        state['rows'] = rows
+        tmp = "{}.{}.tmp".format(fn_state, os.getpid())
+        with open(tmp, 'w') as file:
+            json.dump(state, file)
+        os.rename(tmp, fn_state)
+        return fn
+
+    def print_overview(self, max_lines=None, file=sys.stdout):
+        "Print the overview of the records consumed so far."
+        print("{} {}".format(self._tr("Total # of jobs:"), self._total), file=file)
+        if not self._total:
+            return
+        rows = ([label, '{} {:0.2f}%'.format(
+            draw_progressbar(num, self._total), 100 * num / self._total)]
+            for label, num in self._labels.most_common(max_lines))
+        print(tabulate.tabulate(rows, headers=['label', 'progress']), file=file)
+        if max_lines is not None:
+            lines_skipped = len(self._labels) - max_lines
+            if lines_skipped > 0:
+                print("{} {}".format(self._tr("Lines omitted:"), lines_skipped), file=file)
+        print(file=file)
+        rows = ([str(op), num] for op, num in self._operations.most_common(max_lines))
+        print(tabulate.tabulate(rows, headers=[self._tr('next_operation'), 'jobs']), file=file)
+
+    def print_abbreviations(self, file=sys.stdout):
+        if len(self._abbreviations):
+            print(file=file)
+            print(self._tr("Abbreviations used:"), file=file)
+            for a, x in self._abbreviations.items():
+                print('{}: {}'.format(a, x), file=file)
+
+    def print_status(self, jobs=None, overview=True, overview_max_lines=None,
+                     detailed=False, file=sys.stdout, err=sys.stderr, pool=None):
+        """Print the status of the project.
+
+        :param jobs: The jobs, defaults to all jobs of the project.
+        :param overview: Print the label and operation counts.
+        :param overview_max_lines: Limit the number of lines in the overview.
+        :param detailed: Print a detailed status of each job.
+        :param file: Print all output to this file, defaults to sys.stdout
+        :param err: Print all error output to this file, defaults to sys.stderr
+        :param pool: A multiprocessing or threading pool to generate the records with.
+        """
+        self._reset()
+        print(self._tr("Generate output..."), file=err)
+        title = "{} '{}':".format(self._tr("Status project"), self._project)
+        print('\n' + title, file=file)
+        if detailed:
+            print(self._tr("Detailed view:"), file=file)
+        self.consume(self.records(jobs, pool), detailed=detailed, file=file)
+        if overview:
+            self.print_overview(max_lines=overview_max_lines, file=file)
+        if detailed:
+            self.print_abbreviations(file=file)
+
+    @classmethod
+    def add_print_status_args(cls, parser):
+        "Add arguments to parser for the :meth:`~.print_status` method."
+        parser.add_argument(
+            '-f', '--filter',
+            dest='job_filter',
+            type=str,
+            help="Filter jobs.")
+        parser.add_argument(
+            '--no-overview',
+            action='store_false',
+            dest='overview',
+            help="Do not print an overview.")
+        parser.add_argument(
+            '-m', '--overview-max-lines',
+            type=int,
+            help="Limit the number of lines in the overview.")
+        parser.add_argument(
+            '-d', '--detailed',
+            action='store_true',
+            help="Display a detailed view of the job stati.")
+        parser.add_argument(
+            '-p', '--parameters',
+            type=str,
+            nargs='*',
+            help="Display select parameters of the job's "
+                 "statepoint with the detailed view.")
+        parser.add_argument(
+            '--param-max-width',
+            type=int,
+            help="Limit the width of each parameter row.")
+        parser.add_argument(
+            '--skip-active',
+            action='store_true',
+            help="Display only jobs, which are currently not active.")
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=1000,
+            help="The number of rows per page of the detailed view.")
+
+
+def status(project=None, job_filter=None, scheduler=None, parameters=None, param_max_width=None,
+           skip_active=False, page_size=1000, pool=None, file=sys.stdout, err=sys.stderr, **kwargs):
+    """
+    Print the status of project, defaults to the project of the current directory.
 
-def status():
-    pass
+    :param job_filter: A filter (or its JSON encoding) that the jobs must match.
+    :param scheduler: If given, the status of the submitted jobs is updated
+        with a :class:`~.scheduler.StatusTracker` first.
+    :param kwargs: Forwarded to :meth:`Status.print_status`.
+    """
+    if project is None:
+        from .project import get_project
+        project = get_project()
+    if job_filter is not None and isinstance(job_filter, str):
+        job_filter = json.loads(job_filter)
+    if scheduler is not None:
+        print(Status._tr("Query scheduler..."), file=err)
+        project.status_tracker(scheduler).update()
+    view = Status(project, parameters=parameters, param_max_width=param_max_width,
+                  skip_active=skip_active, page_size=page_size)
+    view.print_status(jobs=project.find_jobs(job_filter), file=file, err=err, pool=pool, **kwargs)
+    return view
@@ -0,0 +1,211 @@
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from fluid.bundler import PackingBundler, JobBundle, JobArrayBundle, BundleRegistry
+from fluid.scheduler import ClusterJob, JobStatus
+
+
+class _Job(object):
+
+    def __init__(self, jid):
+        self._id = jid
+
+    def get_id(self):
+        return self._id
+
+    def __str__(self):
+        return self._id
+
+
+class _Operation(object):
+
+    def __init__(self, name):
+        self._name = name
+
+    def __str__(self):
+        return self._name
+
+    def format_script(self, project, job, nprocs=None, **kwargs):
+        return "echo {} {} {} # nprocs={}\n".format(self._name, job.get_id(), nprocs, nprocs)
+
+
+class _SubmitConfig(object):
+    nodes = None
+    ngpus = None
+
+    def __init__(self, nprocs, walltime=0):
+        self.nprocs = nprocs
+        self.walltime = walltime
+
+    def write_preamble(self, stream, name=None):
+        stream.write("#!/bin/sh\n")
+
+
+class _HostConfig(object):
+    mpi_cmd = None
+
+
+def _lanes(bundle):
+    return [(nprocs, [job.get_id() for job, op in jobops]) for nprocs, ngpus, jobops in bundle._lanes]
+
+
+class PackingBundlerTest(unittest.TestCase):
+
+    def _bundle(self, estimates, nprocs, walltime=0):
+        jobops = [(_Job(str(i)), _Operation('run')) for i in range(len(estimates))]
+        estimate = lambda job, op: estimates[int(job.get_id())]
+        return list(PackingBundler(estimate).bundle(_HostConfig(), _SubmitConfig(nprocs, walltime), jobops))
+
+    def test_concurrent_lanes_first(self):
+        bundles = self._bundle([dict(nprocs=8, walltime=60)] * 2, 32, walltime=3600)
+        self.assertEqual(len(bundles), 1)
+        self.assertEqual(_lanes(bundles[0]), [(8, ['0']), (8, ['1'])])
+
+    def test_concurrent_lanes_without_walltime(self):
+        bundles = self._bundle([dict(nprocs=1)] * 4, 32)
+        self.assertEqual(_lanes(bundles[0]), [(1, ['0']), (1, ['1']), (1, ['2']), (1, ['3'])])
+
+    def test_serial_within_walltime(self):
+        bundles = self._bundle([dict(nprocs=16, walltime=60)] * 5, 32, walltime=120)
+        self.assertEqual([_lanes(b) for b in bundles], [
+            [(16, ['0', '2']), (16, ['1', '3'])],
+            [(16, ['4'])]])
+
+    def test_smaller_after_larger(self):
+        bundles = self._bundle([dict(nprocs=24, walltime=60), dict(nprocs=8, walltime=60), dict(nprocs=16, walltime=10)], 32, walltime=120)
+        self.assertEqual(_lanes(bundles[0]), [(24, ['0', '2']), (8, ['1'])])
+
+
+class JobBundleDumpTest(unittest.TestCase):
+
+    def test_commands_with_comments(self):
+        jobops = [(_Job(str(i)), _Operation('run')) for i in range(3)]
+        lanes = [(2, None, jobops[:2]), (1, None, jobops[2:])]
+        script = JobBundle(jobops, lanes=lanes).dumps(_HostConfig(), _SubmitConfig(3), 'project')
+        output = subprocess.check_output(['sh', '-c', script]).decode().splitlines()
+        self.assertEqual(sorted(output), ['run 0 2', 'run 1 2', 'run 2 1'])
+
+
+
+class _Project(object):
+
+    def __init__(self, root):
+        self._root = root
+
+    def __str__(self):
+        return 'project'
+
+    def root_directory(self):
+        return self._root
+
+
+class _ScriptOperation(_Operation):
+    "Writes a script that prints the job id into a directory with a space in its name."
+
+    def write_script(self, project, job, **kwargs):
+        fn = os.path.join(project.root_directory(), 'work space', job.get_id(), 'run.sh')
+        os.makedirs(os.path.dirname(fn))
+        with open(fn, 'w') as f:
+            f.write('echo {}\n'.format(job.get_id()))
+        return fn
+
+
+class _ArraySubmitConfig(_SubmitConfig):
+    array_index_var = 'TASK_ID'
+
+    def write_preamble(self, stream, name=None):
+        stream.write("#PBS -N {}\n".format(name))
+
+    def write_array_range(self, stream, first, last):
+        stream.write("#PBS -t {}-{}\n".format(first, last))
+
+
+class JobArrayBundleTest(unittest.TestCase):
+
+    def test_posix_shell(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        jobs = [_Job('job{}'.format(i)) for i in range(3)]
+        bundle = JobArrayBundle(_ScriptOperation('run'), jobs)
+        script = bundle.dumps(_HostConfig(), _ArraySubmitConfig(1), _Project(root))
+        self.assertTrue(script.startswith('#!/bin/sh\n#PBS -N project-run-array-'))
+        for shell in ('sh', 'dash', 'bash'):
+            if shutil.which(shell) is None:
+                continue
+            env = dict(os.environ, TASK_ID='1')
+            output = subprocess.check_output([shell, '-c', script], env=env).decode()
+            self.assertEqual(output, 'job1\n')
+
+
+
+class _Jobs(object):
+    "A project that opens jobs by id."
+
+    def open_job(self, id):
+        return _Job(id)
+
+
+class BundleRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+        self.registry = BundleRegistry(os.path.join(self._dir, 'bundles', 'registry.sqlite'))
+        self.addCleanup(self.registry.close)
+        self.operations = dict(run=_Operation('run'), analyze=_Operation('analyze'))
+        self.jobops = [(_Job('a'), self.operations['run']), (_Job('b'), self.operations['analyze'])]
+
+    def _saved(self):
+        bundle = JobBundle(self.jobops, lanes=[(2, None, self.jobops)])
+        bundle.dumps(_HostConfig(), _SubmitConfig(4, walltime=60), 'project')
+        bundle.save(self.registry, _SubmitConfig(4, walltime=60))
+        return bundle
+
+    def test_round_trip(self):
+        bundle = self._saved()
+        self.assertIn(bundle.name(), self.registry)
+        loaded = JobBundle([])
+        loaded.load(self.registry, bundle.name(), _Jobs(), self.operations)
+        self.assertEqual(loaded.job_names(), ['a-run-project', 'b-analyze-project'])
+        self.assertEqual(loaded.resources(), dict(nprocs=4, ngpus=None, walltime=60))
+        self.assertEqual([(job.get_id(), str(op)) for job, op in loaded.jobops()], [('a', 'run'), ('b', 'analyze')])
+        self.assertIs(loaded.jobops()[1][1], self.operations['analyze'])
+
+    def test_load_names_only(self):
+        bundle = self._saved()
+        loaded = JobBundle([])
+        loaded.load(BundleRegistry(os.path.join(self._dir, 'bundles', 'registry.sqlite')), bundle.name())
+        self.assertEqual(loaded.job_names(), bundle.job_names())
+        self.assertEqual(loaded.jobops(), [])
+
+    def test_expand(self):
+        bundle = self._saved()
+        self.registry.register('array', [('x-run-project', 'x', 'run'), ('y-run-project', 'y', 'run')])
+        jobs = [ClusterJob('1', bundle.name(), JobStatus.active),
+                ClusterJob('2[1]', 'array-1', JobStatus.queued), # torque appends the index
+                ClusterJob('3_0', 'array', JobStatus.active),
+                ClusterJob('4', 'other', JobStatus.held)]
+        self.assertEqual([(j.id(), j.name(), j.status()) for j in self.registry.expand(jobs)], [
+            ('1', 'a-run-project', JobStatus.active),
+            ('1', 'b-analyze-project', JobStatus.active),
+            ('2[1]', 'y-run-project', JobStatus.queued),
+            ('3_0', 'x-run-project', JobStatus.active),
+            ('4', 'other', JobStatus.held)])
+
+    def test_compact(self):
+        bundle = self._saved()
+        self.registry.register('old', [('x-run-project', 'x', 'run')])
+        self.registry.register('done', [('y-run-project', 'y', 'run')])
+        self.registry.finish(['done'])
+        self.registry.compact(active=[bundle.name()])
+        self.assertIn(bundle.name(), self.registry)
+        self.assertNotIn('old', self.registry)
+        self.assertNotIn('done', self.registry)
+        self.assertEqual(self.registry.entries('old'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
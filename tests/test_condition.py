@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import signac
+
+from fluid.condition import _condition_key, FluidCondition, PersistentConditionCache, ConditionCache
+from fluid.project import FluidProject
+
+
+def _factory(threshold):
+    return lambda job: job.sp.a > threshold
+
+
+def _unserializable(value):
+    return lambda job: value is not None
+
+
+class ConditionKeyTest(unittest.TestCase):
+
+    def test_closures_of_same_factory(self):
+        self.assertNotEqual(_condition_key(_factory(1)), _condition_key(_factory(2)))
+        self.assertEqual(_condition_key(_factory(1)), _condition_key(_factory(1)))
+
+    def test_default_arguments(self):
+        keys = set(_condition_key(lambda job, n=n: n) for n in range(3))
+        self.assertEqual(len(keys), 3)
+
+    def test_unserializable_closure(self):
+        self.assertIsNone(_condition_key(_unserializable(object())))
+
+    def test_plain_function(self):
+        self.assertTrue(_condition_key(_factory).endswith(_factory.__qualname__ + ':12'))
+
+
+class ProjectTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._root)
+        signac.init_project(name='test', root=self._root)
+        self.project = FluidProject.get_project(root=self._root)
+        self.jobs = [self.project.open_job(dict(a=i)) for i in range(4)]
+        for job in self.jobs:
+            job.init()
+
+
+class PersistentConditionCacheTest(ProjectTestCase):
+
+    def test_closures_are_not_confused(self):
+        fn = os.path.join(self._root, 'conditions.json')
+        job = self.jobs[2]
+        with ConditionCache(PersistentConditionCache(fn)) as cache:
+            self.assertTrue(FluidCondition(_factory(1))(job, cache))
+        with ConditionCache(PersistentConditionCache(fn)) as cache:
+            self.assertTrue(FluidCondition(_factory(1))(job, cache))
+            self.assertFalse(FluidCondition(_factory(3))(job, cache))
+
+    def test_unserializable_not_stored(self):
+        fn = os.path.join(self._root, 'conditions.json')
+        persistent = PersistentConditionCache(fn)
+        with ConditionCache(persistent) as cache:
+            FluidCondition(_unserializable(object()))(self.jobs[0], cache)
+        self.assertFalse(os.path.isfile(fn))
+
+
+class NextOperationsTest(ProjectTestCase):
+
+    def setUp(self):
+        super(NextOperationsTest, self).setUp()
+        self.calls = []
+        def ready(job):
+            self.calls.append(job.get_id())
+            return job.sp.a % 2 == 0
+        done = lambda job: job.sp.a == 0
+        self.project.add_operation('run', 'echo run', pre=[ready], post=[done])
+        self.project.add_operation('analyze', 'echo analyze', pre=[ready])
+
+    def test_shared_condition_evaluated_once(self):
+        names = [op.name for op in self.project.next_operations(self.jobs[2])]
+        self.assertEqual(sorted(names), ['analyze', 'run'])
+        self.assertEqual(self.calls, [self.jobs[2].get_id()])
+
+    def test_eligible_operations(self):
+        eligible = self.project.eligible_operations(self.jobs)
+        self.assertEqual(eligible[self.jobs[0].get_id()], frozenset(['analyze']))
+        self.assertEqual(eligible[self.jobs[1].get_id()], frozenset())
+        self.assertEqual(eligible[self.jobs[2].get_id()], frozenset(['run', 'analyze']))
+        self.assertEqual(len(self.calls), len(self.jobs))
+
+    def test_next_operation(self):
+        self.assertEqual(self.project.next_operation(self.jobs[2]).name, 'run')
+        self.assertIsNone(self.project.next_operation(self.jobs[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from fluid.config.config import SubmitConfigCache, ComputeEnvironment, FlowConfig
+from fluid.config import slurm
+
+
+class SubmitConfigCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+        self._fn = os.path.join(self._dir, 'cache.json')
+
+    def test_copies(self):
+        cache = SubmitConfigCache()
+        state = dict(config=dict(nodes='1'), remainder='')
+        cache.set('a', state)
+        state['config']['nodes'] = '2'
+        self.assertEqual(cache.get('a')['config']['nodes'], '1')
+        cache.get('a')['config']['nodes'] = '3'
+        self.assertEqual(cache.get('a')['config']['nodes'], '1')
+
+    def test_save_once(self):
+        cache = SubmitConfigCache(self._fn)
+        cache.set('a', dict(x=1))
+        cache.set('b', dict(x=2))
+        self.assertFalse(os.path.isfile(self._fn))
+        cache.save()
+        mtime = os.stat(self._fn).st_mtime_ns
+        cache.set('a', dict(x=1))
+        cache.save()
+        self.assertEqual(os.stat(self._fn).st_mtime_ns, mtime)
+        self.assertEqual(SubmitConfigCache(self._fn).get('b'), dict(x=2))
+
+    def test_max_size(self):
+        cache = SubmitConfigCache(self._fn, max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual([cache.get(k) for k in 'abc'], [1, None, 3])
+        cache.save()
+        with open(self._fn) as f:
+            self.assertEqual(len(json.load(f)), 2)
+
+
+class FlowConfigCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+        self._fn = os.path.join(self._dir, 'cache.json')
+        self.addCleanup(FlowConfig._submit_caches.pop, os.path.abspath(self._fn), None)
+
+    def test_shared_cache(self):
+        first = FlowConfig(cache_file=self._fn)
+        second = FlowConfig(cache_file=os.path.relpath(self._fn))
+        self.assertIs(first._submit_cache, second._submit_cache)
+        first._submit_cache.set('a', 1)
+        second._submit_cache.set('b', 2)
+        second.save()
+        first.save()
+        self.assertEqual(SubmitConfigCache(self._fn).get('a'), 1)
+        self.assertEqual(SubmitConfigCache(self._fn).get('b'), 2)
+
+    def test_without_file(self):
+        self.assertIsNot(FlowConfig()._submit_cache, FlowConfig()._submit_cache)
+
+
+class SubmissionConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = ComputeEnvironment('test', dict(
+            pattern=None, mpicmd='mpirun -n {nprocs}', type=slurm.SLURMConfig.alias,
+            submitconf=dict(default=dict(partition='batch'))))
+
+    def test_cached_config_is_not_shared(self):
+        cache = SubmitConfigCache()
+        args = ('-N', '2', '--ntasks-per-node', '16', '-t', '1:00:00')
+        first = self.env.get_submission_config('default', args, cache=cache)
+        first.get_config()['nodes'] = '8'
+        second = self.env.get_submission_config('default', args, cache=cache)
+        self.assertEqual(second.get_config()['nodes'], '2')
+        self.assertEqual(second.get_config()['partition'], 'batch')
+        self.assertEqual(second.nprocs, 32)
+        self.assertEqual(second.walltime, 3600)
+
+
+if __name__ == '__main__':
+    unittest.main()
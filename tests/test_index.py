@@ -0,0 +1,70 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from fluid import index
+from fluid.index import StatepointIndex
+
+
+class StatepointIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self._ws = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._ws)
+        for i in range(4):
+            self._make_job('job{}'.format(i), dict(a=i, b=dict(c=i % 2)), dict(status=dict(run=i)))
+        self.index = StatepointIndex()
+        self.index.update(self._ws)
+
+    def _make_job(self, jid, statepoint, document):
+        os.mkdir(os.path.join(self._ws, jid))
+        with open(os.path.join(self._ws, jid, index.FN_STATEPOINT), 'w') as f:
+            json.dump(statepoint, f)
+        with open(os.path.join(self._ws, jid, index.FN_DOCUMENT), 'w') as f:
+            json.dump(document, f)
+
+    def test_lookups(self):
+        self.assertEqual(sorted(self.index.find_job_ids({'b': {'c': 1}})), ['job1', 'job3'])
+        self.assertEqual(self.index.lookup('a', 2), frozenset(['job2']))
+        self.assertEqual(self.index.get('job3', 'b.c'), 1)
+        self.assertEqual(self.index.status('job2', 'run'), 2)
+        self.assertEqual(list(self.index.match('b.c', 0, ['job0', 'job1', 'job2'])), [True, False, True])
+
+    def test_numbers(self):
+        self._make_job('float', dict(a=2.0, f=1.5), dict())
+        self._make_job('bool', dict(a=True), dict())
+        self.index.update(self._ws)
+        self.assertEqual(sorted(self.index.find_job_ids({'a': 2})), ['float', 'job2'])
+        self.assertEqual(sorted(self.index.find_job_ids({'a': 2.0})), ['float', 'job2'])
+        self.assertEqual(self.index.find_job_ids({'a': 1}), ['job1'])
+        self.assertEqual(self.index.find_job_ids({'a': True}), ['bool'])
+        self.assertEqual(self.index.find_job_ids({'f': 1.5}), ['float'])
+        self.assertEqual(list(self.index.match('a', 2.0, ['job2', 'float', 'bool'])), [True, True, False])
+
+    def test_unknown_job_ids(self):
+        self._make_job('new', dict(a=10), dict())
+        self.assertIsNone(self.index.get('new', 'a'))
+        self.assertEqual(self.index.get('new', 'a', default=-1), -1)
+        self.assertEqual(self.index.status('new', 'run'), 0)
+        self.assertEqual(list(self.index.match('a', 10, ['job0', 'new'])), [False, False])
+        self.assertEqual(list(self.index.match('a', 10, ['job0', 'new'], missing=True)), [False, True])
+        self.assertEqual(self.index.column('a', ['new'])[1].tolist(), [-1])
+        self.index.update(self._ws)
+        self.assertEqual(self.index.get('new', 'a'), 10)
+
+
+class StatepointIndexListTest(StatepointIndexTest):
+
+    def setUp(self):
+        self._np = index.np
+        index.np = None
+        super(StatepointIndexListTest, self).setUp()
+
+    def tearDown(self):
+        index.np = self._np
+
+
+if __name__ == '__main__':
+    unittest.main()
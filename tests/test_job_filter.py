@@ -0,0 +1,153 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from fluid import job_filter
+from fluid import index
+
+
+class _Job(object):
+
+    def __init__(self, jid, statepoint):
+        self._id = jid
+        self._statepoint = statepoint
+
+    def get_id(self):
+        return self._id
+
+    def statepoint(self):
+        return dict(self._statepoint)
+
+
+def _pairs():
+    jobs = [_Job(str(i), dict(a=i, b=dict(c=i % 2))) for i in range(6)]
+    return [(job, op) for job in jobs for op in ('run', 'analyze')]
+
+
+def _selected(f, pairs):
+    return set((job.get_id(), op) for job, op in f.job_ops(pairs))
+
+
+class JobFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pairs = _pairs()
+        self.even = job_filter.JobFilter(lambda job, op: job.statepoint()['a'] % 2 == 0)
+        self.run = job_filter.JobFilter(lambda job, op: op == 'run')
+
+    def expected(self, predicate):
+        return set((job.get_id(), op) for job, op in self.pairs if predicate(job, op))
+
+    def test_predicate(self):
+        self.assertEqual(_selected(self.run, self.pairs), self.expected(lambda job, op: op == 'run'))
+
+    def test_and(self):
+        self.assertEqual(
+            _selected(self.even & self.run, self.pairs),
+            self.expected(lambda job, op: job.statepoint()['a'] % 2 == 0 and op == 'run'))
+
+    def test_or(self):
+        self.assertEqual(
+            _selected(self.even | self.run, self.pairs),
+            self.expected(lambda job, op: job.statepoint()['a'] % 2 == 0 or op == 'run'))
+
+    def test_xor(self):
+        self.assertEqual(
+            _selected(self.even ^ self.run, self.pairs),
+            self.expected(lambda job, op: (job.statepoint()['a'] % 2 == 0) != (op == 'run')))
+
+    def test_invert(self):
+        self.assertEqual(_selected(~self.run, self.pairs), self.expected(lambda job, op: op != 'run'))
+        self.assertEqual(_selected(~~self.run, self.pairs), _selected(self.run, self.pairs))
+
+    def test_nested(self):
+        f = ~(self.even & self.run) | (self.run ^ self.even)
+        self.assertEqual(
+            _selected(f, self.pairs),
+            self.expected(lambda job, op: not (job.statepoint()['a'] % 2 == 0 and op == 'run')))
+
+    def test_statepoint(self):
+        f = job_filter.StatepointFilter({'b.c': 1}) & self.run
+        self.assertEqual(
+            _selected(f, self.pairs),
+            self.expected(lambda job, op: job.statepoint()['a'] % 2 == 1 and op == 'run'))
+
+    def test_statepoint_mixed_types(self):
+        values = [1, '1', 1.0, True, [1, 2], [1], [1, 2, 3], dict(c=1), None]
+        pairs = [(_Job(str(i), dict(x=v)), 'run') for i, v in enumerate(values)]
+        for value in (1, '1', True, [1, 2], dict(c=1), None):
+            f = job_filter.StatepointFilter({'x': value})
+            self.assertEqual(
+                _selected(f, pairs),
+                set((job.get_id(), op) for job, op in pairs if job.statepoint()['x'] == value),
+                "filter x={!r}".format(value))
+
+    def test_statepoint_lists(self):
+        pairs = [(_Job(str(i), dict(x=v)), 'run') for i, v in enumerate([[1, 2], [3, 4], [1, 2]])]
+        self.assertEqual(_selected(job_filter.StatepointFilter({'x': 1}), pairs), set())
+        self.assertEqual(_selected(job_filter.StatepointFilter({'x': [1, 2]}), pairs), set([('0', 'run'), ('2', 'run')]))
+
+    def test_statepoint_nested(self):
+        pairs = [(_Job(str(i), dict(x=dict(y=v))), 'run') for i, v in enumerate([1, 'a', [1]])]
+        self.assertEqual(_selected(job_filter.StatepointFilter({'x.y': 'a'}), pairs), set([('1', 'run')]))
+        self.assertEqual(_selected(job_filter.StatepointFilter({'x': {'y': 1}}), pairs), set([('0', 'run')]))
+
+    def test_statepoint_missing_key(self):
+        pairs = [(_Job('0', dict(x=1)), 'run'), (_Job('1', dict(y=1)), 'run')]
+        self.assertEqual(_selected(job_filter.StatepointFilter({'x': 1}), pairs), set([('0', 'run')]))
+        self.assertEqual(_selected(~job_filter.StatepointFilter({'x': 1}), pairs), set([('1', 'run')]))
+
+    def test_empty(self):
+        self.assertEqual(_selected(self.even & self.run, []), set())
+
+
+class IndexedStatepointFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self._ws = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._ws)
+        self.jobs = [_Job(str(i), sp) for i, sp in enumerate([dict(x=1), dict(x=2.0), dict(y=1)])]
+        for job in self.jobs:
+            self._write(job)
+        self.index = index.StatepointIndex()
+        self.index.update(self._ws)
+
+    def _write(self, job):
+        os.mkdir(os.path.join(self._ws, job.get_id()))
+        with open(os.path.join(self._ws, job.get_id(), index.FN_STATEPOINT), 'w') as f:
+            json.dump(job.statepoint(), f)
+
+    def _check(self, filter_map, pairs):
+        indexed = _selected(job_filter.StatepointFilter(filter_map, self.index), pairs)
+        self.assertEqual(indexed, _selected(job_filter.StatepointFilter(filter_map), pairs))
+        return indexed
+
+    def test_same_as_unindexed(self):
+        pairs = [(job, 'run') for job in self.jobs]
+        self.assertEqual(self._check({'x': 1}, pairs), set([('0', 'run')]))
+        self.assertEqual(self._check({'x': 2}, pairs), set([('1', 'run')]))
+        self.assertEqual(self._check({'x': 1.0}, pairs), set([('0', 'run')]))
+
+    def test_unindexed_jobs(self):
+        new = [_Job('3', dict(x=5)), _Job('4', dict(x=1)), _Job('5', dict())]
+        pairs = [(job, 'run') for job in self.jobs + new]
+        self.assertEqual(self._check({'x': 1}, pairs), set([('0', 'run'), ('4', 'run')]))
+        self.assertEqual(self._check({'x': 5}, pairs), set([('3', 'run')]))
+
+
+class JobFilterListTest(JobFilterTest):
+    "The same tests with the list masks used when numpy is not available."
+
+    def setUp(self):
+        self._np = job_filter.np
+        job_filter.np = None
+        super(JobFilterListTest, self).setUp()
+
+    def tearDown(self):
+        job_filter.np = self._np
+
+
+if __name__ == '__main__':
+    unittest.main()
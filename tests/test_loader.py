@@ -0,0 +1,82 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from fluid.ipython import loader
+
+
+class _Job(object):
+
+    def __init__(self, root, jid):
+        self._id = jid
+        self._ws = os.path.join(root, jid)
+        os.makedirs(self._ws)
+
+    def get_id(self):
+        return self._id
+
+    def workspace(self):
+        return self._ws
+
+
+class LoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._root)
+        self.cache_dir = os.path.join(self._root, 'cache')
+        self.jobs = [_Job(self._root, 'job{}'.format(i)) for i in range(3)]
+        for i, job in enumerate(self.jobs):
+            np.save(os.path.join(job.workspace(), 'x.npy'), np.arange(4) + i)
+            np.savez(os.path.join(job.workspace(), 'data.npz'), energy=np.ones(2) * i)
+
+    def test_npz_cached(self):
+        for _ in range(2):
+            batch = loader.load(self.jobs, 'data.npz', cache_dir=self.cache_dir)
+            self.assertEqual(batch.job_ids(), ['job0', 'job1', 'job2'])
+            self.assertEqual(batch['energy'].tolist(), [[0, 0], [1, 1], [2, 2]])
+            batch = loader.load(self.jobs, 'data.npz', cache_dir=self.cache_dir, mmap=True)
+            self.assertEqual([a.tolist() for a in batch['energy']], [[0, 0], [1, 1], [2, 2]])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 3)
+
+    def test_stacked_by_default(self):
+        batch = loader.load(self.jobs, 'x.npy')
+        self.assertEqual(batch['x'].shape, (3, 4))
+        batch = loader.load(self.jobs, 'data.npz')
+        self.assertEqual(batch['energy'].shape, (3, 2))
+        batch = loader.load(self.jobs, 'data.npz', stack=False)
+        self.assertIsInstance(batch['energy'], list)
+
+    def test_memory_mapped_not_stacked(self):
+        batch = loader.load(self.jobs, 'x.npy', mmap=True)
+        self.assertIsInstance(batch['x'], list)
+        self.assertTrue(all(isinstance(a, np.memmap) for a in batch['x']))
+
+    def test_stale_entries_removed(self):
+        fn = os.path.join(self.jobs[0].workspace(), 'data.npz')
+        loader.load(self.jobs[:1], 'data.npz', cache_dir=self.cache_dir)
+        np.savez(fn, energy=np.ones(3))
+        st = os.stat(fn)
+        os.utime(fn, (st.st_atime, st.st_mtime + 10))
+        batch = loader.load(self.jobs[:1], 'data.npz', cache_dir=self.cache_dir)
+        self.assertEqual(batch['energy'].tolist(), [[1, 1, 1]])
+        entries = os.listdir(self.cache_dir)
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(len(os.listdir(os.path.join(self.cache_dir, entries[0]))), 1)
+
+    def test_requires_numpy(self):
+        np_ = loader.np
+        loader.np = None
+        try:
+            with self.assertRaises(RuntimeError):
+                loader.load(self.jobs, 'data.npz')
+        finally:
+            loader.np = np_
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+
+from fluid import parameter
+from fluid.parameter import FluidParams
+
+
+class _Document(dict):
+
+    def __call__(self):
+        return self
+
+
+class _Job(object):
+
+    def __init__(self, **document):
+        self.document = _Document(document)
+
+
+class _Params(FluidParams):
+    defaults = dict(value=0, shape=[1, 1])
+
+
+class GetValuesTest(unittest.TestCase):
+
+    def _values(self, name, *values):
+        jobs = [_Job(**{name: value}) for value in values]
+        return _Params.get_values(jobs, [name])[name]
+
+    def test_numbers(self):
+        column = self._values('value', 1, 0.5)
+        self.assertEqual(column.dtype, np.float64)
+        self.assertEqual(column.tolist(), [1.0, 0.5])
+
+    def test_defaults(self):
+        column = _Params.get_values([_Job(), _Job(value=2)], ['value'])['value']
+        self.assertEqual(column.tolist(), [0, 2])
+
+    def test_mixed_types(self):
+        column = self._values('value', 1, 'a')
+        self.assertEqual(column.dtype, object)
+        self.assertEqual(column.tolist(), [1, 'a'])
+
+    def test_sequences(self):
+        column = self._values('shape', [1, 2], [3, 4])
+        self.assertEqual(column.shape, (2, 2))
+        column = self._values('shape', [1, 2], [3])
+        self.assertEqual(column.dtype, object)
+        self.assertEqual(column.tolist(), [[1, 2], [3]])
+        column = self._values('shape', [1, 2], [3, 'a'])
+        self.assertEqual(column.dtype, object)
+        self.assertEqual(column.tolist(), [[1, 2], [3, 'a']])
+
+    def test_without_numpy(self):
+        np = parameter.np
+        parameter.np = None
+        try:
+            self.assertEqual(self._values('value', 1, 'a'), [1, 'a'])
+        finally:
+            parameter.np = np
+
+
+if __name__ == '__main__':
+    unittest.main()
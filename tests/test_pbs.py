@@ -0,0 +1,112 @@
+import io
+import os
+import datetime
+import unittest
+
+from fluid.config.pbs import PBSConfig, NodeSpec, parse_qsub_args, parse_walltime, parse_memory
+from fluid.scheduler import JobStatus
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class JobStatusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = PBSConfig('localhost', 'test')
+
+    def test_qstat(self):
+        with open(os.path.join(FIXTURES, 'qstat-fx-t.xml'), 'rb') as f:
+            records = list(self.config.job_status(f))
+        self.assertEqual(records, [
+            ('4810.pbs01', 'c0b1a2d3e4f5a6b7c8d9e0f1a2b3c4d5-run-project', JobStatus.active),
+            ('4811.pbs01', 'analyze & plot', JobStatus.queued),
+            ('4812.pbs01', 'held', JobStatus.held),
+            ('4813.pbs01', 'finished', JobStatus.inactive),
+            ('4814[].pbs01', 'project-run-array-5f2c', JobStatus.active),
+            ('4814[0].pbs01', 'project-run-array-5f2c', JobStatus.inactive),
+            ('4814[1].pbs01', 'project-run-array-5f2c', JobStatus.active),
+            ('4814[2].pbs01', 'project-run-array-5f2c', JobStatus.queued),
+            ('4815.pbs01', 'new-state', JobStatus.registered)])
+
+    def test_streaming(self):
+        "Jobs are yielded before the end of the output."
+        with open(os.path.join(FIXTURES, 'qstat-fx-t.xml'), 'rb') as f:
+            data = f.read()
+        truncated = data[:data.index(b'<Job><Job_Id>4812')]
+        records = self.config.job_status(io.BytesIO(truncated))
+        self.assertEqual(next(records)[0], '4810.pbs01')
+        self.assertEqual(next(records)[0], '4811.pbs01')
+
+    def test_empty_queue(self):
+        self.assertEqual(list(self.config.job_status(io.BytesIO(b''))), [])
+        self.assertEqual(list(self.config.job_status(io.BytesIO(b'<?xml version="1.0"?>\n<Data></Data>'))), [])
+
+
+
+class ParseQsubArgsTest(unittest.TestCase):
+
+    def test_nodes(self):
+        spec = parse_qsub_args('-l nodes=2:ppn=4:gpus=1')
+        self.assertEqual(spec.resources, (('nodes', (NodeSpec(2, None, 4, 1, None),)),))
+        self.assertEqual(spec.options, ())
+        self.assertEqual(spec.remainder, ())
+
+    def test_node_list(self):
+        spec = parse_qsub_args('-l nodes=node01:ppn=2:bigmem+3')
+        self.assertEqual(dict(spec.resources)['nodes'], (
+            NodeSpec(None, 'node01', 2, None, ('bigmem',)), NodeSpec(3, None, None, None, None)))
+
+    def test_repeated_resources(self):
+        spec = parse_qsub_args(('-l', 'nodes=1:ppn=8', '-lwalltime=01:30:00,mem=4gb', '-l', 'pmem=512mb'))
+        self.assertEqual([name for name, value in spec.resources], ['nodes', 'walltime', 'mem', 'pmem'])
+        self.assertEqual(dict(spec.resources)['walltime'], '01:30:00')
+
+    def test_options(self):
+        spec = parse_qsub_args('-N name -M a@b -V -M c@d -q batch script.sh -l ignored')
+        self.assertEqual(spec.options, (('M', ('a@b', 'c@d')), ('N', 'name'), ('V', True), ('q', 'batch')))
+        self.assertEqual(spec.remainder, ('script.sh', '-l', 'ignored'))
+
+    def test_memoized(self):
+        self.assertIs(parse_qsub_args('-l nodes=1:ppn=2'), parse_qsub_args('-l nodes=1:ppn=2'))
+        self.assertEqual(parse_qsub_args(('-l', 'nodes=1:ppn=2')), parse_qsub_args('-l nodes=1:ppn=2'))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parse_qsub_args, '-l nodes')
+        self.assertRaises(ValueError, parse_qsub_args, '-l nodes=1:ppn=x')
+        self.assertRaises(ValueError, parse_qsub_args, '-N')
+
+
+class ParseWalltimeTest(unittest.TestCase):
+
+    def test_formats(self):
+        self.assertEqual(parse_walltime('01:30:00'), datetime.timedelta(hours=1, minutes=30))
+        self.assertEqual(parse_walltime('2:00:00:05'), datetime.timedelta(days=2, seconds=5))
+        self.assertEqual(parse_walltime('10:30'), datetime.timedelta(minutes=10, seconds=30))
+        self.assertEqual(parse_walltime('90.5'), datetime.timedelta(seconds=90.5))
+
+    def test_invalid(self):
+        for walltime in ('', 'one hour', '1:2:3:4:5', '1h'):
+            self.assertRaises(ValueError, parse_walltime, walltime)
+
+
+class ParseMemoryTest(unittest.TestCase):
+
+    def test_units(self):
+        self.assertEqual(parse_memory('100'), 100)
+        self.assertEqual(parse_memory('100b'), 100)
+        self.assertEqual(parse_memory('2kb'), 2048)
+        self.assertEqual(parse_memory('512MB'), 512 * 1024**2)
+        self.assertEqual(parse_memory('4gb'), 4 * 1024**3)
+        self.assertEqual(parse_memory('1tb'), 1024**4)
+
+    def test_words(self):
+        self.assertEqual(parse_memory('1w'), 8)
+        self.assertEqual(parse_memory('2mw'), 2 * 8 * 1024**2)
+
+    def test_invalid(self):
+        for memory in ('', 'gb', '1.5gb', '2pb', '-1kb'):
+            self.assertRaises(ValueError, parse_memory, memory)
+
+
+if __name__ == '__main__':
+    unittest.main()
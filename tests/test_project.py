@@ -0,0 +1,102 @@
+import gc
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import signac
+
+from fluid.project import FluidProject, FluidOperation, get_project, _write_atomic
+from fluid.formatter import ScriptFormatter
+
+
+class WriteAtomicTest(unittest.TestCase):
+
+    def test_concurrent_writes(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        fn = os.path.join(root, 'sub', 'file.txt')
+        contents = ['x' * 10000 + str(i) for i in range(32)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda content: _write_atomic(fn, content), contents))
+        with open(fn) as f:
+            self.assertIn(f.read(), contents)
+        self.assertEqual(os.listdir(os.path.dirname(fn)), ['file.txt'])
+
+    def test_mode(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        fn = os.path.join(root, 'file.txt')
+        umask = os.umask(0o022)
+        try:
+            _write_atomic(fn, 'content')
+        finally:
+            os.umask(umask)
+        self.assertEqual(os.stat(fn).st_mode & 0o777, 0o644)
+
+
+class GetProjectTest(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._root)
+        signac.init_project(name='test', root=self._root)
+        self.addCleanup(gc.collect) # drops the project classes defined by the tests
+
+    def test_base_class(self):
+        project = get_project(root=self._root)
+        self.assertIs(type(project), FluidProject)
+        self.assertEqual(project.root_directory(), self._root)
+
+    def test_subclass(self):
+        class Base(FluidProject):
+            pass
+        class MyProject(Base):
+            pass
+        self.assertIs(type(get_project(root=self._root)), MyProject)
+        self.assertIs(type(get_project(root=self._root, alias='MyProject')), MyProject)
+        with self.assertRaises(LookupError):
+            get_project(root=self._root, alias='Base')
+
+    def test_ambiguous(self):
+        class One(FluidProject):
+            pass
+        class Two(FluidProject):
+            pass
+        with self.assertRaises(LookupError):
+            get_project(root=self._root)
+        self.assertIs(type(get_project(root=self._root, alias='Two')), Two)
+
+
+class WriteScriptTest(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._root)
+        signac.init_project(name='test', root=self._root)
+        self.project = FluidProject.get_project(root=self._root)
+        self.job = self.project.open_job(dict(a=1))
+        self.job.init()
+        self.operation = FluidOperation(
+            None, None, 'run {statepoint[a]} {job.document[steps]}', ScriptFormatter(), name='run')
+
+    def _read(self, fn):
+        with open(fn) as f:
+            return f.read()
+
+    def test_index_tracks_document(self):
+        index = self.project.script_index()
+        self.job.document['steps'] = 10
+        fn = self.operation.write_script(self.project, self.job, index=index)
+        self.assertEqual(self._read(fn), 'run 1 10\n')
+        self.assertEqual(self.operation.write_script(self.project, self.job, index=index), fn)
+        self.job.document['steps'] = 20
+        self.operation.write_script(self.project, self.job, index=index)
+        self.assertEqual(self._read(fn), 'run 1 20\n')
+        index.save()
+        self.assertIsNotNone(self.project.script_index().get(self.job, self.operation))
+
+
+if __name__ == '__main__':
+    unittest.main()
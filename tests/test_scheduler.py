@@ -0,0 +1,243 @@
+import os
+import io
+import stat
+import subprocess
+import shutil
+import tempfile
+import json
+import unittest
+import contextlib
+
+from fluid.scheduler import Scheduler
+from fluid.config.pbs import PBSConfig
+from fluid.config.slurm import SLURMConfig
+
+# Submits scripts that contain FAIL with a permanent error, scripts that contain
+# FLAKY with a transient error on the first attempt, and logs every call.
+QSUB = """#!/bin/sh
+echo "$@" >> "{log}"
+if grep -q FAIL "$1"; then
+    echo "qsub: Unauthorized Request" >&2
+    exit 1
+fi
+if grep -q FLAKY "$1" && [ ! -e "{flag}" ]; then
+    touch "{flag}"
+    echo "qsub: Server too busy, try again" >&2
+    exit 1
+fi
+if grep -q SLOW "$1" && [ ! -e "{slow}" ]; then
+    touch "{slow}"
+    exec sleep 5
+fi
+echo "$(wc -l < "{log}").server"
+"""
+
+# Prints the queue file, fails if it does not exist.
+QSTAT = """#!/bin/sh
+exec cat "{queue}"
+"""
+
+
+class SubmitManyTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+        self._log = os.path.join(self._dir, 'qsub.log')
+        fn = os.path.join(self._dir, 'qsub')
+        with open(fn, 'w') as f:
+            f.write(QSUB.format(log=self._log, flag=os.path.join(self._dir, 'flaky'),
+                                slow=os.path.join(self._dir, 'slow')))
+        os.chmod(fn, os.stat(fn).st_mode | stat.S_IEXEC)
+        self._queue = os.path.join(self._dir, 'queue.xml')
+        fn = os.path.join(self._dir, 'qstat')
+        with open(fn, 'w') as f:
+            f.write(QSTAT.format(queue=self._queue))
+        os.chmod(fn, os.stat(fn).st_mode | stat.S_IEXEC)
+        self._path = os.environ['PATH']
+        os.environ['PATH'] = self._dir + os.pathsep + self._path
+        self.scheduler = Scheduler(PBSConfig('localhost', 'test'))
+
+    def tearDown(self):
+        os.environ['PATH'] = self._path
+
+    def _calls(self):
+        if not os.path.isfile(self._log):
+            return []
+        with open(self._log) as f:
+            return f.read().splitlines()
+
+    def test_retries_and_partial_failure(self):
+        scripts = ['echo ok', 'echo FLAKY', 'echo FAIL', io.StringIO('echo ok')]
+        results = self.scheduler.submit_many(scripts, concurrency=2, retries=2, backoff=0.01)
+        self.assertEqual([r.index() for r in results], [0, 1, 2, 3])
+        self.assertEqual([r.ok() for r in results], [True, True, False, True])
+        self.assertEqual([r.attempts() for r in results], [1, 2, 1, 1])
+        self.assertTrue(all(r.jobid().endswith('.server') for r in results if r.ok()))
+        self.assertIn('Unauthorized', results[2].error().stderr.decode())
+        self.assertEqual(len(self._calls()), 5)
+
+    def test_retries_exhausted(self):
+        results = self.scheduler.submit_many(['echo FLAKY'], retries=0)
+        self.assertFalse(results[0].ok())
+        self.assertEqual(results[0].attempts(), 1)
+
+    def set_queue(self, names):
+        with open(self._queue, 'w') as f:
+            f.write('<Data>{}</Data>'.format(''.join(
+                '<Job><Job_Id>{}.server</Job_Id><Job_Name>{}</Job_Name><job_state>Q</job_state></Job>'.format(
+                    100 + i, name) for i, name in enumerate(names))))
+
+    def test_timeout_not_retried(self):
+        results = self.scheduler.submit_many(['echo SLOW'], timeout=0.5, backoff=0.01)
+        self.assertFalse(results[0].ok())
+        self.assertIsInstance(results[0].error(), subprocess.TimeoutExpired)
+        self.assertEqual(results[0].attempts(), 1)
+        self.assertEqual(len(self._calls()), 1)
+
+    def test_timeout_queued(self):
+        self.set_queue(['other', 'slow-run-project'])
+        results = self.scheduler.submit_many(
+            ['echo SLOW'], timeout=0.5, backoff=0.01, names=['slow-run-project'])
+        self.assertEqual(results[0].jobid(), '101.server')
+        self.assertEqual(results[0].attempts(), 1)
+        self.assertEqual(len(self._calls()), 1)
+
+    def test_timeout_retried(self):
+        self.set_queue(['other'])
+        results = self.scheduler.submit_many(
+            ['echo SLOW', 'echo ok'], timeout=0.5, backoff=0.01, names=['slow-run-project', 'ok-run-project'])
+        self.assertEqual([r.ok() for r in results], [True, True])
+        self.assertEqual(results[0].attempts(), 2)
+        self.assertEqual(len(self._calls()), 3)
+
+    def test_timeout_queue_unknown(self):
+        results = self.scheduler.submit_many(
+            ['echo SLOW'], timeout=0.5, backoff=0.01, names=['slow-run-project'])
+        self.assertIsInstance(results[0].error(), subprocess.TimeoutExpired)
+        self.assertEqual(len(self._calls()), 1)
+
+    def test_pretend(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            results = self.scheduler.submit_many(['echo a', 'echo FAIL'], pretend=True, remainder='-q debug')
+        self.assertEqual([r.jobid() for r in results], ['pretend-0', 'pretend-1'])
+        self.assertEqual(self._calls(), [])
+        self.assertEqual(out.getvalue().count('# Submit command: qsub -q debug '), 2)
+        self.assertIn('echo FAIL', out.getvalue())
+
+
+# Prints the jobs in the fixture file and logs the call, fails if the exit file exists.
+SQUEUE = """#!/bin/sh
+echo "$@" >> "{log}"
+if [ -e "{exit}" ]; then
+    exit 1
+fi
+cat "{fixture}"
+"""
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+        self._log = os.path.join(self._dir, 'squeue.log')
+        self._exit = os.path.join(self._dir, 'exit')
+        self._fixture = os.path.join(self._dir, 'squeue.txt')
+        self.cache_dir = os.path.join(self._dir, 'cache')
+        fn = os.path.join(self._dir, 'squeue')
+        with open(fn, 'w') as f:
+            f.write(SQUEUE.format(log=self._log, exit=self._exit, fixture=self._fixture))
+        os.chmod(fn, os.stat(fn).st_mode | stat.S_IEXEC)
+        self._path = os.environ['PATH']
+        os.environ['PATH'] = self._dir + os.pathsep + self._path
+        Scheduler._snapshots.clear()
+        self.addCleanup(Scheduler._snapshots.clear)
+        self.set_jobs(['1|a|R'])
+
+    def tearDown(self):
+        os.environ['PATH'] = self._path
+
+    def set_jobs(self, lines):
+        with open(self._fixture, 'w') as f:
+            f.write(''.join(line + '\n' for line in lines))
+
+    def queries(self):
+        if not os.path.isfile(self._log):
+            return 0
+        with open(self._log) as f:
+            return len(f.read().splitlines())
+
+    def scheduler(self, **kwargs):
+        return Scheduler(SLURMConfig('localhost', 'test'), **kwargs)
+
+    def ids(self, scheduler, **kwargs):
+        return [job.id() for job in scheduler.jobs(user='someone', **kwargs)]
+
+    def age(self, seconds):
+        "Make the snapshots seconds older."
+        for cmd, (t, records) in list(Scheduler._snapshots.items()):
+            Scheduler._snapshots[cmd] = (t - seconds, records)
+        for name in os.listdir(self.cache_dir) if os.path.isdir(self.cache_dir) else ():
+            if name.endswith('.json'):
+                fn = os.path.join(self.cache_dir, name)
+                with open(fn) as f:
+                    data = json.load(f)
+                data['time'] -= seconds
+                with open(fn, 'w') as f:
+                    json.dump(data, f)
+
+    def test_reuse_across_instances(self):
+        self.assertEqual(self.ids(self.scheduler()), ['1'])
+        self.set_jobs(['2|b|R'])
+        self.assertEqual(self.ids(self.scheduler()), ['1'])
+        self.assertEqual(self.queries(), 1)
+
+    def test_reuse_across_processes(self):
+        self.ids(self.scheduler(cache_dir=self.cache_dir))
+        Scheduler._snapshots.clear() # as in a new process
+        self.assertEqual(self.ids(self.scheduler(cache_dir=self.cache_dir)), ['1'])
+        self.assertEqual(self.queries(), 1)
+
+    def test_expiry(self):
+        scheduler = self.scheduler(ttl=30)
+        self.ids(scheduler)
+        self.set_jobs(['2|b|R'])
+        self.assertEqual(self.ids(scheduler, refresh=True), ['1']) # within the dos timeout
+        self.age(20)
+        self.assertEqual(self.ids(scheduler), ['1'])
+        self.assertEqual(self.ids(scheduler, refresh=True), ['2'])
+        self.age(40)
+        self.set_jobs(['3|c|R'])
+        self.assertEqual(self.ids(scheduler), ['3'])
+        self.assertEqual(self.queries(), 3)
+
+    def test_failed_query(self):
+        scheduler = self.scheduler(ttl=30, max_age=600)
+        self.ids(scheduler)
+        open(self._exit, 'w').close()
+        self.age(60)
+        self.assertEqual(self.ids(scheduler), ['1'])
+        self.age(600)
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.ids(scheduler)
+
+    def test_corrupted_snapshot(self):
+        scheduler = self.scheduler(cache_dir=self.cache_dir)
+        self.ids(scheduler)
+        Scheduler._snapshots.clear()
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                with open(os.path.join(self.cache_dir, name), 'w') as f:
+                    f.write('{"time": ')
+        self.set_jobs(['2|b|R'])
+        self.assertEqual(self.ids(scheduler), ['2'])
+        self.assertEqual(self.queries(), 2)
+        Scheduler._snapshots.clear()
+        self.assertEqual(self.ids(scheduler), ['2']) # the snapshot was written again
+        self.assertEqual(self.queries(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+import io
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+
+import signac
+
+from fluid.config.slurm import SLURMConfig
+from fluid.bundler import PackingBundler
+from fluid.project import FluidProject
+from fluid.scheduler import Scheduler, StatusTracker, JobStatus, make_submit_name
+
+SQUEUE = """\
+101|pending|PD
+102|running|R
+103_4|array|R
+104|held|S
+105|completing|CG
+106|name|with|bars|PD
+107|unknown|XX
+short|line
+"""
+
+SACCT = """\
+101|pending|PENDING
+102|running|COMPLETED
+102.batch|batch|COMPLETED
+102.0|step|COMPLETED
+108|timeout|TIMEOUT
+109|cancelled|CANCELLED by 1000
+110_2|array|FAILED
+111|oom|OUT_OF_MEMORY
+112|requeued|REQUEUED
+"""
+
+# Prints the fixture file of the command and logs the arguments.
+COMMAND = """#!/bin/sh
+echo "$@" >> "{log}"
+cat "{fixture}"
+"""
+
+
+class JobStatusTest(unittest.TestCase):
+
+    def _parse(self, output):
+        config = SLURMConfig('localhost', 'test')
+        return [(i, n, s) for i, n, s in config.job_status(io.BytesIO(output.encode()))]
+
+    def test_squeue(self):
+        self.assertEqual(self._parse(SQUEUE), [
+            ('101', 'pending', JobStatus.queued),
+            ('102', 'running', JobStatus.active),
+            ('103_4', 'array', JobStatus.active),
+            ('104', 'held', JobStatus.held),
+            ('105', 'completing', JobStatus.active),
+            ('106', 'name|with|bars', JobStatus.queued),
+            ('107', 'unknown', JobStatus.registered)])
+
+    def test_sacct(self):
+        self.assertEqual(self._parse(SACCT), [
+            ('101', 'pending', JobStatus.queued),
+            ('102', 'running', JobStatus.inactive),
+            ('108', 'timeout', JobStatus.error),
+            ('109', 'cancelled', JobStatus.inactive),
+            ('110_2', 'array', JobStatus.error),
+            ('111', 'oom', JobStatus.error),
+            ('112', 'requeued', JobStatus.queued)])
+
+    def test_empty(self):
+        self.assertEqual(self._parse(''), [])
+
+
+class ParseArgsTest(unittest.TestCase):
+
+    def _config(self, *args):
+        config = SLURMConfig('localhost', 'test')
+        config.parse_args(args)
+        return config
+
+    def test_gpus_without_nodes(self):
+        config = self._config('--ntasks=4', '--gpus=4')
+        self.assertEqual((config.nodes, config.ppn, config.gpn), ([1], [4], [4]))
+        self.assertEqual((config.nprocs, config.ngpus), (4, 4))
+        self.assertEqual(PackingBundler._layout(config), [(4, 4)])
+
+    def test_gpus_per_node(self):
+        config = self._config('-N', '2', '--ntasks', '8', '--gpus', '4')
+        self.assertEqual((config.nodes, config.ppn, config.gpn), ([2], [4], [2]))
+        self.assertEqual((config.nprocs, config.ngpus), (8, 4))
+        self.assertEqual(PackingBundler._layout(config), [(4, 2), (4, 2)])
+
+    def test_gres(self):
+        config = self._config('--gres=gpu:2', '-n', '2')
+        self.assertEqual((config.nprocs, config.ngpus), (2, 2))
+
+
+class FakeSlurmTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+        for name in ('squeue', 'sacct'):
+            fn = os.path.join(self._dir, name)
+            with open(fn, 'w') as f:
+                f.write(COMMAND.format(log=self._log(name), fixture=self._fixture(name)))
+            os.chmod(fn, os.stat(fn).st_mode | stat.S_IEXEC)
+        self._path = os.environ['PATH']
+        os.environ['PATH'] = self._dir + os.pathsep + self._path
+        self.addCleanup(Scheduler._snapshots.clear)
+        Scheduler._snapshots.clear()
+        self.scheduler = Scheduler(SLURMConfig('localhost', 'test'))
+
+    def tearDown(self):
+        os.environ['PATH'] = self._path
+
+    def _log(self, name):
+        return os.path.join(self._dir, name + '.log')
+
+    def _fixture(self, name):
+        return os.path.join(self._dir, name + '.txt')
+
+    def write_fixture(self, name, content):
+        with open(self._fixture(name), 'w') as f:
+            f.write(content)
+
+    def calls(self, name):
+        if not os.path.isfile(self._log(name)):
+            return []
+        with open(self._log(name)) as f:
+            return f.read().splitlines()
+
+
+class SchedulerTest(FakeSlurmTestCase):
+
+    def test_jobs(self):
+        self.write_fixture('squeue', SQUEUE)
+        jobs = self.scheduler.jobs(user='someone', refresh=True)
+        self.assertEqual([(j.id(), j.status()) for j in jobs][:3], [
+            ('101', JobStatus.queued), ('102', JobStatus.active), ('103_4', JobStatus.active)])
+        self.assertIn('--user someone', self.calls('squeue')[0])
+
+    def test_history(self):
+        self.write_fixture('sacct', SACCT)
+        jobs = self.scheduler.history(0, user='someone')
+        self.assertEqual(len(jobs), 7)
+        self.assertIn('--starttime 19', self.calls('sacct')[0])
+
+
+class StatusTrackerTest(FakeSlurmTestCase):
+
+    def setUp(self):
+        super(StatusTrackerTest, self).setUp()
+        signac.init_project(name='test', root=self._dir)
+        self.project = FluidProject.get_project(root=self._dir)
+        self.jobs = [self.project.open_job(dict(a=i)) for i in range(3)]
+        for job in self.jobs:
+            job.init()
+        self.names = [make_submit_name('run', job, self.project) for job in self.jobs]
+
+    def test_jobs_only_in_sacct(self):
+        tracker = StatusTracker(self.scheduler, self.project)
+        self.write_fixture('squeue', "1|{}|PD\n2|other-run-project|R\n".format(self.names[0]))
+        changes = tracker.update()
+        self.assertEqual(changes, {self.names[0]: (None, JobStatus.queued)})
+
+        # job 1 finished and jobs 2 and 3 started and ended between the polls.
+        self.write_fixture('sacct', "1|{}|COMPLETED\n1.batch|batch|COMPLETED\n"
+                           "3|{}|FAILED\n4|{}|COMPLETED\n".format(*self.names))
+        tracker = StatusTracker(self.scheduler, self.project)
+        changes = tracker.update()
+        self.assertEqual(len(self.calls('sacct')), 1)
+        self.assertEqual(changes, {
+            self.names[0]: (JobStatus.queued, JobStatus.inactive),
+            self.names[1]: (None, JobStatus.error),
+            self.names[2]: (None, JobStatus.inactive)})
+        self.assertEqual(self.jobs[1].document['status'], {self.names[1]: int(JobStatus.error)})
+        self.assertIsNone(tracker.status(self.names[2]))
+
+
+if __name__ == '__main__':
+    unittest.main()